@@ -0,0 +1,91 @@
+import argparse
+import os
+import random
+import sys
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.aave.aggregation import RAY_DECIMALS, DailyAggregator, aggregate_data_by_date  # noqa: E402
+from src.aave.utils import annualize_rate, effective_daily_rate  # noqa: E402
+
+FIRST_TIMESTAMP = 1672531200  # 2023-01-01
+PAGE_SIZE = 1000
+
+
+def synthetic_events(count, days, seed=0):
+    """ Events shaped like the subgraph JSON (rates as strings), spread evenly over `days` days """
+    rng = random.Random(seed)
+    step = days * 86400 / count
+    return [{
+        "id": f"0x{rng.getrandbits(256):064x}:{i % 300}",
+        "timestamp": FIRST_TIMESTAMP + int(i * step),
+        "reserve": {
+            "stableBorrowRate": str(rng.randint(10 ** 25, 2 * 10 ** 26)),
+            "variableBorrowRate": str(rng.randint(10 ** 25, 2 * 10 ** 26)),
+            "utilizationRate": str(rng.random()),
+            "lastUpdateTimestamp": FIRST_TIMESTAMP + int(i * step),
+        },
+    } for i in range(count)]
+
+
+def previous_aggregate_data_by_date(data):
+    """ The aggregation this replaces: a per-row apply to unpack the reserves, then a groupby per statistic and a merge """
+    df = pd.DataFrame(data)
+    df['date'] = pd.to_datetime(df['timestamp'], unit='s').dt.strftime('%Y-%m-%d')
+    reserve_df = df['reserve'].apply(pd.Series)
+    df['stableBorrowRate'] = reserve_df['stableBorrowRate'].astype(float) / RAY_DECIMALS
+    df['variableBorrowRate'] = reserve_df['variableBorrowRate'].astype(float) / RAY_DECIMALS
+    df['utilizationRate'] = reserve_df['utilizationRate'].astype(float)
+    df_min = df.groupby('date')[['stableBorrowRate', 'variableBorrowRate', 'utilizationRate']].min()
+    df_max = df.groupby('date')[['stableBorrowRate', 'variableBorrowRate', 'utilizationRate']].max()
+    df_min.columns = [f"{col}_min" for col in df_min.columns]
+    df_max.columns = [f"{col}_max" for col in df_max.columns]
+    return pd.merge(df_min, df_max, on='date').reset_index()
+
+
+def timed(name, count, function, unit="events"):
+    start = time.perf_counter()
+    result = function()
+    elapsed = time.perf_counter() - start
+    print(f"{name:<45} {elapsed:8.2f} s {count / elapsed:12,.0f} {unit}/s")
+    return result
+
+
+def run():
+    parser = argparse.ArgumentParser(description='Measure the throughput of the Aave daily aggregation on synthetic events.')
+    parser.add_argument('--events', type=int, help='Number of synthetic events', default=1_000_000)
+    parser.add_argument('--days', type=int, help='Number of days the events are spread over', default=730)
+    parser.add_argument('--previous-events', type=int, help='Number of events given to the previous aggregation, which is much slower (0 to skip)', default=50_000)
+    args = parser.parse_args()
+
+    events = synthetic_events(args.events, args.days)
+    print(f"{args.events:,} events over {args.days} days")
+
+    aggregated = timed("one pass aggregation", args.events, lambda: aggregate_data_by_date(events))
+
+    def fold_pages():
+        aggregator = DailyAggregator()
+        for i in range(0, len(events), PAGE_SIZE):
+            aggregator.add(events[i:i + PAGE_SIZE])
+        return aggregator.to_frame()
+    folded = timed(f"streaming fold of {PAGE_SIZE} event pages", args.events, fold_pages)
+    assert folded.equals(aggregated), "The streaming fold and the one pass aggregation differ"
+
+    def compound():
+        daily = effective_daily_rate(aggregated['variableBorrowRate_max'])
+        return annualize_rate(daily)
+    annual = timed("daily compounding and annualization", len(aggregated), compound, unit="days")
+    assert annual.notna().all() and (annual < 1).all(), "Annualized rates of rates below 20% must stay below 100%"
+
+    if args.previous_events:
+        subset = events[:args.previous_events]
+        previous = timed(f"previous aggregation ({args.previous_events:,} events)", args.previous_events, lambda: previous_aggregate_data_by_date(subset))
+        current = aggregate_data_by_date(subset)
+        assert previous['date'].tolist() == current['date'].tolist()
+        assert (previous['variableBorrowRate_max'] == current['variableBorrowRate_max']).all()
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,75 @@
+import argparse
+import os
+import random
+import sys
+import time
+
+from eth_abi import encode
+from eth_utils import function_signature_to_4byte_selector
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src import decoder_registry  # noqa: E402
+from src.constants import TOKEN_CONTRACT_MAP, UNISWAP_V3_FACTORY_ADDR  # noqa: E402
+from src.decoder_registry import decode_inputs, set_decode_processes  # noqa: E402
+
+# Window of blocks decoded together by the range scans (DEFAULT_MAX_WORKERS * 4)
+WINDOW_BLOCKS = 32
+
+
+def synthetic_inputs(count, seed=0):
+    """ Calls to contracts with bundled ABIs: ERC20 transfers and approvals, and Uniswap v3 pool creations """
+    rng = random.Random(seed)
+    address = lambda: f"0x{rng.getrandbits(160):040x}"
+    calls = [
+        (TOKEN_CONTRACT_MAP['USDC'], "transfer(address,uint256)", lambda: [address(), rng.getrandbits(64)]),
+        (TOKEN_CONTRACT_MAP['WETH'], "approve(address,uint256)", lambda: [address(), 2 ** 256 - 1]),
+        (TOKEN_CONTRACT_MAP['DAI'], "transferFrom(address,address,uint256)", lambda: [address(), address(), rng.getrandbits(96)]),
+        (UNISWAP_V3_FACTORY_ADDR, "createPool(address,address,uint24)", lambda: [address(), address(), rng.choice([500, 3000, 10000])]),
+    ]
+    items = []
+    for _ in range(count):
+        contract_address, signature, arguments = rng.choice(calls)
+        types = signature[signature.index("(") + 1:-1].split(",")
+        items.append((contract_address, "0x" + (function_signature_to_4byte_selector(signature) + encode(types, arguments())).hex()))
+    return items
+
+
+def decode_in_groups(items, group_size):
+    results = []
+    for start in range(0, len(items), group_size):
+        results += decode_inputs(items[start:start + group_size])
+    return results
+
+
+def timed(name, count, function):
+    start = time.perf_counter()
+    result = function()
+    elapsed = time.perf_counter() - start
+    print(f"{name:<60} {elapsed:8.2f} s {count / elapsed:12,.0f} inputs/s")
+    return result
+
+
+def run():
+    parser = argparse.ArgumentParser(description='Measure the calldata decoding throughput, in process and with worker processes.')
+    parser.add_argument('--inputs', type=int, help='Number of synthetic inputs', default=200_000)
+    parser.add_argument('--per-block', type=int, help='Matching inputs per block', default=20)
+    parser.add_argument('--processes', type=int, nargs='+', help='Worker process counts to measure', default=[2, 4, os.cpu_count()])
+    args = parser.parse_args()
+
+    items = synthetic_inputs(args.inputs)
+    print(f"{args.inputs:,} inputs, {args.per_block} per block, {os.cpu_count()} CPUs")
+    expected = timed("in process", args.inputs, lambda: decode_inputs(items))
+
+    window = WINDOW_BLOCKS * args.per_block
+    for processes in sorted({processes for processes in args.processes if processes > 1}):
+        set_decode_processes(processes)
+        # Start the workers before measuring
+        decode_inputs(items[:decoder_registry.MIN_PARALLEL_INPUTS * processes])
+        per_block = timed(f"{processes} processes, one call per block ({args.per_block} inputs)", args.inputs, lambda: decode_in_groups(items, args.per_block))
+        per_window = timed(f"{processes} processes, one call per window of {WINDOW_BLOCKS} blocks ({window} inputs)", args.inputs, lambda: decode_in_groups(items, window))
+        assert per_block == expected and per_window == expected, "Parallel decoding differs from decoding in process"
+    set_decode_processes(0)
+
+
+if __name__ == "__main__":
+    run()
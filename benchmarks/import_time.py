@@ -0,0 +1,42 @@
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from main import COMMANDS  # noqa: E402
+
+ROOT_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def time_import(statement, repeat):
+    """ Best wall-clock time over `repeat` fresh interpreters running `statement`, interpreter startup included """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", statement], cwd=ROOT_DIRECTORY, check=True, capture_output=True)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def run():
+    parser = argparse.ArgumentParser(description='Measure the cold start cost of every CLI subcommand, in fresh interpreters.')
+    parser.add_argument('--repeat', type=int, help='Number of runs per measurement, the best one is reported', default=5)
+    args = parser.parse_args()
+
+    measurements = {"python (empty)": "pass", "main.py (dispatcher only)": "import main"}
+    for command, (module_name, _) in COMMANDS.items():
+        measurements[f"main.py {command}"] = f"import main, {module_name}"
+    # What the previous main.py paid on every run, whatever the task
+    measurements["all tasks"] = "import " + ", ".join(module_name for module_name, _ in COMMANDS.values())
+
+    for name, statement in measurements.items():
+        try:
+            print(f"{name:<30} {time_import(statement, args.repeat) * 1000:8.1f} ms")
+        except subprocess.CalledProcessError as e:
+            print(f"{name:<30} failed: {e.stderr.decode().strip().splitlines()[-1]}")
+
+
+if __name__ == "__main__":
+    run()
@@ -1,9 +1,29 @@
+import argparse
+import importlib
+import sys
 
-from src import uniswap, aave, decoding_transactions_with_ABIs, decoding_traces_with_ABIs
+# Module of every task, imported only when its subcommand is chosen: importing them all pulled in web3, pandas,
+# aiohttp and built every Web3 provider before any work started.
+COMMANDS = {
+    "uniswap": ("src.uniswap.main", "Generate the Uniswap pools CSV of a token pair (also snapshots, depth, multi-pair scans)"),
+    "aave": ("src.aave.main", "Fetch and aggregate Aave supplies and borrows"),
+    "decode-tx": ("src.decoding_transactions_with_ABIs.main", "Fetch and decode the transactions of a block or block range"),
+    "decode-traces": ("src.decoding_traces_with_ABIs.main", "Fetch and decode the traces of a block or block range"),
+}
 
 
-uniswap.main.run()
-decoding_transactions_with_ABIs.main.run()
-aave.main.run()  # query error
-decoding_traces_with_ABIs.main.run()  # require paid plan (tested with Alchemy, Infura, QuickNode, Etherscan)
+def run(argv=None):
+    parser = argparse.ArgumentParser(description='Run one of the tasks. Arguments after the command are passed to it, e.g. `python main.py uniswap --help`.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    for command, (_, help_text) in COMMANDS.items():
+        subparsers.add_parser(command, help=help_text, add_help=False)
+    args, task_args = parser.parse_known_args(argv)
 
+    module_name = COMMANDS[args.command][0]
+    # Each task parses sys.argv itself
+    sys.argv = [f"{sys.argv[0]} {args.command}", *task_args]
+    importlib.import_module(module_name).run()
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,111 @@
+import numpy as np
+import pandas as pd
+
+RAY_DECIMALS = 10 ** 27
+SECONDS_PER_DAY = 86400
+
+# Rates of the reserve recorded with every event, the borrow rates in ray
+RATE_FIELDS = ("stableBorrowRate", "variableBorrowRate", "utilizationRate")
+RAY_FIELDS = {"stableBorrowRate", "variableBorrowRate"}
+
+# Events buffered by DailyAggregator before they are folded, to spread the fixed cost of a groupby over many pages
+FOLD_EVENTS = 20000
+
+# Every statistic of every rate, computed in one groupby pass
+AGGREGATIONS = {f"{field}_{statistic}": (field, statistic) for statistic in ("min", "max", "last") for field in RATE_FIELDS}
+
+
+def events_to_frame(events):
+    """
+    Columns of a list of events, read straight from the subgraph JSON: `day` (days since the epoch), `timestamp`,
+    `id` and every rate of RATE_FIELDS as floats, the ray rates scaled to fractions.
+    """
+    timestamps = np.fromiter((int(event['timestamp']) for event in events), dtype=np.int64, count=len(events))
+    columns = {'day': timestamps // SECONDS_PER_DAY, 'timestamp': timestamps, 'id': [event['id'] for event in events]}
+    for field in RATE_FIELDS:
+        # Ray rates are integers too large for int64: parse them as floats, as the scaled value only has float precision
+        values = np.array([event['reserve'][field] for event in events], dtype=np.float64)
+        columns[field] = values / RAY_DECIMALS if field in RAY_FIELDS else values
+    return pd.DataFrame(columns)
+
+
+def aggregate_by_day(events):
+    """
+    Min, max and last value of every rate per day, in one groupby over the events. The last value of a day is the
+    one of its event with the latest (timestamp, id).
+
+    Returns:
+    - DataFrame: Indexed by day number, with the <rate>_min, <rate>_max, <rate>_last columns and the `timestamp`
+      and `id` of the last event.
+    """
+    df = events_to_frame(events)
+    if not (df['timestamp'].is_monotonic_increasing and df['timestamp'].is_unique):
+        df = df.sort_values(['timestamp', 'id'], kind='stable')
+    return df.groupby('day', sort=True).agg(**AGGREGATIONS, timestamp=('timestamp', 'last'), id=('id', 'last'))
+
+
+def _with_dates(days):
+    """ Replace the day number index with a `date` (YYYY-MM-DD) column """
+    days = days.drop(columns=['timestamp', 'id'])
+    days.insert(0, 'date', pd.to_datetime(days.index.to_numpy() * SECONDS_PER_DAY, unit='s').strftime('%Y-%m-%d'))
+    return days.reset_index(drop=True)
+
+
+def aggregate_data_by_date(events):
+    """
+    Returns:
+    - DataFrame: One row per day in date order, with `date` (YYYY-MM-DD) and the <rate>_min, <rate>_max and
+      <rate>_last columns of every rate.
+    """
+    return _with_dates(aggregate_by_day(events))
+
+
+class DailyAggregator:
+    """
+    Running min, max and last value of the reserve rates per UTC day, folded from pages of events as they arrive.
+
+    Only the accumulators of each day and at most `fold_events` buffered events are kept, so memory grows with the
+    number of days, not of events. Pages can come in any order (e.g. from concurrent shards): the last value of a day
+    is the one of its latest event.
+    """
+
+    def __init__(self, fold_events=FOLD_EVENTS):
+        # Day number -> row of `aggregate_by_day`, as a dict
+        self.days = {}
+        self.events = 0
+        self.fold_events = fold_events
+        self._buffer = []
+
+    def add(self, events):
+        self._buffer.extend(events)
+        self.events += len(events)
+        if len(self._buffer) >= self.fold_events:
+            self._fold()
+
+    def _fold(self):
+        events, self._buffer = self._buffer, []
+        if not events:
+            return
+        # Aggregate the buffered events in one pass, then merge their days into the running ones
+        for day, page_day in aggregate_by_day(events).to_dict('index').items():
+            running = self.days.get(day)
+            if running is None:
+                self.days[day] = page_day
+                continue
+            for field in RATE_FIELDS:
+                running[f"{field}_min"] = min(running[f"{field}_min"], page_day[f"{field}_min"])
+                running[f"{field}_max"] = max(running[f"{field}_max"], page_day[f"{field}_max"])
+            if (page_day['timestamp'], page_day['id']) > (running['timestamp'], running['id']):
+                for field in RATE_FIELDS:
+                    running[f"{field}_last"] = page_day[f"{field}_last"]
+                running['timestamp'], running['id'] = page_day['timestamp'], page_day['id']
+
+    def to_frame(self):
+        """
+        Returns:
+        - DataFrame: One row per day in date order, with `date` (YYYY-MM-DD) and the <rate>_min, <rate>_max and
+          <rate>_last columns of every rate.
+        """
+        self._fold()
+        columns = list(AGGREGATIONS) + ['timestamp', 'id']
+        return _with_dates(pd.DataFrame.from_dict(self.days, orient='index', columns=columns).sort_index())
@@ -1,4 +1,4 @@
-
+import os
 
 graph_ids = {
     'aave_v2': {
@@ -9,4 +9,12 @@ graph_ids = {
         'subgraph_id': 'QmdAmQxQCuGoeqNLuE8m6zH366pY2LkustTRYDhSt85X7w',
         'subgraph_queries': 'https://api.thegraph.com/subgraphs/name/aave/protocol-v3',
     },
-}
\ No newline at end of file
+}
+
+# Market of graph_ids read from SUBGRAPH_URL, keys the synced events
+DEFAULT_MARKET = 'aave_v3'
+# GraphQL endpoint of every market, overridden by AAVE_V2_SUBGRAPH_URL / AAVE_V3_SUBGRAPH_URL
+SUBGRAPH_URLS = {market: os.environ.get(f"{market.upper()}_SUBGRAPH_URL", ids['subgraph_queries']) for market, ids in graph_ids.items()}
+# GraphQL endpoint of the single reserve fetches, e.g. a local stub or a gateway URL with an API key
+SUBGRAPH_URL = os.environ.get('AAVE_SUBGRAPH_URL', SUBGRAPH_URLS[DEFAULT_MARKET])
+SUBGRAPH_URLS[DEFAULT_MARKET] = SUBGRAPH_URL
@@ -2,7 +2,7 @@ import json
 import logging
 import csv
 
-from src.utils import root_directory
+from src.constants import ROOT_DIRECTORY
 
 
 def initialize_csv(filename, headers):
@@ -16,7 +16,7 @@ def initialize_csv(filename, headers):
 
 
 def append_supplies_to_csv(supplies):
-    filename = f"{root_directory}/data/supplies.csv"
+    filename = f"{ROOT_DIRECTORY}/data/supplies.csv"
     with open(filename, 'a', newline='') as f:  # 'a' mode for appending
         writer = csv.writer(f)
         # Write data rows
@@ -32,7 +32,7 @@ def append_supplies_to_csv(supplies):
 
 
 def append_borrows_to_csv(borrows):
-    filename = f"{root_directory}/data/borrows.csv"
+    filename = f"{ROOT_DIRECTORY}/data/borrows.csv"
     with open(filename, 'a', newline='') as f:  # 'a' mode for appending
         writer = csv.writer(f)
         # Write data rows
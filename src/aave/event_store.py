@@ -0,0 +1,128 @@
+import sqlite3
+import threading
+import time
+
+from src.constants import ROOT_DIRECTORY
+
+# Supplies and borrows already fetched from the subgraph, and the position reached for every (market, reserve, data
+# type), so incremental syncs only ask the subgraph for newer events. `pending_since` is the timestamp of the earliest
+# event stored since the daily aggregates were last written, so a failed run is caught up by the next one.
+# Pages are stored as they arrive, from concurrent shards in any order: the cursor only moves once a sync completed.
+EVENT_STORE_PATH = f"{ROOT_DIRECTORY}/data/aave_events.sqlite"
+SECONDS_PER_DAY = 86400
+BATCH_SIZE = 1000
+
+_connection = None
+_lock = threading.Lock()
+
+
+def _get_connection():
+    global _connection
+    if _connection is None:
+        _connection = sqlite3.connect(EVENT_STORE_PATH, check_same_thread=False)
+        _connection.executescript("""
+            CREATE TABLE IF NOT EXISTS events (
+                market TEXT NOT NULL, reserve TEXT NOT NULL, data_type TEXT NOT NULL, id TEXT NOT NULL, timestamp INTEGER NOT NULL,
+                stable_borrow_rate TEXT, variable_borrow_rate TEXT, utilization_rate TEXT, last_update_timestamp INTEGER,
+                PRIMARY KEY (market, reserve, data_type, id)
+            );
+            CREATE INDEX IF NOT EXISTS events_timestamp ON events (market, reserve, data_type, timestamp);
+            CREATE TABLE IF NOT EXISTS cursors (
+                market TEXT NOT NULL, reserve TEXT NOT NULL, data_type TEXT NOT NULL,
+                last_timestamp INTEGER, last_id TEXT, synced_at REAL, pending_since INTEGER,
+                PRIMARY KEY (market, reserve, data_type)
+            );
+        """)
+    return _connection
+
+
+def get_cursor(market, reserve, data_type):
+    """
+    Returns:
+    - tuple: (timestamp, id) of the last stored event, None before the first sync.
+    """
+    with _lock:
+        rows = _get_connection().execute("SELECT last_timestamp, last_id FROM cursors WHERE market = ? AND reserve = ? AND data_type = ? AND last_timestamp IS NOT NULL",
+                                         (market, reserve, data_type)).fetchall()
+    return rows[0] if rows else None
+
+
+def append_events(market, reserve, data_type, events):
+    """
+    Store new events. Events already stored (the events of the cursor timestamp are read again by the next sync) are
+    ignored, the others move `pending_since` back to them in the same transaction.
+
+    Returns:
+    - int: Timestamp of the earliest event that was not stored yet, None when every event was already stored.
+    """
+    rows = [(market, reserve, data_type, event['id'], int(event['timestamp']), event['reserve']['stableBorrowRate'], event['reserve']['variableBorrowRate'],
+             event['reserve']['utilizationRate'], int(event['reserve']['lastUpdateTimestamp'])) for event in events]
+    earliest = None
+    with _lock:
+        connection = _get_connection()
+        with connection:
+            for row in rows:
+                if connection.execute("INSERT OR IGNORE INTO events VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", row).rowcount:
+                    earliest = row[4] if earliest is None else min(earliest, row[4])
+            if earliest is not None:
+                connection.execute("""
+                    INSERT INTO cursors (market, reserve, data_type, pending_since) VALUES (?, ?, ?, ?)
+                    ON CONFLICT (market, reserve, data_type) DO UPDATE SET pending_since = MIN(COALESCE(pending_since, excluded.pending_since), excluded.pending_since)
+                """, (market, reserve, data_type, earliest))
+    return earliest
+
+
+def advance_cursor(market, reserve, data_type):
+    """ Move the cursor to the last stored event, once every event up to it was stored """
+    with _lock:
+        connection = _get_connection()
+        with connection:
+            last = connection.execute("SELECT timestamp, id FROM events WHERE market = ? AND reserve = ? AND data_type = ? ORDER BY timestamp DESC, id DESC LIMIT 1",
+                                      (market, reserve, data_type)).fetchone()
+            if last is not None:
+                connection.execute("""
+                    INSERT INTO cursors (market, reserve, data_type, last_timestamp, last_id, synced_at) VALUES (?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (market, reserve, data_type) DO UPDATE SET last_timestamp = excluded.last_timestamp, last_id = excluded.last_id, synced_at = excluded.synced_at
+                """, (market, reserve, data_type, last[0], last[1], time.time()))
+
+
+def get_pending_since(market, reserve, data_type):
+    """ Timestamp of the earliest event stored since the last `mark_processed`, None when there is none """
+    with _lock:
+        rows = _get_connection().execute("SELECT pending_since FROM cursors WHERE market = ? AND reserve = ? AND data_type = ?",
+                                         (market, reserve, data_type)).fetchall()
+    return rows[0][0] if rows else None
+
+
+def mark_processed(market, reserve, data_type):
+    """ Record that the daily aggregates include every stored event """
+    with _lock:
+        connection = _get_connection()
+        with connection:
+            connection.execute("UPDATE cursors SET pending_since = NULL WHERE market = ? AND reserve = ? AND data_type = ?", (market, reserve, data_type))
+
+
+def iter_events(market, reserve, data_type, since=0, batch_size=BATCH_SIZE):
+    """
+    Stored events with a timestamp from `since`, in timestamp order and in the shape returned by the subgraph.
+
+    Yields:
+    - list: Batches of at most `batch_size` events, so that a caller folding them never holds the whole history.
+    """
+    with _lock:
+        cursor = _get_connection().execute(
+            "SELECT id, timestamp, stable_borrow_rate, variable_borrow_rate, utilization_rate, last_update_timestamp FROM events "
+            "WHERE market = ? AND reserve = ? AND data_type = ? AND timestamp >= ? ORDER BY timestamp, id", (market, reserve, data_type, since))
+    while True:
+        with _lock:
+            rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        yield [{"id": id, "timestamp": timestamp, "reserve": {"stableBorrowRate": stable_borrow_rate, "variableBorrowRate": variable_borrow_rate,
+                                                              "utilizationRate": utilization_rate, "lastUpdateTimestamp": last_update_timestamp}}
+               for id, timestamp, stable_borrow_rate, variable_borrow_rate, utilization_rate, last_update_timestamp in rows]
+
+
+def start_of_day(timestamp):
+    """ Timestamp of 00:00 UTC on the day of `timestamp` """
+    return timestamp - timestamp % SECONDS_PER_DAY
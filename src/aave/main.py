@@ -1,102 +1,47 @@
 from datetime import datetime
+import argparse
+import os
 import requests
 import asyncio
-import aiohttp
 import logging
 import pandas as pd
+from src.aave import event_store
+from src.aave.aggregation import DailyAggregator, aggregate_data_by_date
+from src.aave.config import DEFAULT_MARKET, SUBGRAPH_URL, graph_ids
+from src.aave.subgraph import DATA_TYPES, DEFAULT_BATCH_SIZE, DEFAULT_CONCURRENCY, DEFAULT_SHARDS, fetch_markets_events, fetch_reserve_events
 from src.aave.utils import effective_daily_rate, annualize_rate
-from src.utils import root_directory
+from src.constants import ROOT_DIRECTORY
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 
-RAY_DECIMALS = 10 ** 27
-
-
-# The fetch_page function remains largely the same, but the query and function signature change slightly:
-
-async def fetch_page(session, last_id, data_type, token_symbol="USDC"):
-    assert data_type in ["supplies", "borrows"], "Invalid data_type. Choose either 'supplies' or 'borrows'."
-    endpoint = "https://api.thegraph.com/subgraphs/name/aave/protocol-v3"
-    query = f"""
-    {{
-        {data_type}(
-            where: {{reserve_: {{symbol: "{token_symbol}"}}, id_gt: "{last_id}"}}
-            orderBy: timestamp
-            orderDirection: asc
-            first: 1000
-        ){{
-            id
-            timestamp
-            reserve {{
-                stableBorrowRate
-                variableBorrowRate
-                utilizationRate
-                lastUpdateTimestamp
-            }}
-        }}
-    }}
-    """
-    async with session.post(endpoint, json={"query": query}) as response:
-        if response.status != 200:
-            logging.error(f"Request failed with status code: {response.status}")
-            raise ValueError(f"Request failed with status code: {response.status}")
-        data = await response.json()
-        if not data['data'][data_type]:
-            logging.info(f"No more data to fetch for {data_type.upper()} with {token_symbol.upper()}")
-            return data['data']
-        logging.info(f"Data fetched for {data_type.upper()} with {token_symbol.upper()} with timestamp: {pd.to_datetime(data['data'][data_type][0]['timestamp'], unit='s')}")
-        logging.info(data['data'])
-        return data['data']
-
-
-async def fetch_data_by_type(data_type, token_symbol="USDC"):
-    async with aiohttp.ClientSession() as session:
-        all_data = []
-        last_id = ""  # initial value
-
-        while True:
-            fetched_data = await fetch_page(session, last_id, data_type, token_symbol)
-
-            if not fetched_data[data_type]:
-                break
-
-            all_data.extend(fetched_data[data_type])
-            last_id = fetched_data[data_type][-1]['id']  # set the last_id for the next iteration
-
-        process_and_write_data(data_type, all_data)
-        return all_data
-
-
-def aggregate_data_by_date(data):
-    df = pd.DataFrame(data)
+async def fetch_data_by_type(data_type, token_symbol="USDC", shards=DEFAULT_SHARDS, concurrency=DEFAULT_CONCURRENCY):
+    """ Every event of one data type of a reserve, see `fetch_reserve_events` """
+    return (await fetch_reserve_events(token_symbol, [data_type], shards, concurrency))[data_type]
 
-    # Convert timestamp to date
-    df['date'] = pd.to_datetime(df['timestamp'], unit='s').dt.strftime('%Y-%m-%d')
 
-    # Unpack dictionary column into multiple columns
-    reserve_df = df['reserve'].apply(pd.Series)
+def processed_path(market, token_symbol, data_type):
+    """ CSV of the daily aggregates of one data type of a reserve, each reserve of each market having its own """
+    return f"{ROOT_DIRECTORY}/data/{market}_{token_symbol}_processed_{data_type}.csv"
 
-    # Convert rate columns
-    df['stableBorrowRate'] = reserve_df['stableBorrowRate'].astype(float) / RAY_DECIMALS
-    df['variableBorrowRate'] = reserve_df['variableBorrowRate'].astype(float) / RAY_DECIMALS
-    df['utilizationRate'] = reserve_df['utilizationRate'].astype(float)
 
-    # Get the min and max values for each rate
-    df_min = df.groupby('date').min()[['stableBorrowRate', 'variableBorrowRate', 'utilizationRate']]
-    df_max = df.groupby('date').max()[['stableBorrowRate', 'variableBorrowRate', 'utilizationRate']]
-
-    # Renaming the min and max columns
-    df_min.columns = [f"min_{col}" for col in df_min.columns]
-    df_max.columns = [f"max_{col}" for col in df_max.columns]
-
-    # Merging the min and max dataframes
-    aggregated = pd.merge(df_min, df_max, on='date').reset_index()
-
-    return aggregated
+def process_and_write_data(data_type, data, since_date=None, path=None, token_symbol="USDC", market=DEFAULT_MARKET):
+    """
+    Aggregate events by day and write them to `path`, data/<market>_<token_symbol>_processed_<data_type>.csv by default.
 
+    Args:
+    - data_type (str): "supplies" or "borrows".
+    - data (list or DataFrame): The events, as returned by the subgraph, or the days already aggregated by a
+      `DailyAggregator`.
+    - since_date (str, optional): Date (YYYY-MM-DD) of the first event of `data`, when it only holds the events from
+      that day on: the rows of the existing CSV before it are kept, the others are replaced.
+    - path (str, optional): CSV to write.
+    - token_symbol (str): Symbol of the reserve of the events, names the default CSV.
+    - market (str): Market of the reserve, names the default CSV.
 
-def process_and_write_data(data_type, data):
-    aggregated = aggregate_data_by_date(data)
+    Returns:
+    - DataFrame: Every row of the CSV.
+    """
+    aggregated = data if isinstance(data, pd.DataFrame) else aggregate_data_by_date(data)
 
     # Depending on the data type, calculate some derived columns
     aggregated['daily_rate_stable'] = effective_daily_rate(aggregated['stableBorrowRate_max'])
@@ -104,10 +49,6 @@ def process_and_write_data(data_type, data):
     aggregated['daily_rate_variable'] = effective_daily_rate(aggregated['variableBorrowRate_max'])
     aggregated['daily_apr_variable'] = annualize_rate(aggregated['daily_rate_variable'])
 
-    # Drop the original camel case columns
-    columns_to_drop = ['stableBorrowRate_min', 'stableBorrowRate_max', 'variableBorrowRate_min', 'variableBorrowRate_max', 'utilizationRate_min', 'utilizationRate_max']
-    aggregated.drop(columns=columns_to_drop, inplace=True, errors='ignore')
-
     # Renaming based on data_type
     if data_type == "supplies":
         # For deposits
@@ -135,8 +76,21 @@ def process_and_write_data(data_type, data):
             'daily_apr_stable': 'daily_borrow_APR',
         }, inplace=True)
 
+    # Drop the original camel case columns that were not renamed
+    columns_to_drop = ['stableBorrowRate_min', 'stableBorrowRate_max', 'variableBorrowRate_min', 'variableBorrowRate_max', 'utilizationRate_min', 'utilizationRate_max',
+                       'stableBorrowRate_last', 'variableBorrowRate_last', 'utilizationRate_last']
+    aggregated.drop(columns=columns_to_drop, inplace=True, errors='ignore')
+
+    path = path or processed_path(market, token_symbol, data_type)
+    if since_date is not None and os.path.exists(path):
+        existing = pd.read_csv(path, float_precision='round_trip')
+        if list(existing.columns) == list(aggregated.columns):
+            aggregated = pd.concat([existing[existing['date'] < since_date], aggregated], ignore_index=True)
+        else:
+            logging.warning(f"{path} was written with other columns, only the days from {since_date} are kept")
+
     # Save the processed data
-    aggregated.to_csv(f"{root_directory()}/data/processed_{data_type}.csv", index=False)
+    aggregated.to_csv(path, index=False)
     logging.info(f"Saved data for {data_type.upper()} with min and max dates: {aggregated['date'].min()} - {aggregated['date'].max()}")
 
     return aggregated
@@ -155,8 +109,6 @@ def get_pool_by_asset_from_graph(underlying_asset: str) -> str:
     """
 
     # Query the GraphQL endpoint
-    endpoint = "https://api.thegraph.com/subgraphs/name/aave/protocol-v3"  # Replace with the actual endpoint
-
     query = """
     {
       mapAssetPools{
@@ -167,7 +119,7 @@ def get_pool_by_asset_from_graph(underlying_asset: str) -> str:
     }
     """
 
-    response = requests.post(endpoint, json={"query": query})
+    response = requests.post(SUBGRAPH_URL, json={"query": query})
     data = response.json()
 
     # Save this data locally in a Python dictionary.
@@ -177,22 +129,132 @@ def get_pool_by_asset_from_graph(underlying_asset: str) -> str:
     return asset_to_pool_mapping.get(underlying_asset)
 
 
-# Example usage:
+def sync_events(token_symbol, shards=DEFAULT_SHARDS, concurrency=DEFAULT_CONCURRENCY, market=DEFAULT_MARKET):
+    """
+    Fetch the supplies and borrows of a reserve newer than the ones already in the event store, and store them.
 
+    The fetch starts at the timestamp of the last stored event of each data type: events of that second are read
+    again, as more of them may have been indexed since, and those already stored are ignored. Pages are stored as
+    they arrive and the cursors only move once every page was stored.
+    """
+    cursors = {data_type: event_store.get_cursor(market, token_symbol, data_type) for data_type in DATA_TYPES}
+    since = {data_type: cursor[0] for data_type, cursor in cursors.items() if cursor is not None}
+    counts = asyncio.run(fetch_reserve_events(token_symbol, DATA_TYPES, shards, concurrency, since=since,
+                                              on_page=lambda data_type, events: event_store.append_events(market, token_symbol, data_type, events)))
+
+    for data_type in DATA_TYPES:
+        event_store.advance_cursor(market, token_symbol, data_type)
+        logging.info(f"Synced {data_type.upper()} with {token_symbol.upper()}: {counts[data_type]} events fetched since {since.get(data_type, 'the first one')}")
+
+
+def sync_markets_events(markets, token_symbols, batch_size=DEFAULT_BATCH_SIZE, concurrency=DEFAULT_CONCURRENCY):
+    """ Like `sync_events`, for many reserves of many markets fetched in aliased batches (see `fetch_markets_events`) """
+    since = {}
+    for market in markets:
+        for token_symbol in token_symbols:
+            for data_type in DATA_TYPES:
+                cursor = event_store.get_cursor(market, token_symbol, data_type)
+                if cursor is not None:
+                    since[(market, token_symbol, data_type)] = cursor[0]
+
+    counts = asyncio.run(fetch_markets_events(markets, token_symbols, DATA_TYPES, since, batch_size, concurrency,
+                                              on_page=lambda market, token_symbol, data_type, events: event_store.append_events(market, token_symbol, data_type, events)))
+    for market, token_symbol, data_type in counts:
+        event_store.advance_cursor(market, token_symbol, data_type)
+    logging.info(f"Synced {sum(counts.values())} events of {len(token_symbols)} reserves on {', '.join(markets)}")
+
+
+def process_synced_data(data_type, token_symbol, market=DEFAULT_MARKET, path=None):
+    """
+    Update the CSV at `path` (data/<market>_<token_symbol>_processed_<data_type>.csv by default) with the events stored
+    since it was last written: only the days from the one of the earliest of them are aggregated again, every day when
+    the CSV is missing.
+    """
+    path = path or processed_path(market, token_symbol, data_type)
+    pending_since = event_store.get_pending_since(market, token_symbol, data_type)
+    if pending_since is None and os.path.exists(path):
+        logging.info(f"No new {data_type.upper()} with {token_symbol.upper()}, keeping {path}")
+        return pd.read_csv(path, float_precision='round_trip')
+
+    since = event_store.start_of_day(pending_since) if pending_since is not None and os.path.exists(path) else 0
+    since_date = pd.to_datetime(since, unit='s').strftime('%Y-%m-%d') if since else None
+    aggregator = DailyAggregator()
+    for events in event_store.iter_events(market, token_symbol, data_type, since):
+        aggregator.add(events)
+    processed = process_and_write_data(data_type, aggregator.to_frame(), since_date, path)
+    event_store.mark_processed(market, token_symbol, data_type)
+    return processed
+
+
+def merge_and_write_data(processed_supplies, processed_borrows, path):
+    merged = pd.merge(processed_supplies, processed_borrows, on='date', how='outer', suffixes=('_supply', '_borrow'))
+    merged.to_csv(path, index=False)
+    logging.info(f"Merged supplies and borrows data into {path}")
 
-def run(token_symbol='USDC', user_input="0x6b175474e89094c44da98b954eedeac495271d0f"):
-    user_input = "0x6b175474e89094c44da98b954eedeac495271d0f"
+
+def run_markets(markets, token_symbols, batch_size=DEFAULT_BATCH_SIZE, concurrency=DEFAULT_CONCURRENCY, incremental=False):
+    """
+    Fetch and aggregate the supplies and borrows of every reserve on every market, the pages of several reserves
+    being read in one aliased query. Writes data/<market>_<symbol>_processed_<data_type>.csv and
+    data/<market>_<symbol>_aave_data.csv for every reserve of every market.
+    """
+    if incremental:
+        sync_markets_events(markets, token_symbols, batch_size, concurrency)
+        processed = {(market, token_symbol, data_type): process_synced_data(data_type, token_symbol, market)
+                     for market in markets for token_symbol in token_symbols for data_type in DATA_TYPES}
+    else:
+        aggregators = {(market, token_symbol, data_type): DailyAggregator() for market in markets for token_symbol in token_symbols for data_type in DATA_TYPES}
+        asyncio.run(fetch_markets_events(markets, token_symbols, DATA_TYPES, batch_size=batch_size, concurrency=concurrency,
+                                         on_page=lambda market, token_symbol, data_type, events: aggregators[(market, token_symbol, data_type)].add(events)))
+        processed = {(market, token_symbol, data_type): process_and_write_data(data_type, aggregator.to_frame(), token_symbol=token_symbol, market=market)
+                     for (market, token_symbol, data_type), aggregator in aggregators.items()}
+
+    for market in markets:
+        for token_symbol in token_symbols:
+            merge_and_write_data(processed[(market, token_symbol, "supplies")], processed[(market, token_symbol, "borrows")],
+                                 f"{ROOT_DIRECTORY}/data/{market}_{token_symbol}_aave_data.csv")
+
+
+def run():
+    parser = argparse.ArgumentParser(description='Fetch the supplies and borrows of an Aave reserve and aggregate their rates by day.')
+    parser.add_argument('--symbol', type=str, help='Symbol of the reserve', default='USDC')
+    parser.add_argument('--asset', type=str, help='Underlying asset address, names the merged CSV', default="0x6b175474e89094c44da98b954eedeac495271d0f")
+    parser.add_argument('--shards', type=int, help='Number of timestamp shards of the history paged concurrently', default=DEFAULT_SHARDS)
+    parser.add_argument('--concurrency', type=int, help='Maximum number of subgraph queries in flight', default=DEFAULT_CONCURRENCY)
+    parser.add_argument('--incremental', action='store_true', help='Only fetch the events newer than the last run into data/aave_events.sqlite and update the days they touch')
+    parser.add_argument('--debug', action='store_true', help='Log the content of every fetched page')
+    parser.add_argument('--symbols', type=str, help='Comma-separated reserve symbols fetched together in aliased batches instead of --symbol, e.g. USDC,DAI,WETH', default='')
+    parser.add_argument('--markets', type=str, help=f"Comma-separated markets of --symbols, among {', '.join(graph_ids)}", default=DEFAULT_MARKET)
+    parser.add_argument('--batch-size', type=int, help='Number of reserves and data types read per query with --symbols', default=DEFAULT_BATCH_SIZE)
+    args = parser.parse_args()
+
+    if args.debug:
+        logging.getLogger().setLevel(logging.DEBUG)
+
+    if args.symbols:
+        markets = [market.strip() for market in args.markets.split(',') if market.strip()]
+        unknown = [market for market in markets if market not in graph_ids]
+        if unknown:
+            parser.error(f"Unknown markets {', '.join(unknown)}, choose among {', '.join(graph_ids)}")
+        run_markets(markets, [symbol.strip() for symbol in args.symbols.split(',') if symbol.strip()], args.batch_size, args.concurrency, args.incremental)
+        return
+
+    user_input = args.asset
     pool_address = get_pool_by_asset_from_graph(user_input)
 
-    borrows = asyncio.run(fetch_data_by_type("borrows", token_symbol))
-    supplies = asyncio.run(fetch_data_by_type("supplies", token_symbol))
+    if args.incremental:
+        sync_events(args.symbol, args.shards, args.concurrency)
+        processed_supplies = process_synced_data("supplies", args.symbol)
+        processed_borrows = process_synced_data("borrows", args.symbol)
+    else:
+        # Borrows and supplies are paged together over one session, every page being folded into the days it covers
+        # as soon as it arrives
+        aggregators = {data_type: DailyAggregator() for data_type in DATA_TYPES}
+        asyncio.run(fetch_reserve_events(args.symbol, DATA_TYPES, args.shards, args.concurrency,
+                                         on_page=lambda data_type, events: aggregators[data_type].add(events)))
 
-    processed_supplies = process_and_write_data("supplies", supplies)
-    processed_borrows = process_and_write_data("borrows", borrows)
+        processed_supplies = process_and_write_data("supplies", aggregators["supplies"].to_frame(), token_symbol=args.symbol)
+        processed_borrows = process_and_write_data("borrows", aggregators["borrows"].to_frame(), token_symbol=args.symbol)
 
     # Merging at the end
-    merged = pd.merge(processed_supplies, processed_borrows, on='date', how='outer', suffixes=('_supply', '_borrow'))
-    merged.to_csv(f"{root_directory()}/data/{user_input}_aave_data.csv", index=False)
-    logging.info("Merged supplies and borrows data.")
-
-
+    merge_and_write_data(processed_supplies, processed_borrows, f"{ROOT_DIRECTORY}/data/{user_input}_aave_data.csv")
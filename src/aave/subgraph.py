@@ -0,0 +1,309 @@
+import asyncio
+import logging
+
+import aiohttp
+
+from src.aave.config import DEFAULT_MARKET, SUBGRAPH_URL, SUBGRAPH_URLS
+
+# The subgraph returns at most 1000 entities per query
+PAGE_SIZE = 1000
+DEFAULT_SHARDS = 16
+DEFAULT_CONCURRENCY = 8
+# Reserves and data types whose next pages are read in one aliased query
+DEFAULT_BATCH_SIZE = 10
+MAX_RETRIES = 5
+# Seconds waited before the first retry, doubled on every following one
+RETRY_DELAY = 1
+REQUEST_TIMEOUT = 60
+# GraphQL errors worth retrying: the indexers behind the gateway failing or overloaded. Any other error (a validation
+# error such as an unknown field or argument) fails the same way every time, and is raised at once.
+TRANSIENT_GRAPHQL_ERRORS = ("timeout", "timed out", "overloaded", "unavailable", "bad indexers", "too many requests", "rate limit")
+
+DATA_TYPES = ("borrows", "supplies")
+# Entities that are named differently in the subgraph of a market: supplies were deposits before Aave v3
+MARKET_ENTITIES = {'aave_v2': {'supplies': 'deposits'}}
+EVENT_FIELDS = """
+            id
+            timestamp
+            reserve {
+                stableBorrowRate
+                variableBorrowRate
+                utilizationRate
+                lastUpdateTimestamp
+            }
+"""
+
+
+async def post_query(session, semaphore, query, endpoint=SUBGRAPH_URL):
+    """
+    Send a GraphQL query, at most `semaphore` queries being in flight at once, and retry failed requests with
+    exponential backoff: connection errors, timeouts, 429s and 5xx (the hosted service answers bursts with 429s and
+    transient 5xx), and GraphQL errors of TRANSIENT_GRAPHQL_ERRORS. Other errors are raised at once.
+
+    Returns:
+    - dict: The `data` of the response.
+    """
+    for attempt in range(MAX_RETRIES):
+        try:
+            async with semaphore:
+                async with session.post(endpoint, json={"query": query}) as response:
+                    status = response.status
+                    data = await response.json() if status == 200 else None
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            error, retry = f"{type(e).__name__} {e}".strip(), True
+        else:
+            if status == 200 and not data.get('errors'):
+                return data['data']
+            if status != 200:
+                error, retry = f"status code {status}", status == 429 or status >= 500
+            else:
+                error = data['errors']
+                retry = any(marker in str(error).lower() for marker in TRANSIENT_GRAPHQL_ERRORS)
+        if not retry or attempt == MAX_RETRIES - 1:
+            logging.error(f"Request failed with {error}")
+            raise ValueError(f"Request failed with {error}")
+        logging.warning(f"Request failed with {error}, retrying")
+        await asyncio.sleep(RETRY_DELAY * 2 ** attempt)
+
+
+def _reserve_filter(token_symbol):
+    return f'reserve_: {{symbol: "{token_symbol}"}}'
+
+
+async def fetch_time_range(session, semaphore, data_types, token_symbol, endpoint=SUBGRAPH_URL):
+    """
+    Timestamps of the first and last event of every data type, in one query with an alias per bound.
+
+    Returns:
+    - dict: Data type -> (first timestamp, last timestamp), None for data types without any event.
+    """
+    fields = []
+    for data_type in data_types:
+        for bound, direction in (("first", "asc"), ("last", "desc")):
+            fields.append(f"""
+        {data_type}_{bound}: {data_type}(where: {{{_reserve_filter(token_symbol)}}}, orderBy: timestamp, orderDirection: {direction}, first: 1) {{
+            timestamp
+        }}""")
+    data = await post_query(session, semaphore, "{" + "".join(fields) + "\n}", endpoint)
+
+    time_range = {}
+    for data_type in data_types:
+        first, last = data[f"{data_type}_first"], data[f"{data_type}_last"]
+        time_range[data_type] = (int(first[0]['timestamp']), int(last[0]['timestamp'])) if first else None
+    return time_range
+
+
+def shard_bounds(start, end, shards):
+    """ Split the timestamps [start, end] into at most `shards` half-open ranges [lower, upper) of equal duration """
+    shards = max(1, min(shards, end - start + 1))
+    step = (end - start + 1) / shards
+    bounds = [start + round(i * step) for i in range(shards)] + [end + 1]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+class PageCursor:
+    """
+    Position of the paged read of the events of one reserve and data type, from `start` to `end` (excluded).
+
+    Pages are read by timestamp, the next page starting at the timestamp of the last event of the previous one
+    (`id_gt` cursors do not follow a timestamp order, the ids are transaction hashes). Events of that timestamp were
+    already returned by the previous page and are skipped by id. A second holding a whole page of events is read by
+    id, since the timestamp cursor cannot move past it.
+    """
+
+    def __init__(self, data_type, token_symbol, start=0, end=None, market=DEFAULT_MARKET):
+        self.data_type, self.token_symbol, self.market = data_type, token_symbol, market
+        self.entity = MARKET_ENTITIES.get(market, {}).get(data_type, data_type)
+        self.timestamp, self.end = start, end
+        self.seen_ids = set()
+        # Id of the last event read while paging one second by id, None when paging by timestamp
+        self.second_id = None
+        self.done = False
+        self.count = 0
+
+    def field(self, alias=None):
+        """ Query field reading the next page, under `alias` when several are packed into one query """
+        where = [_reserve_filter(self.token_symbol)]
+        if self.second_id is not None:
+            where += [f"timestamp: {self.timestamp}", f'id_gt: "{self.second_id}"']
+            order_by = "id"
+        else:
+            where.append(f"timestamp_gte: {self.timestamp}")
+            if self.end is not None:
+                where.append(f"timestamp_lt: {self.end}")
+            order_by = "timestamp"
+        return f"""
+        {alias + ': ' if alias else ''}{self.entity}(
+            where: {{{', '.join(where)}}}
+            orderBy: {order_by}
+            orderDirection: asc
+            first: {PAGE_SIZE}
+        ){{{EVENT_FIELDS}        }}"""
+
+    def advance(self, rows):
+        """ Move past a page, and return its events that were not returned before """
+        new_rows = [row for row in rows if row['id'] not in self.seen_ids]
+        self.count += len(new_rows)
+        if self.second_id is not None:
+            if len(rows) == PAGE_SIZE:
+                self.second_id = rows[-1]['id']
+            else:
+                self.timestamp, self.second_id, self.seen_ids = self.timestamp + 1, None, set()
+                self.done = self.end is not None and self.timestamp >= self.end
+        elif len(rows) < PAGE_SIZE:
+            self.done = True
+        elif int(rows[-1]['timestamp']) == self.timestamp:
+            # A whole page within one second
+            self.second_id = ""
+            self.seen_ids |= {row['id'] for row in rows}
+        else:
+            self.timestamp = int(rows[-1]['timestamp'])
+            self.seen_ids = {row['id'] for row in rows if int(row['timestamp']) == self.timestamp}
+        return new_rows
+
+
+def _log_page(cursor, rows):
+    # Dumping a page serializes 1000 nested dicts, only do it when debug logs are shown
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        logging.debug(f"Page of {cursor.data_type.upper()} with {cursor.token_symbol.upper()} on {cursor.market}: {rows}")
+
+
+async def fetch_shard(session, semaphore, data_type, token_symbol, start, end, on_page, endpoint=SUBGRAPH_URL):
+    """
+    Pass every event of `data_type` with a timestamp in [start, end) to `on_page(data_type, events)`, a page at a
+    time in timestamp order, so pages can be released as soon as they are processed.
+
+    Returns:
+    - int: The number of events.
+    """
+    cursor = PageCursor(data_type, token_symbol, start, end)
+    while not cursor.done:
+        rows = (await post_query(session, semaphore, "{" + cursor.field() + "\n}", endpoint))[cursor.entity]
+        _log_page(cursor, rows)
+        on_page(data_type, cursor.advance(rows))
+    logging.info(f"Fetched {cursor.count} {data_type.upper()} with {token_symbol.upper()} from {start} to {end}")
+    return cursor.count
+
+
+async def fetch_batched(session, semaphore, cursors, on_page, endpoint):
+    """
+    Page every cursor until it is done, the next pages of all the cursors being read in one query where each cursor
+    has its own alias. Cursors that are done drop out of the next queries.
+
+    Args:
+    - cursors (list): PageCursor of every reserve and data type to read from `endpoint`.
+    - on_page (callable): Called with (cursor, events) for the page of every cursor.
+    """
+    active = list(cursors)
+    while active:
+        query = "{" + "".join(cursor.field(f"c{i}") for i, cursor in enumerate(active)) + "\n}"
+        data = await post_query(session, semaphore, query, endpoint)
+        for i, cursor in enumerate(active):
+            rows = data[f"c{i}"]
+            _log_page(cursor, rows)
+            on_page(cursor, cursor.advance(rows))
+        active = [cursor for cursor in active if not cursor.done]
+
+
+async def fetch_reserve_events(token_symbol="USDC", data_types=DATA_TYPES, shards=DEFAULT_SHARDS, concurrency=DEFAULT_CONCURRENCY, endpoint=SUBGRAPH_URL, since=None, on_page=None):
+    """
+    Fetch the whole history of `data_types` events of a reserve, the timestamp range of every data type being split
+    into `shards` shards paged concurrently over one aiohttp session, with at most `concurrency` queries in flight.
+
+    Shards are half-open timestamp ranges, so no event belongs to two of them, and events repeated at page boundaries
+    are dropped by id: every event is returned once.
+
+    Args:
+    - token_symbol (str): Symbol of the reserve.
+    - data_types (iterable): Entities to fetch, "borrows" and/or "supplies".
+    - shards (int): Number of shards of the timestamp range of each data type.
+    - concurrency (int): Maximum number of queries in flight.
+    - endpoint (str): GraphQL endpoint, AAVE_SUBGRAPH_URL or the Aave v3 subgraph by default.
+    - since (dict, optional): Data type -> timestamp, only the events from that timestamp are fetched.
+    - on_page (callable, optional): Called with (data_type, events) for every page as it arrives, pages of
+      different shards being interleaved. The events are then not kept.
+
+    Returns:
+    - dict: Data type -> list of events in timestamp order, or number of events when `on_page` is given.
+    """
+    for data_type in data_types:
+        assert data_type in DATA_TYPES, "Invalid data_type. Choose either 'supplies' or 'borrows'."
+
+    collected = {data_type: [] for data_type in data_types}
+
+    def shard_sink(data_type):
+        if on_page is not None:
+            return on_page
+        # Shards are concatenated in order once they are all fetched
+        shard_events = []
+        collected[data_type].append(shard_events)
+        return lambda _, events: shard_events.extend(events)
+
+    semaphore = asyncio.Semaphore(concurrency)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)) as session:
+        time_range = await fetch_time_range(session, semaphore, data_types, token_symbol, endpoint)
+
+        tasks = {}
+        for data_type in data_types:
+            start = max(time_range[data_type][0], (since or {}).get(data_type) or 0) if time_range[data_type] else None
+            if start is None or start > time_range[data_type][1]:
+                logging.info(f"No data to fetch for {data_type.upper()} with {token_symbol.upper()}")
+                continue
+            tasks[data_type] = [fetch_shard(session, semaphore, data_type, token_symbol, lower, upper, shard_sink(data_type), endpoint)
+                                for lower, upper in shard_bounds(start, time_range[data_type][1], shards)]
+
+        counts = dict(zip(tasks, await asyncio.gather(*(asyncio.gather(*shard_tasks) for shard_tasks in tasks.values()))))
+
+    for data_type in data_types:
+        logging.info(f"Fetched {sum(counts.get(data_type, []))} {data_type.upper()} with {token_symbol.upper()}")
+    if on_page is not None:
+        return {data_type: sum(counts.get(data_type, [])) for data_type in data_types}
+    return {data_type: [event for shard_events in collected[data_type] for event in shard_events] for data_type in data_types}
+
+
+async def fetch_markets_events(markets, token_symbols, data_types=DATA_TYPES, since=None, batch_size=DEFAULT_BATCH_SIZE, concurrency=DEFAULT_CONCURRENCY, on_page=None):
+    """
+    Fetch the events of many reserves of many markets with few round trips: the reserves and data types of each
+    market are split into batches of `batch_size`, and the next page of every reserve and data type of a batch is
+    read in one query, each with its own alias and its own cursor. Batches run concurrently, with at most
+    `concurrency` queries in flight.
+
+    Args:
+    - markets (iterable): Keys of graph_ids, e.g. ["aave_v2", "aave_v3"].
+    - token_symbols (iterable): Symbols of the reserves, read on every market.
+    - data_types (iterable): Entities to fetch, "borrows" and/or "supplies".
+    - since (dict, optional): (market, symbol, data type) -> timestamp, only the events from that timestamp are fetched.
+    - batch_size (int): Number of reserves and data types read per query.
+    - concurrency (int): Maximum number of queries in flight.
+    - on_page (callable, optional): Called with (market, symbol, data_type, events) for every page as it arrives.
+      The events are then not kept.
+
+    Returns:
+    - dict: (market, symbol, data type) -> list of events in timestamp order, or number of events when `on_page` is given.
+    """
+    for data_type in data_types:
+        assert data_type in DATA_TYPES, "Invalid data_type. Choose either 'supplies' or 'borrows'."
+
+    cursors = {market: [PageCursor(data_type, token_symbol, (since or {}).get((market, token_symbol, data_type)) or 0, market=market)
+                        for token_symbol in token_symbols for data_type in data_types] for market in markets}
+    collected = {(cursor.market, cursor.token_symbol, cursor.data_type): [] for market_cursors in cursors.values() for cursor in market_cursors}
+
+    def route_page(cursor, events):
+        if on_page is not None:
+            on_page(cursor.market, cursor.token_symbol, cursor.data_type, events)
+        else:
+            collected[(cursor.market, cursor.token_symbol, cursor.data_type)].extend(events)
+
+    semaphore = asyncio.Semaphore(concurrency)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)) as session:
+        await asyncio.gather(*(fetch_batched(session, semaphore, market_cursors[i:i + batch_size], route_page, SUBGRAPH_URLS[market])
+                               for market, market_cursors in cursors.items() for i in range(0, len(market_cursors), batch_size)))
+
+    for market_cursors in cursors.values():
+        for cursor in market_cursors:
+            logging.info(f"Fetched {cursor.count} {cursor.data_type.upper()} with {cursor.token_symbol.upper()} on {cursor.market}")
+    if on_page is not None:
+        return {(cursor.market, cursor.token_symbol, cursor.data_type): cursor.count for market_cursors in cursors.values() for cursor in market_cursors}
+    return collected
@@ -1,10 +1,23 @@
+import numpy as np
+
+SECONDS_PER_DAY = 86400
+SECONDS_PER_YEAR = 365 * SECONDS_PER_DAY
+
+
 def effective_daily_rate(rates):
-    # Compounding the rates
-    effective_rate = 1.0
-    for rate in rates:
-        effective_rate *= (1 + rate)
-    return effective_rate - 1
+    """
+    Rate earned over a day at each annual rate, compounded every second as Aave accrues interest. Computed element
+    wise (one value per day and per reserve) in log space, so tiny per-second rates keep their precision.
+
+    Args:
+    - rates (Series or array): Annual rates, as fractions.
+
+    Returns:
+    - Series or array: The daily rates, with the shape of `rates`.
+    """
+    return np.expm1(SECONDS_PER_DAY * np.log1p(rates / SECONDS_PER_YEAR))
 
 
 def annualize_rate(daily_rate):
-    return (1 + daily_rate) ** 365 - 1
+    """ Yearly rate of each daily rate compounded every day for 365 days, element wise """
+    return np.expm1(365 * np.log1p(daily_rate))
@@ -0,0 +1,235 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from web3 import Web3
+
+from src.constants import ABI_PATH, ADDRESS_TO_ABI_FILE, ROOT_DIRECTORY
+
+# Every ABI used by the repo goes through this registry: bundled ABI files are parsed on first use, ABIs fetched from
+# Etherscan are kept in one SQLite store, and identical ABIs (e.g. the ERC20 ABI of every token) are stored and held
+# in memory once, keyed by the hash of their canonical JSON.
+ABI_REGISTRY_PATH = f"{ROOT_DIRECTORY}/data/abi_registry.sqlite"
+
+ETHERSCAN_API_URL = "https://api.etherscan.io/api"
+ETHERSCAN_API_KEY = os.environ.get("ETHERSCAN_API_KEY")  # Replace with your Etherscan API key
+# Etherscan allows 5 calls per second with a free API key (and 1 per 5 seconds without one)
+ETHERSCAN_CALLS_PER_SECOND = float(os.environ.get("ETHERSCAN_CALLS_PER_SECOND", 5 if ETHERSCAN_API_KEY else 0.2))
+ETHERSCAN_MAX_RETRIES = 5
+ETHERSCAN_REQUEST_TIMEOUT = 30
+DEFAULT_FETCH_WORKERS = 4
+
+# https://eips.ethereum.org/EIPS/eip-1967: bytes32(uint256(keccak256('eip1967.proxy.implementation')) - 1)
+EIP1967_IMPLEMENTATION_SLOT = 0x360894a13ba1a3210667c828492db98dca3e2076cc3735a920a3ca505d382bbc
+
+_connection = None
+_lock = threading.Lock()
+_abis_by_hash = {}
+_abis_by_path = {}
+_abis_by_address = {}
+
+_rate_limit_lock = threading.Lock()
+_next_request_time = 0.0
+
+
+def _get_connection():
+    global _connection
+    if _connection is None:
+        _connection = sqlite3.connect(ABI_REGISTRY_PATH, check_same_thread=False)
+        _connection.executescript("""
+            CREATE TABLE IF NOT EXISTS abis (hash TEXT PRIMARY KEY, abi TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS contracts (address TEXT PRIMARY KEY, abi_hash TEXT NOT NULL REFERENCES abis (hash), implementation TEXT);
+        """)
+    return _connection
+
+
+def abi_hash(abi):
+    """ Hash of the canonical JSON of an ABI, identical for the same ABI whatever its formatting """
+    return hashlib.sha256(json.dumps(abi, sort_keys=True, separators=(",", ":")).encode()).hexdigest()
+
+
+def _intern(abi):
+    """ Return the already known ABI with the same content, or register this one. Etherscan ABIs are JSON strings. """
+    abi = json.loads(abi) if isinstance(abi, str) else abi
+    return _abis_by_hash.setdefault(abi_hash(abi), abi)
+
+
+def load_abi_file(file_path):
+    """ Parse a bundled ABI file (a plain ABI or a saved Etherscan response) once """
+    if file_path not in _abis_by_path:
+        with open(file_path, 'r') as file:
+            data = json.load(file)
+        _abis_by_path[file_path] = _intern(data['result'] if isinstance(data, dict) and 'result' in data else data)
+    return _abis_by_path[file_path]
+
+
+def _load_stored_abi(contract_address):
+    with _lock:
+        rows = _get_connection().execute(
+            "SELECT abis.abi FROM contracts JOIN abis ON abis.hash = contracts.abi_hash WHERE contracts.address = ?", (contract_address,)).fetchall()
+    return _intern(rows[0][0]) if rows else None
+
+
+def store_abi(contract_address, abi, implementation=None):
+    """ Persist the ABI of a contract, and the implementation it was resolved from for proxies """
+    abi = _intern(abi)
+    key = abi_hash(abi)
+    with _lock:
+        connection = _get_connection()
+        with connection:
+            connection.execute("INSERT OR IGNORE INTO abis (hash, abi) VALUES (?, ?)", (key, json.dumps(abi, separators=(",", ":"))))
+            connection.execute("INSERT OR REPLACE INTO contracts (address, abi_hash, implementation) VALUES (?, ?, ?)", (contract_address, key, implementation))
+    _abis_by_address[contract_address] = abi
+    # The decoders compiled from a previous (e.g. bundled) ABI of the contract are outdated
+    from src.decoder_registry import forget_selector_table
+    forget_selector_table(contract_address)
+
+
+def get_abi(contract_address, fetch=False):
+    """
+    ABI of a contract: from memory, the store, the bundled files of ADDRESS_TO_ABI_FILE, or Etherscan when `fetch` is True.
+
+    ABIs fetched from Etherscan take precedence over bundled ones, since the bundled ERC20 ABI only covers the
+    standard functions of a token.
+
+    Returns:
+    - list: The ABI, or None when it is unknown (or cannot be fetched).
+    """
+    contract_address = Web3.to_checksum_address(contract_address)
+    abi = _abis_by_address.get(contract_address)
+    if abi is None:
+        abi = _load_stored_abi(contract_address)
+        if abi is None and contract_address in ADDRESS_TO_ABI_FILE:
+            abi = load_abi_file(f"{ABI_PATH}{ADDRESS_TO_ABI_FILE[contract_address]}")
+        if abi is not None:
+            _abis_by_address[contract_address] = abi
+    if abi is None and fetch:
+        abi = fetch_abi(contract_address)
+    return abi
+
+
+def known_addresses():
+    """ Addresses whose ABI is available without fetching """
+    with _lock:
+        stored = [row[0] for row in _get_connection().execute("SELECT address FROM contracts").fetchall()]
+    return list(dict.fromkeys(list(ADDRESS_TO_ABI_FILE) + stored))
+
+
+def _wait_for_rate_limit():
+    """ Space Etherscan calls of every thread by 1 / ETHERSCAN_CALLS_PER_SECOND seconds """
+    global _next_request_time
+    with _rate_limit_lock:
+        now = time.monotonic()
+        wait = _next_request_time - now
+        _next_request_time = max(now, _next_request_time) + 1 / ETHERSCAN_CALLS_PER_SECOND
+    if wait > 0:
+        time.sleep(wait)
+
+
+def get_contract_source(contract_address):
+    """
+    Fetch the verified source metadata of a contract from Etherscan (getsourcecode), which carries its ABI and,
+    for proxies, the implementation address in one call.
+
+    Returns:
+    - dict: The Etherscan entry with "ABI", "Proxy" and "Implementation", or None if the contract is not verified.
+    """
+    params = {
+        "module": "contract",
+        "action": "getsourcecode",
+        "address": contract_address,
+        "apikey": ETHERSCAN_API_KEY
+    }
+
+    for attempt in range(ETHERSCAN_MAX_RETRIES):
+        _wait_for_rate_limit()
+        data = requests.get(ETHERSCAN_API_URL, params=params, timeout=ETHERSCAN_REQUEST_TIMEOUT).json()
+        if data['status'] == '1' and data['result']:
+            entry = data['result'][0]
+            # Unverified contracts come back with status 1 and this placeholder instead of an ABI
+            return entry if entry['ABI'] != "Contract source code not verified" else None
+        if "rate limit" not in str(data['result']).lower():
+            raise Exception(f"Error fetching ABI for {contract_address}. Error: {data['message']} {data['result']}")
+        time.sleep(2 ** attempt)
+    raise Exception(f"Error fetching ABI for {contract_address}: Etherscan rate limit still reached after {ETHERSCAN_MAX_RETRIES} attempts")
+
+
+def read_eip1967_implementation(contract_address):
+    """ Implementation address stored in the EIP-1967 slot of a proxy, None when the slot is empty """
+    from src.rpc import get_web3
+    value = get_web3('ETHEREUM_HTTP_ENDPOINT').eth.get_storage_at(contract_address, EIP1967_IMPLEMENTATION_SLOT)
+    implementation = Web3.to_checksum_address(value[-20:])
+    return None if int(implementation, 16) == 0 else implementation
+
+
+def _merge_abis(proxy_abi, implementation_abi):
+    """ Entries of the implementation followed by the proxy's own (admin functions, events), without duplicates """
+    merged = {}
+    for entry in implementation_abi + proxy_abi:
+        merged.setdefault(json.dumps(entry, sort_keys=True), entry)
+    return list(merged.values())
+
+
+def fetch_abi(contract_address):
+    """
+    Fetch the ABI of a contract from Etherscan and store it. Calls to a proxy execute the code of its implementation,
+    so for proxies (flagged by Etherscan, or with an EIP-1967 implementation slot) the ABI of the implementation is
+    fetched as well and merged into the proxy's.
+
+    Returns:
+    - list: The ABI, or None if the contract is not verified.
+    """
+    contract_address = Web3.to_checksum_address(contract_address)
+    entry = get_contract_source(contract_address)
+    if entry is None:
+        logging.warning(f"No verified ABI on Etherscan for {contract_address}")
+        return None
+
+    abi = json.loads(entry['ABI'])
+    implementation = entry.get('Implementation') if entry.get('Proxy') == '1' else None
+    if not implementation:
+        try:
+            implementation = read_eip1967_implementation(contract_address)
+        except Exception as e:
+            logging.debug(f"Could not read the EIP-1967 slot of {contract_address}: {e}")
+
+    if implementation and Web3.to_checksum_address(implementation) != contract_address:
+        implementation = Web3.to_checksum_address(implementation)
+        implementation_entry = get_contract_source(implementation)
+        if implementation_entry is not None:
+            abi = _merge_abis(abi, json.loads(implementation_entry['ABI']))
+
+    store_abi(contract_address, abi, implementation)
+    print(f"ABI for {contract_address} saved successfully!" + (f" (proxy of {implementation})" if implementation else ""))
+    return _abis_by_address[contract_address]
+
+
+def _fetch_or_bundled_abi(contract_address):
+    try:
+        return fetch_abi(contract_address)
+    except Exception as e:
+        logging.warning(f"{e}, using the bundled ABI if any")
+        return None
+
+
+def fetch_abis(contract_addresses, max_workers=DEFAULT_FETCH_WORKERS):
+    """
+    Make sure the full ABI of every contract is in the store, fetching the missing ones from Etherscan concurrently
+    (within ETHERSCAN_CALLS_PER_SECOND). Bundled ABIs do not count as present, so proxied tokens such as USDC get
+    the ABI of their implementation; they are still used when the fetch fails.
+
+    Returns:
+    - dict: Contract address -> ABI (None for contracts without any ABI).
+    """
+    contract_addresses = list(dict.fromkeys(Web3.to_checksum_address(address) for address in contract_addresses))
+    missing = [address for address in contract_addresses if _load_stored_abi(address) is None]
+    if missing:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(_fetch_or_bundled_abi, missing))
+    return {address: get_abi(address) for address in contract_addresses}
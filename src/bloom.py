@@ -0,0 +1,99 @@
+from eth_utils import keccak
+from hexbytes import HexBytes
+
+from src.rpc import batch_call
+
+# https://ethereum.github.io/yellowpaper/paper.pdf (section 4.3.1): the 2048-bit logsBloom of a block header has
+# 3 bits set for the address and for every topic of every log emitted in the block.
+BLOOM_BITS = 2048
+TRACE_PAGE_SIZE = 1000
+# JSON-RPC error code of methods a node does not implement
+METHOD_NOT_FOUND = -32601
+# trace_filter address field matching each interaction type, queried separately since both fields together match
+# the traces from AND to the addresses
+TRACE_FILTER_SIDES = {"to": ("toAddress",), "from": ("fromAddress",), "both": ("toAddress", "fromAddress")}
+
+# Set once a node answered that it does not serve trace_filter, so pruned blocks are no longer confirmed with it
+_trace_filter_unsupported = False
+
+
+def bloom_mask(item):
+    """ Bits of the logsBloom set by one address or topic, as an int mask over the big-endian bloom """
+    digest = keccak(HexBytes(item))
+    mask = 0
+    for i in (0, 2, 4):
+        mask |= 1 << (((digest[i] << 8) | digest[i + 1]) % BLOOM_BITS)
+    return mask
+
+
+def bloom_may_contain(logs_bloom, item_mask):
+    """ False when the item is certainly not in the bloom, True when it might be (false positives are possible) """
+    return int.from_bytes(HexBytes(logs_bloom), 'big') & item_mask == item_mask
+
+
+def block_may_match(logs_bloom, address_masks, topic_masks=None):
+    """ True when the bloom might contain a log of one of the addresses, and one of the topics when given """
+    if not any(bloom_may_contain(logs_bloom, mask) for mask in address_masks):
+        return False
+    return not topic_masks or any(bloom_may_contain(logs_bloom, mask) for mask in topic_masks)
+
+
+def blocks_with_transactions(w3, from_block, to_block, addresses, interaction_type="both", page_size=TRACE_PAGE_SIZE):
+    """
+    Blocks from `from_block` to `to_block` (inclusive) holding a transaction sent to (or from, see
+    `interaction_type`) one of `addresses`, read exactly from trace_filter: the top-level trace of a transaction
+    (empty traceAddress) has the sender and recipient of the transaction, whether it emitted logs or not.
+
+    Returns:
+    - set: The block numbers, or None when the node does not serve trace_filter.
+    """
+    global _trace_filter_unsupported
+    blocks = set()
+    for side in TRACE_FILTER_SIDES[interaction_type]:
+        after = 0
+        while True:
+            trace_filter = {"fromBlock": hex(from_block), "toBlock": hex(to_block), side: list(addresses), "after": after, "count": page_size}
+            response = w3.provider.make_request("trace_filter", [trace_filter])
+            if "error" in response:
+                # e.g. {"code":-32600,"message":"trace_filter is not available on the Free tier - ..."}
+                if response["error"].get("code") == METHOD_NOT_FOUND or "not available" in response["error"].get("message", ""):
+                    print(f"trace_filter is not available ({response['error']}), blocks are no longer pruned by their logsBloom")
+                    _trace_filter_unsupported = True
+                    return None
+                raise ValueError(f"RPC call trace_filter failed: {response['error']}")
+            page = response["result"]
+            blocks.update(trace["blockNumber"] for trace in page if not trace["traceAddress"])
+            if len(page) < page_size:
+                break
+            after += len(page)
+    return blocks
+
+
+def filter_blocks_by_bloom(w3, block_numbers, addresses, topics=None, interaction_type="both", trace_w3=None):
+    """
+    Fetch the headers of `block_numbers` (without transactions bodies, in one batched request) and keep the blocks
+    whose logsBloom might contain a log emitted by one of `addresses` and, when given, carrying one of `topics`.
+
+    The bloom only records logs: a transaction to or from the addresses that emits no log (a reverted call, a
+    function without events, a transfer sent by an externally owned account) is invisible to it. Without `topics`,
+    blocks pruned by the bloom are therefore confirmed with trace_filter on `trace_w3` (`w3` by default), and the
+    ones holding such a transaction are kept. When the node does not serve trace_filter nothing is pruned. With
+    `topics`, only the blocks that may hold one of those events are kept, which is what asking for them means.
+
+    Returns:
+    - list: The block numbers that might match, in the order of `block_numbers`.
+    """
+    address_masks = [bloom_mask(address) for address in addresses]
+    topic_masks = [bloom_mask(topic) for topic in topics] if topics else None
+    headers = batch_call(w3, [("eth_getBlockByNumber", [hex(block_number), False]) for block_number in block_numbers])
+    # Blocks not produced yet come back as None and are kept so the full fetch reports them
+    kept = {block_number for block_number, header in zip(block_numbers, headers)
+            if header is None or block_may_match(header["logsBloom"], address_masks, topic_masks)}
+    pruned = [block_number for block_number in block_numbers if block_number not in kept]
+    if pruned and not topics:
+        confirmed = None if _trace_filter_unsupported else blocks_with_transactions(trace_w3 or w3, min(pruned), max(pruned), addresses, interaction_type)
+        if confirmed is None:
+            # The pruned blocks cannot be confirmed, fetch them all
+            return list(block_numbers)
+        kept.update(confirmed)
+    return [block_number for block_number in block_numbers if block_number in kept]
@@ -1,7 +1,5 @@
 import os
 
-from src.uniswap.utils import load_abi
-
 TOKEN_CONTRACT_MAP = {
     'WETH': '0xC02aaA39b223FE8D0A0e5C4F27eAD9083C756Cc2',
     'USDC': '0xA0b86991c6218b36c1d19D4a2e9Eb0cE3606eB48',
@@ -12,6 +10,9 @@ TOKEN_CONTRACT_MAP = {
 
 UNISWAP_V2_FACTORY_ADDR = '0x5C69bEe701ef814a2B6a3EDD4B1652CB9cc5aA6f'  # https://docs.uniswap.org/contracts/v2/reference/smart-contracts/factory
 UNISWAP_V3_FACTORY_ADDR = '0x1F98431c8aD98523631AE4a59f267346ea31F984'  # https://docs.uniswap.org/contracts/v3/reference/deployments
+MULTICALL3_ADDR = '0xcA11bde05977b3631167028862bE2a173976CA11'  # https://www.multicall3.com/deployments, same address on every chain and on anvil forks
+MULTICALL3_DEPLOY_BLOCK = 14353601  # first mainnet block where MULTICALL3_ADDR has code, earlier eth_calls to it return nothing
+ZERO_ADDRESS = '0x0000000000000000000000000000000000000000'  # returned by the factories for pairs and fee tiers without a pool
 
 UNISWAP_V3_TIERS = [0.05/100, 0.3/100, 1/100]
 UNISWAP_V3_TIERS_BPS = [100, 500, 3000, 10000]
@@ -32,39 +33,50 @@ Thus, for 1%, you'd use the value 10000 as the uint24 representation.
 """
 
 
+# Resolved once from the location of this file: src/constants.py is always one level below the root. Walking up
+# from the working directory looking for '.git' cost a directory listing per level on every import, and never
+# ended in deployments without a .git directory.
+ROOT_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
 def root_directory() -> str:
     """
-    Determine the root directory of the project based on the presence of '.git' directory.
+    Return the root directory of the project.
 
     Returns:
     - str: The path to the root directory of the project.
     """
-    current_dir = os.getcwd()
-
-    while True:
-        if '.git' in os.listdir(current_dir):
-            return current_dir
-        else:
-            # Go up one level
-            current_dir = os.path.dirname(current_dir)
-
-
-ROOT_DIRECTORY = root_directory()
-
-UNISWAP_V2_FACTORY_ABI = load_abi(f"{ROOT_DIRECTORY}/src/uniswap/ABI/UNISWAP_V2_FACTORY_ABI.json")
-UNISWAP_V3_FACTORY_ABI = load_abi(f"{ROOT_DIRECTORY}/src/uniswap/ABI/UNISWAP_V3_FACTORY_ABI.json")
-UNISWAP_V2_POOL_ABI = load_abi(f"{ROOT_DIRECTORY}/src/uniswap/ABI/UNISWAP_V2_POOL_ABI.json")
-UNISWAP_V3_POOL_ABI = load_abi(f"{ROOT_DIRECTORY}/src/uniswap/ABI/UNISWAP_V3_POOL_ABI.json")
-ERC20_ABI = load_abi(f"{ROOT_DIRECTORY}/src/uniswap/ABI/ERC20_ABI.json")  # https://gist.github.com/veox/8800debbf56e24718f9f483e1e40c35c#file-erc20-abi-json
+    return ROOT_DIRECTORY
 
 ABI_PATH = f"{ROOT_DIRECTORY}/src/uniswap/ABI/"
 
-ADDRESS_TO_ABI_MAPPING = {
-    TOKEN_CONTRACT_MAP['WETH']: load_abi(f"{ABI_PATH}ERC20_ABI.json"),
-    TOKEN_CONTRACT_MAP['USDC']: load_abi(f"{ABI_PATH}ERC20_ABI.json"),
-    TOKEN_CONTRACT_MAP['DAI']: load_abi(f"{ABI_PATH}ERC20_ABI.json"),
-    TOKEN_CONTRACT_MAP['WBTC']: load_abi(f"{ABI_PATH}ERC20_ABI.json"),
-    TOKEN_CONTRACT_MAP['USDT']: load_abi(f"{ABI_PATH}ERC20_ABI.json"),
-    UNISWAP_V2_FACTORY_ADDR: load_abi(f"{ABI_PATH}UNISWAP_V2_FACTORY_ABI.json"),
-    UNISWAP_V3_FACTORY_ADDR: load_abi(f"{ABI_PATH}UNISWAP_V3_FACTORY_ABI.json"),
+# ABIs are parsed on first access (module __getattr__, PEP 562) through src/abi_registry.py, so importing this module
+# parses none of them. They are not part of `from src.constants import *`: import the ones a module uses by name.
+ABI_FILES = {
+    "UNISWAP_V2_FACTORY_ABI": "UNISWAP_V2_FACTORY_ABI.json",
+    "UNISWAP_V3_FACTORY_ABI": "UNISWAP_V3_FACTORY_ABI.json",
+    "UNISWAP_V2_POOL_ABI": "UNISWAP_V2_POOL_ABI.json",
+    "UNISWAP_V3_POOL_ABI": "UNISWAP_V3_POOL_ABI.json",
+    "MULTICALL3_ABI": "MULTICALL3_ABI.json",
+    "ERC20_ABI": "ERC20_ABI.json",  # https://gist.github.com/veox/8800debbf56e24718f9f483e1e40c35c#file-erc20-abi-json
+}
+# Bundled ABI file of the contracts whose calls can be decoded without fetching their ABI from Etherscan
+ADDRESS_TO_ABI_FILE = {
+    TOKEN_CONTRACT_MAP['WETH']: "ERC20_ABI.json",
+    TOKEN_CONTRACT_MAP['USDC']: "ERC20_ABI.json",
+    TOKEN_CONTRACT_MAP['DAI']: "ERC20_ABI.json",
+    TOKEN_CONTRACT_MAP['WBTC']: "ERC20_ABI.json",
+    TOKEN_CONTRACT_MAP['USDT']: "ERC20_ABI.json",
+    UNISWAP_V2_FACTORY_ADDR: "UNISWAP_V2_FACTORY_ABI.json",
+    UNISWAP_V3_FACTORY_ADDR: "UNISWAP_V3_FACTORY_ABI.json",
 }
+
+
+def __getattr__(name):
+    if name in ABI_FILES:
+        from src.abi_registry import load_abi_file
+        return load_abi_file(f"{ABI_PATH}{ABI_FILES[name]}")
+    if name == "ADDRESS_TO_ABI_MAPPING":
+        from src.abi_registry import get_abi
+        return {address: get_abi(address) for address in ADDRESS_TO_ABI_FILE}
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
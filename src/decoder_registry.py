@@ -0,0 +1,181 @@
+import logging
+import threading
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from eth_abi.decoding import ContextFramesBytesIO, TupleDecoder
+from eth_abi.registry import registry as default_registry
+from eth_utils import function_abi_to_4byte_selector
+from hexbytes import HexBytes
+from web3._utils.abi import get_abi_input_types, map_abi_data, named_tree
+from web3._utils.normalizers import BASE_RETURN_NORMALIZERS
+
+from src.abi_registry import abi_hash, get_abi, known_addresses
+
+# Selector tables compiled once per distinct ABI: 4-byte selector -> (function ABI, input types, eth_abi decoder).
+# Decoding an input is then a dict lookup plus one decoder call, instead of building a contract object per
+# transaction and searching its ABI.
+_selector_tables = {}
+_selector_tables_by_address = {}
+_lock = threading.Lock()
+
+# Outcome of every decode attempt: "decoded", "no_abi", "unknown_selector", "short_input" or "decode_error"
+decode_stats = Counter()
+
+# Largest number of inputs sent to a worker process at once, and the smallest number of inputs worth the pickling
+# round trip (see benchmarks/decode_throughput.py). Range scans decode the matches of a whole window of blocks at once.
+DEFAULT_DECODE_BATCH_SIZE = 500
+MIN_PARALLEL_INPUTS = 200
+
+_process_pool = None
+_processes = 0
+# Set when an ABI changed after the workers were started, which compiled the previous one
+_process_pool_stale = False
+
+
+def compile_abi(abi):
+    """
+    Compile the functions of an ABI into a selector table.
+
+    Returns:
+    - dict: 4-byte selector -> (function ABI, input types, eth_abi tuple decoder)
+    """
+    table = {}
+    for fn_abi in abi:
+        if fn_abi.get("type", "function") != "function":
+            continue
+        types = get_abi_input_types(fn_abi)
+        decoder = TupleDecoder(decoders=[default_registry.get_decoder(type_str) for type_str in types])
+        table[function_abi_to_4byte_selector(fn_abi)] = (fn_abi, types, decoder)
+    return table
+
+
+def get_selector_table(contract_address):
+    """
+    Selector table of a contract whose ABI is in the ABI registry (src/abi_registry.py), compiled on first use.
+    Contracts sharing an ABI share one table. None when the ABI is unknown.
+    """
+    table = _selector_tables_by_address.get(contract_address)
+    if table is None:
+        abi = get_abi(contract_address)
+        if not abi:
+            return None
+        key = abi_hash(abi)
+        with _lock:
+            if key not in _selector_tables:
+                _selector_tables[key] = compile_abi(abi)
+            table = _selector_tables_by_address[contract_address] = _selector_tables[key]
+    return table
+
+
+def forget_selector_table(contract_address):
+    """ Drop the table compiled for a contract whose ABI was replaced in the ABI registry, it is compiled again on next use """
+    global _process_pool_stale
+    with _lock:
+        _selector_tables_by_address.pop(contract_address, None)
+        _process_pool_stale = _process_pool is not None
+
+
+def decode_input(contract_address, input_data):
+    """
+    Decode the input of a call to a contract whose ABI is in the ABI registry.
+
+    Args:
+    - contract_address (str): Checksummed address of the called contract.
+    - input_data (str or bytes): Calldata, selector included.
+
+    Returns:
+    - dict: {"function_name": ..., "values": {argument name: value}}, or None when the input cannot be decoded.
+      The reason is counted in `decode_stats`.
+    """
+    table = get_selector_table(contract_address)
+    if table is None:
+        decode_stats["no_abi"] += 1
+        return None
+
+    data = HexBytes(input_data)
+    if len(data) < 4:
+        # Plain ether transfers and fallback calls
+        decode_stats["short_input"] += 1
+        return None
+
+    entry = table.get(bytes(data[:4]))
+    if entry is None:
+        decode_stats["unknown_selector"] += 1
+        return None
+
+    fn_abi, types, decoder = entry
+    try:
+        values = decoder(ContextFramesBytesIO(bytes(data[4:])))
+    except Exception as e:
+        decode_stats["decode_error"] += 1
+        logging.debug(f"Could not decode {fn_abi['name']} input to {contract_address}: {e}")
+        return None
+
+    decode_stats["decoded"] += 1
+    return {
+        "function_name": fn_abi["name"],
+        "values": named_tree(fn_abi["inputs"], map_abi_data(BASE_RETURN_NORMALIZERS, types, values))
+    }
+
+
+def log_decode_stats():
+    undecodable = sum(count for outcome, count in decode_stats.items() if outcome != "decoded")
+    logging.info(f"Decoded inputs: {decode_stats['decoded']}, undecodable: {undecodable} {dict(decode_stats)}")
+
+
+def _init_worker():
+    """ Compile the selector tables of every known ABI once, when a worker process starts """
+    for contract_address in known_addresses():
+        get_selector_table(contract_address)
+
+
+def _decode_batch(batch):
+    """ Decode a batch of (contract address, input) in a worker, returning the results and the outcome counts """
+    decode_stats.clear()
+    results = [decode_input(contract_address, input_data) for contract_address, input_data in batch]
+    return results, dict(decode_stats)
+
+
+def set_decode_processes(processes):
+    """
+    Decode large sets of inputs with `processes` worker processes from now on. 0 or 1 decodes in the calling process.
+
+    Workers compile the ABIs known to the ABI registry once at startup and are reused by every `decode_inputs` call.
+    """
+    global _process_pool, _processes, _process_pool_stale
+    _process_pool_stale = False
+    if _process_pool is not None:
+        _process_pool.shutdown()
+        _process_pool = None
+    _processes = processes if processes and processes > 1 else 0
+    if _processes:
+        _process_pool = ProcessPoolExecutor(max_workers=_processes, initializer=_init_worker)
+
+
+def decode_inputs(items, batch_size=DEFAULT_DECODE_BATCH_SIZE):
+    """
+    Decode many calldata inputs, in worker processes when enabled with `set_decode_processes` and there are enough of them.
+
+    Args:
+    - items (list): (contract address, input) tuples.
+    - batch_size (int): Largest number of inputs sent to a worker at once, smaller sets are split evenly between the workers.
+
+    Returns:
+    - list: The result of `decode_input` for every item, in the same order.
+    """
+    if _process_pool is None or len(items) < MIN_PARALLEL_INPUTS:
+        return [decode_input(contract_address, input_data) for contract_address, input_data in items]
+    if _process_pool_stale:
+        # Workers compile the ABIs when they start: start new ones for the replaced ABIs
+        set_decode_processes(_processes)
+
+    # Every worker gets a share of sets smaller than one batch per worker
+    batch_size = min(batch_size, -(-len(items) // _processes))
+    batches = [items[start:start + batch_size] for start in range(0, len(items), batch_size)]
+    results = []
+    # map keeps the order of the batches, whatever the order workers finish them in
+    for batch_results, batch_stats in _process_pool.map(_decode_batch, batches):
+        results += batch_results
+        decode_stats.update(batch_stats)
+    return results
@@ -1,15 +1,20 @@
+import argparse
 import json
-import requests
-from web3 import Web3
 from typing import List, Union
 from dotenv import load_dotenv
+from web3 import Web3
 
+from src.abi_registry import fetch_abis
 from src.constants import *
-from src.decoding_transactions_with_ABIs.main import parse_args
+from src.decoder_registry import decode_inputs, log_decode_stats, set_decode_processes
+from src import rpc_cache
+from src.follow import follow_to_sink
+from src.rpc import REQUEST_TIMEOUT, get_session, get_web3
+from src.sinks import open_sink
 from src.utils import *
 
 load_dotenv()
-w3 = Web3(Web3.HTTPProvider(os.environ.get('ETHEREUM_HTTP_ENDPOINT_ALCHEMY')))
+w3 = get_web3('ETHEREUM_HTTP_ENDPOINT_ALCHEMY')
 
 # https://www.quicknode.com/docs/ethereum/trace_block
 # Please note that this RPC method is available by default for all Build & Scale plans. If you are using the Discover plan, you will need to upgrade to a paid plan to utilize this method. See our pricing for more information. Also, it is supported only on OpenEthereum & Erigon.
@@ -19,64 +24,225 @@ w3 = Web3(Web3.HTTPProvider(os.environ.get('ETHEREUM_HTTP_ENDPOINT_ALCHEMY')))
 # b'{"jsonrpc":"2.0","id":1,"error":{"code":-32600,"message":"trace_block is not available on the Free tier - upgrade to Growth, Scale, or Enterprise for access. See available methods at https://docs.alchemy.com/alchemy/documentation/apis"}}'
 
 
-def get_traces(block_identifier: Union[int, str], contract_addresses: List[str], interaction_type: str = "both"):
-    # Convert block number to block hash format if it's a number. Otherwise, use the given block hash.
-    if isinstance(block_identifier, int):
-        block_param = hex(block_identifier)
-    else:
-        block_param = block_identifier
+DEFAULT_TRACE_PAGE_SIZE = 1000
+# JSON-RPC error code of methods a node does not implement
+METHOD_NOT_FOUND = -32601
+
+
+class TraceFilterUnsupported(Exception):
+    """ Raised when the node does not serve trace_filter """
+
+
+def trace_rpc(method: str, params: list):
+    """
+    Make a trace_* call to the Alchemy endpoint, through the on-disk cache of src/rpc_cache.py for final blocks.
+
+    Returns:
+    - The 'result' of the call. Raises TraceFilterUnsupported when trace_filter is missing or not available on the plan.
+    """
+    hit, result = rpc_cache.lookup(method, params)
+    if hit:
+        return result
 
-    # Make the RPC call to Alchemy
     url = os.environ.get('ETHEREUM_HTTP_ENDPOINT_ALCHEMY')
     payload = {
-        "method": "trace_block",
-        "params": [block_param],
+        "method": method,
+        "params": params,
         "id": 1,
         "jsonrpc": "2.0"
     }
     headers = {'Content-Type': 'application/json'}
-    response = requests.post(url, headers=headers, json=payload)
+    response = get_session().post(url, headers=headers, json=payload, timeout=REQUEST_TIMEOUT).json()
+
+    if "error" in response:
+        # e.g. {"code":-32600,"message":"trace_block is not available on the Free tier - upgrade to Growth, Scale, or Enterprise for access. ..."}
+        if method == "trace_filter" and (response["error"].get("code") == METHOD_NOT_FOUND or "not available" in response["error"].get("message", "")):
+            raise TraceFilterUnsupported(response["error"])
+        raise ValueError(f"RPC call {method} failed: {response['error']}")
 
-    traces = response.json()['result']  # will fail with error: b'{"jsonrpc":"2.0","id":1,"error":{"code":-32600,"message":"trace_block is not available on the Free tier - upgrade to Growth, Scale, or Enterprise for access. See available methods at https://docs.alchemy.com/alchemy/documentation/apis"}}'
+    rpc_cache.store(method, params, response["result"], lambda: rpc_cache.get_head_block(url, lambda: w3.eth.block_number))
+    return response["result"]
+
+
+def filter_traces(traces: list, contract_addresses: List[str], interaction_type: str = "both"):
+    """
+    Keep the traces that interact with the given contracts and decode the calls to them.
+
+    Trace addresses are lowercase, they are compared against the lowercased contract addresses in a set.
+    Contract creations have no 'to' address.
+    """
+    if interaction_type not in ("both", "to", "from"):
+        raise ValueError(f"Invalid interaction type: {interaction_type}. Allowed values are 'both', 'to', 'from'.")
+    watched = {address.lower() for address in contract_addresses}
     results = []
+    # (index in results, contract address, input) of the calls to a contract, decoded together at the end
+    to_decode = []
 
     for trace in traces:
+        to_address = (trace['action'].get('to') or '').lower()
+        from_address = trace['action']['from'].lower()
+
         # Depending on the interaction type, decide if the trace should be processed
-        process_trace = False
         if interaction_type == "both":
-            process_trace = trace['action']['to'] in contract_addresses or trace['action']['from'] in contract_addresses
+            process_trace = to_address in watched or from_address in watched
         elif interaction_type == "to":
-            process_trace = trace['action']['to'] in contract_addresses
-        elif interaction_type == "from":
-            process_trace = trace['action']['from'] in contract_addresses
+            process_trace = to_address in watched
         else:
-            raise ValueError(f"Invalid interaction type: {interaction_type}. Allowed values are 'both', 'to', 'from'.")
+            process_trace = from_address in watched
 
         # If the trace matches the filtering criteria
         if process_trace:
-            # If the trace 'to' address is a contract address, attempt to decode it
-            if trace['action']['to'] in contract_addresses:
-                decoded_data = decode_transaction(w3, {'to': trace['action']['to'], 'input': trace['action'].get('input', '0x')}, trace['action']['to'])
-            else:
-                decoded_data = None
-
             results.append({
+                "block_number": trace.get("blockNumber"),
+                "transaction_hash": trace.get("transactionHash"),
                 "trace_type": trace["type"],
                 "from": trace['action']['from'],
-                "to": trace['action']['to'],
-                "decoded": decoded_data
+                "to": trace['action'].get('to'),
+                "decoded": None
             })
 
+            # If the trace 'to' address is a contract address, attempt to decode it
+            if to_address in watched:
+                to_decode.append((len(results) - 1, Web3.to_checksum_address(to_address), trace['action'].get('input', '0x')))
+
+    # Decode every match at once, in worker processes when enabled with set_decode_processes
+    decoded_inputs = decode_inputs([(contract_address, input_data) for _, contract_address, input_data in to_decode])
+    for (index, _, _), decoded_data in zip(to_decode, decoded_inputs):
+        results[index]["decoded"] = decoded_data
+
     # Return only traces with decoded data
     return [result for result in results if result["decoded"] is not None]
 
 
+def get_traces(block_identifier: Union[int, str], contract_addresses: List[str], interaction_type: str = "both"):
+    # Convert block number to block hash format if it's a number. Otherwise, use the given block hash.
+    if isinstance(block_identifier, int):
+        block_param = hex(block_identifier)
+    else:
+        block_param = block_identifier
+
+    traces = trace_rpc("trace_block", [block_param])
+    return filter_traces(traces, contract_addresses, interaction_type)
+
+
+def _trace_key(trace):
+    """ Identifies a trace across trace_filter queries """
+    return trace.get("transactionHash"), tuple(trace["traceAddress"])
+
+
+def iter_filtered_traces(from_block: int, to_block: int, contract_addresses: List[str], interaction_type: str = "both", page_size: int = DEFAULT_TRACE_PAGE_SIZE):
+    """
+    Yield the decoded traces of a block range matched by the node with trace_filter, one page of `page_size` traces at a time.
+
+    https://docs.alchemy.com/reference/trace-filter
+    Only traces from/to the contracts are sent back, instead of every trace of every block. A filter with both
+    fromAddress and toAddress matches the traces from AND to the addresses, so "both" runs one query per side: the
+    traces sent from the contracts first, then the ones sent to them, skipping the calls between two watched
+    contracts already returned by the first query.
+    """
+    sides = {"both": ("fromAddress", "toAddress"), "from": ("fromAddress",), "to": ("toAddress",)}[interaction_type]
+    watched = {address.lower() for address in contract_addresses}
+    # (transaction hash, trace address) of the traces returned by both queries, seen in the first one
+    seen = set()
+
+    for side in sides:
+        trace_filter = {"fromBlock": hex(from_block), "toBlock": hex(to_block), "count": page_size, side: contract_addresses}
+        after = 0
+        while True:
+            page = trace_rpc("trace_filter", [{**trace_filter, "after": after}])
+            traces = page
+            if interaction_type == "both" and side == "fromAddress":
+                seen.update(_trace_key(trace) for trace in page if (trace['action'].get('to') or '').lower() in watched)
+            elif interaction_type == "both":
+                traces = [trace for trace in page if _trace_key(trace) not in seen]
+            yield filter_traces(traces, contract_addresses, interaction_type)
+            if len(page) < page_size:
+                break
+            after += len(page)
+
+
+def iter_traces_range(from_block: int, to_block: int, contract_addresses: List[str], interaction_type: str = "both", page_size: int = DEFAULT_TRACE_PAGE_SIZE):
+    """
+    Yield the decoded traces of the blocks from `from_block` to `to_block` (inclusive) as they arrive.
+
+    Uses trace_filter when the node serves it, and falls back to one trace_block call per block otherwise.
+    """
+    try:
+        yield from iter_filtered_traces(from_block, to_block, contract_addresses, interaction_type, page_size)
+        return
+    except TraceFilterUnsupported as e:
+        # Nothing has been yielded yet: the first page is the one that fails
+        print(f"trace_filter is not available ({e}), falling back to trace_block per block")
+
+    for block_number in range(from_block, to_block + 1):
+        yield get_traces(block_number, contract_addresses, interaction_type)
+
+
+def scan_traces_range(from_block: int, to_block: int, contract_addresses: List[str], output_path: str, interaction_type: str = "both", page_size: int = DEFAULT_TRACE_PAGE_SIZE):
+    """
+    Stream the decoded traces of a block range to a JSON Lines (default) or Parquet (.parquet) file.
+
+    Returns:
+    - int: Number of traces written.
+    """
+    count = 0
+    with open_sink(output_path) as sink:
+        for results in iter_traces_range(from_block, to_block, contract_addresses, interaction_type, page_size):
+            sink.write(results)
+            count += len(results)
+    print(f"{count} traces written successfully to {output_path}!")
+    return count
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Fetch and decode Ethereum traces for a block and list of contract addresses.')
+
+    # Adding command line arguments
+    parser.add_argument('-b', '--block', type=int, help='Block identifier. If not provided, a default will be used.')
+    parser.add_argument('-a', '--addresses', type=str, nargs='+', help='List of contract addresses. If not provided, default addresses will be used.')
+    parser.add_argument('--from-block', type=int, help='First block of a range scan, results are streamed to --output', default=None)
+    parser.add_argument('--to-block', type=int, help='Last block (inclusive) of a range scan. Defaults to --from-block', default=None)
+    parser.add_argument('-o', '--output', type=str, help='Output of a range scan, .jsonl or .parquet. Defaults to data/traces_<from>_<to>.jsonl', default=None)
+
+    parser.add_argument('--follow', action='store_true', help='Decode the traces of every new block as it arrives (from --from-block, or the head), appending to --output')
+    parser.add_argument('--decode-processes', type=int, help='Number of worker processes decoding inputs, 0 decodes in the main process', default=0)
+
+    args = parser.parse_args()
+    if args.follow and args.output and args.output.endswith(".parquet"):
+        # Parquet files are only readable once closed, and rows would wait in the row group buffer
+        parser.error("--follow writes every block as it arrives, use a .jsonl --output")
+
+    # Check if any arguments were provided
+    if args.block or args.addresses or args.from_block is not None or args.follow:
+        return args
+    return None
+
+
 contract_addresses = [UNISWAP_V2_FACTORY_ADDR, UNISWAP_V3_FACTORY_ADDR]
 block_identifier = 10008355
 
 
 def run():
     args = parse_args()
+    if args:
+        set_decode_processes(args.decode_processes)
+
+    if args and args.follow:
+        addresses_to_use = args.addresses if args.addresses else contract_addresses
+        fetch_abis(addresses_to_use)
+        # Appended to: a restarted follow job keeps the rows and retractions written before it
+        with open_sink(args.output or f"{ROOT_DIRECTORY}/data/traces_follow.jsonl", append=True) as sink:
+            follow_to_sink(w3, lambda block: get_traces(block.number, addresses_to_use), sink, from_block=args.from_block)
+        return
+
+    if args and args.from_block is not None:
+        to_block = args.to_block if args.to_block is not None else args.from_block
+        addresses_to_use = args.addresses if args.addresses else contract_addresses
+        output_path = args.output or f"{ROOT_DIRECTORY}/data/traces_{args.from_block}_{to_block}.jsonl"
+        fetch_abis(addresses_to_use)
+        scan_traces_range(args.from_block, to_block, addresses_to_use, output_path)
+        log_decode_stats()
+        return
 
     if args:
         # Use provided block_identifier or default
@@ -94,13 +260,13 @@ def run():
         else:
             addresses_to_use = [addr.strip() for addr in input_addresses.split(',')]
 
-    # Save ABI locally
-    for contract in addresses_to_use:
-        save_abi_locally(contract)
+    # Fetch the missing ABIs into the ABI registry
+    fetch_abis(addresses_to_use)
 
     # Fetch transactions for provided block and addresses
-    print(f"Returned traces for addresses {addresses_to_use} and for block {block_identifier}:")
+    print(f"Returned traces for addresses {addresses_to_use} and for block {block_identifier_to_use}:")
     print(get_traces(block_identifier_to_use, addresses_to_use))
+    log_decode_stats()
 
 
 if __name__ == "__main__":
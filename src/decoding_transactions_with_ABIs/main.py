@@ -2,13 +2,21 @@ from typing import List
 from dotenv import load_dotenv
 load_dotenv()
 import argparse
-from web3 import Web3
+import os
+from concurrent.futures import ThreadPoolExecutor
 
+from src.abi_registry import fetch_abis
 from src.constants import *
-from src.utils import save_abi_locally, decode_transaction
+from src.decoder_registry import decode_inputs, log_decode_stats, set_decode_processes
+from src.bloom import filter_blocks_by_bloom
+from src.follow import follow_to_sink
+from src.rpc import get_web3
+from src.sinks import open_sink
 
 
-w3 = Web3(Web3.HTTPProvider(os.environ.get('ETHEREUM_HTTP_ENDPOINT')))  # https://www.quicknode.com/
+w3 = get_web3('ETHEREUM_HTTP_ENDPOINT')  # https://www.quicknode.com/
+
+DEFAULT_MAX_WORKERS = 8
 
 
 def get_transactions(block_identifier: int, contract_addresses: List[str], interaction_type: str = "both"):
@@ -31,7 +39,21 @@ def get_transactions(block_identifier: int, contract_addresses: List[str], inter
     but if you wanted to, you could look for the from field being one of the contract addresses.
     """
     block = w3.eth.get_block(block_identifier, full_transactions=True)
+    return filter_transactions(block, contract_addresses, interaction_type)
+
+
+def select_transactions(block, contract_addresses: List[str], interaction_type: str = "both"):
+    """
+    Keep the transactions of a block fetched with full transactions that interact with the given contracts, without
+    decoding them yet. See `get_transactions` for the meaning of `interaction_type`.
+
+    Returns:
+    - tuple: (results, to_decode), the matches and the (index in results, contract address, input) of the ones sent
+      to a contract, for `decode_selected`.
+    """
     results = []
+    # (index in results, contract address, input) of the matches sent to a contract, decoded together at the end
+    to_decode = []
 
     for transaction in block.transactions:
         # Depending on the interaction type, decide if the transaction should be processed
@@ -48,17 +70,94 @@ def get_transactions(block_identifier: int, contract_addresses: List[str], inter
 
         # If the transaction matches the filtering criteria
         if process_transaction:
-            # If the transaction 'to' address is a contract address, attempt to decode it
-            decoded_data = decode_transaction(w3, transaction, transaction['to']) if transaction['to'] in contract_addresses else None
-
             results.append({
                 "transaction_hash": transaction.hash.hex(),
                 "contract_address": transaction['to'] if transaction['to'] in contract_addresses else transaction['from'],
-                "decoded": decoded_data
+                "decoded": None
             })
 
-    # Return only transactions with decoded data (i.e., only those which interacted 'to' a contract and were decodable)
-    return [result for result in results if result["decoded"] is not None]
+            # If the transaction 'to' address is a contract address, attempt to decode it
+            if transaction['to'] in contract_addresses:
+                to_decode.append((len(results) - 1, transaction['to'], transaction['input']))
+
+    return results, to_decode
+
+
+def decode_selected(selections):
+    """
+    Decode the matches of several blocks, as returned by `select_transactions`, in one `decode_inputs` call: range
+    scans hand it a whole window of blocks, enough inputs to be worth the worker processes.
+
+    Returns:
+    - list: For every selection, its transactions with decoded data (i.e., only those which interacted 'to' a
+      contract and were decodable).
+    """
+    # Decode every match at once, in worker processes when enabled with set_decode_processes
+    decoded_inputs = iter(decode_inputs([(contract_address, input_data) for _, to_decode in selections for _, contract_address, input_data in to_decode]))
+    decoded_results = []
+    for results, to_decode in selections:
+        for index, _, _ in to_decode:
+            results[index]["decoded"] = next(decoded_inputs)
+        decoded_results.append([result for result in results if result["decoded"] is not None])
+    return decoded_results
+
+
+def filter_transactions(block, contract_addresses: List[str], interaction_type: str = "both"):
+    """
+    Keep the transactions of a block fetched with full transactions that interact with the given contracts,
+    and decode them. See `get_transactions` for the meaning of `interaction_type`.
+    """
+    return decode_selected([select_transactions(block, contract_addresses, interaction_type)])[0]
+
+
+def iter_transactions_range(from_block: int, to_block: int, contract_addresses: List[str], interaction_type: str = "both", max_workers: int = DEFAULT_MAX_WORKERS,
+                            bloom_filter: bool = False, topics: List[str] = None):
+    """
+    Fetch the blocks from `from_block` to `to_block` (inclusive) concurrently and yield their decoded transactions in block order.
+
+    At most `max_workers * 4` blocks are in flight at once, so memory does not grow with the length of the range.
+    The matching transactions of those blocks are decoded together, see `decode_selected`.
+
+    With `bloom_filter`, the headers of each window are fetched first and only the blocks whose logsBloom might
+    contain a log of the contracts (and of one of `topics` when given) are downloaded with their full transactions.
+    Without `topics`, the blocks pruned this way are confirmed with trace_filter on the trace endpoint, so
+    transactions that emit no log are still returned (see `filter_blocks_by_bloom`). With `topics`, only the
+    blocks that may hold one of those events are fetched.
+
+    Yields:
+    - tuple: (block number, list of decoded transactions as returned by `get_transactions`)
+    """
+    window = max_workers * 4
+    # trace_filter is served by the endpoint the traces are decoded from, when one is configured
+    trace_w3 = get_web3('ETHEREUM_HTTP_ENDPOINT_ALCHEMY') if os.environ.get('ETHEREUM_HTTP_ENDPOINT_ALCHEMY') else w3
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for start in range(from_block, to_block + 1, window):
+            window_blocks = list(range(start, min(start + window, to_block + 1)))
+            fetched_blocks = filter_blocks_by_bloom(w3, window_blocks, contract_addresses, topics, interaction_type, trace_w3) if bloom_filter else window_blocks
+            selections = executor.map(lambda block_number: select_transactions(w3.eth.get_block(block_number, full_transactions=True), contract_addresses, interaction_type), fetched_blocks)
+            # The inputs of the whole window are decoded together
+            results_per_block = dict(zip(fetched_blocks, decode_selected(list(selections))))
+            for block_number in window_blocks:
+                yield block_number, results_per_block.get(block_number, [])
+
+
+def scan_transactions_range(from_block: int, to_block: int, contract_addresses: List[str], output_path: str, interaction_type: str = "both", max_workers: int = DEFAULT_MAX_WORKERS,
+                            bloom_filter: bool = False, topics: List[str] = None):
+    """
+    Stream the decoded transactions of a block range to a JSON Lines (default) or Parquet (.parquet) file as blocks arrive.
+
+    Returns:
+    - int: Number of transactions written.
+    """
+    count = 0
+    with open_sink(output_path) as sink:
+        for block_number, results in iter_transactions_range(from_block, to_block, contract_addresses, interaction_type, max_workers, bloom_filter, topics):
+            sink.write([{"block_number": block_number, **result} for result in results])
+            count += len(results)
+            if block_number % 100 == 0:
+                print(f"Scanned up to block {block_number}, {count} transactions written")
+    print(f"{count} transactions written successfully to {output_path}!")
+    return count
 
 
 def parse_args():
@@ -67,11 +166,23 @@ def parse_args():
     # Adding command line arguments
     parser.add_argument('-b', '--block', type=int, help='Block identifier. If not provided, a default will be used.')
     parser.add_argument('-a', '--addresses', type=str, nargs='+', help='List of contract addresses. If not provided, default addresses will be used.')
+    parser.add_argument('--from-block', type=int, help='First block of a range scan, results are streamed to --output', default=None)
+    parser.add_argument('--to-block', type=int, help='Last block (inclusive) of a range scan. Defaults to --from-block', default=None)
+    parser.add_argument('-o', '--output', type=str, help='Output of a range scan, .jsonl or .parquet. Defaults to data/transactions_<from>_<to>.jsonl', default=None)
+    parser.add_argument('--workers', type=int, help='Number of blocks fetched concurrently in a range scan', default=DEFAULT_MAX_WORKERS)
+
+    parser.add_argument('--follow', action='store_true', help='Decode every new block as it arrives (from --from-block, or the head), appending to --output')
+    parser.add_argument('--decode-processes', type=int, help='Number of worker processes decoding inputs, 0 decodes in the main process', default=0)
+    parser.add_argument('--bloom-filter', action='store_true', help='Skip blocks whose logsBloom has no log of the contracts in a range scan, confirmed with trace_filter unless --topics is given')
+    parser.add_argument('--topics', type=str, nargs='+', help='Only fetch blocks whose logsBloom may contain one of these event topics with --bloom-filter', default=None)
 
     args = parser.parse_args()
+    if args.follow and args.output and args.output.endswith(".parquet"):
+        # Parquet files are only readable once closed, and rows would wait in the row group buffer
+        parser.error("--follow writes every block as it arrives, use a .jsonl --output")
 
     # Check if any arguments were provided
-    if args.block or args.addresses:
+    if args.block or args.addresses or args.from_block is not None or args.follow:
         return args
     return None
 
@@ -82,6 +193,25 @@ block_identifier = 10008355
 
 def run():
     args = parse_args()
+    if args:
+        set_decode_processes(args.decode_processes)
+
+    if args and args.follow:
+        addresses_to_use = args.addresses if args.addresses else contract_addresses
+        fetch_abis(addresses_to_use)
+        # Appended to: a restarted follow job keeps the rows and retractions written before it
+        with open_sink(args.output or f"{ROOT_DIRECTORY}/data/transactions_follow.jsonl", append=True) as sink:
+            follow_to_sink(w3, lambda block: filter_transactions(block, addresses_to_use), sink, from_block=args.from_block, full_transactions=True)
+        return
+
+    if args and args.from_block is not None:
+        to_block = args.to_block if args.to_block is not None else args.from_block
+        addresses_to_use = args.addresses if args.addresses else contract_addresses
+        output_path = args.output or f"{ROOT_DIRECTORY}/data/transactions_{args.from_block}_{to_block}.jsonl"
+        fetch_abis(addresses_to_use)
+        scan_transactions_range(args.from_block, to_block, addresses_to_use, output_path, max_workers=args.workers, bloom_filter=args.bloom_filter, topics=args.topics)
+        log_decode_stats()
+        return
 
     if args:
         # Use provided block_identifier or default
@@ -99,13 +229,13 @@ def run():
         else:
             addresses_to_use = [addr.strip() for addr in input_addresses.split(',')]
 
-    # Save ABI locally
-    for contract in addresses_to_use:
-        save_abi_locally(contract)
+    # Fetch the missing ABIs into the ABI registry
+    fetch_abis(addresses_to_use)
 
     # Fetch transactions for provided block and addresses
-    print(f"Returned transactions for addresses {addresses_to_use} and for block {block_identifier}:")
+    print(f"Returned transactions for addresses {addresses_to_use} and for block {block_identifier_to_use}:")
     print(get_transactions(block_identifier_to_use, addresses_to_use))
+    log_decode_stats()
 
 
 if __name__ == "__main__":
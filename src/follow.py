@@ -0,0 +1,156 @@
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+
+from web3.exceptions import BlockNotFound
+
+from src.sinks import ParquetSink
+
+# Blocks remembered to detect reorgs: a reorg deeper than this is not seen
+DEFAULT_MAX_REORG_DEPTH = 64
+# Polling interval once the next block is due, and the slowest interval while a block is late
+MIN_POLL_INTERVAL = 0.2
+MAX_POLL_INTERVAL = 1.0
+
+
+def _subscribe_new_heads(ws_endpoint):
+    """ Open a websocket subscription to newHeads, None when the endpoint cannot be reached """
+    try:
+        from websockets.sync.client import connect
+        connection = connect(ws_endpoint)
+        connection.send(json.dumps({"jsonrpc": "2.0", "id": 1, "method": "eth_subscribe", "params": ["newHeads"]}))
+        json.loads(connection.recv(timeout=10))
+        return connection
+    except Exception as e:
+        logging.warning(f"Could not subscribe to newHeads on {ws_endpoint} ({e}), polling instead")
+        return None
+
+
+def wait_for_head(w3, block_number, recent, last_block_timestamp, block_time, ws_connection=None, ws_endpoint=None):
+    """
+    Block until the head reaches `block_number`, or replaces one of the `recent` blocks (a reorg that did not make
+    the chain longer), and return the head block header.
+
+    With a websocket subscription, every newHeads notification wakes it up. Otherwise it sleeps until shortly before
+    the block is due (the timestamp of the previous block plus the estimated block time), then polls every
+    MIN_POLL_INTERVAL, slowing down to MAX_POLL_INTERVAL while the block is late. When the websocket connection is
+    closed, it subscribes again on `ws_endpoint`, and polls when that fails.
+
+    Returns:
+    - tuple: (head block, websocket connection to wait on next, None once polling)
+    """
+    while True:
+        head = w3.eth.get_block('latest')
+        if head.number >= block_number or recent.get(head.number, head.hash) != head.hash:
+            return head, ws_connection
+
+        if ws_connection is not None:
+            from websockets.exceptions import ConnectionClosed
+            try:
+                # Notifications are only a wake-up signal, the block is read from the HTTP endpoint like when polling
+                ws_connection.recv(timeout=MAX_POLL_INTERVAL * 5)
+            except TimeoutError:
+                pass
+            except ConnectionClosed as e:
+                logging.warning(f"newHeads subscription closed ({e}), subscribing again")
+                ws_connection = _subscribe_new_heads(ws_endpoint) if ws_endpoint else None
+            continue
+
+        # Until two blocks were seen, there is no estimate of the block time: poll
+        due_in = last_block_timestamp + block_time - time.time() if block_time else 0.0
+        if due_in > MIN_POLL_INTERVAL:
+            time.sleep(due_in - MIN_POLL_INTERVAL)
+        else:
+            time.sleep(min(MAX_POLL_INTERVAL, MIN_POLL_INTERVAL * (1 - due_in / block_time * 4)) if block_time else MIN_POLL_INTERVAL)
+
+
+def follow_blocks(w3, from_block=None, full_transactions=False, ws_endpoint=None, max_reorg_depth=DEFAULT_MAX_REORG_DEPTH):
+    """
+    Follow the chain head, yielding every new block as soon as it is seen, and a retraction for every block that a
+    reorg removed from the canonical chain.
+
+    Each block's parentHash is checked against the hash of the block yielded before it, and the hash of the head
+    against the block yielded at its height. On a mismatch, the yielded blocks from that height are retracted and
+    read again, walking back until the chains join.
+
+    Try it on a local dev chain, e.g. `anvil --block-time 1`, with reorgs triggered by its `anvil_reorg` method.
+
+    Args:
+    - w3: The Web3 instance to read blocks with.
+    - from_block (int, optional): First block to yield. Defaults to the current head.
+    - full_transactions (bool): Read blocks with their full transactions.
+    - ws_endpoint (str, optional): Websocket endpoint notifying new heads, instead of polling.
+    - max_reorg_depth (int): Number of recent blocks remembered to detect reorgs.
+
+    Yields:
+    - tuple: ("block", block) for a new canonical block, ("retract", block number, block hash) for a reorged block.
+    """
+    recent = OrderedDict()
+    next_block = from_block if from_block is not None else w3.eth.block_number
+    ws_connection = _subscribe_new_heads(ws_endpoint) if ws_endpoint else None
+    block_time, previous_timestamp = None, None
+
+    while True:
+        head, ws_connection = wait_for_head(w3, next_block, recent, previous_timestamp or 0, block_time, ws_connection, ws_endpoint)
+        # A head below the next block means the last blocks were replaced by as many others
+        next_block = min(next_block, head.number)
+        while next_block <= head.number:
+            # Blocks already yielded at this height were reorged out
+            while recent and next(reversed(recent)) >= next_block:
+                retracted_block, retracted_hash = recent.popitem()
+                logging.info(f"Reorg at block {retracted_block}, retracting {retracted_hash.hex()}")
+                yield "retract", retracted_block, retracted_hash
+
+            try:
+                block = w3.eth.get_block(next_block, full_transactions=full_transactions)
+            except BlockNotFound:
+                # Load balanced endpoints can answer from a node slightly behind the one that reported the head
+                break
+
+            parent_hash = recent.get(next_block - 1)
+            if parent_hash is not None and block.parentHash != parent_hash:
+                retracted_block, retracted_hash = recent.popitem()
+                logging.info(f"Reorg at block {retracted_block}, retracting {retracted_hash.hex()}")
+                yield "retract", retracted_block, retracted_hash
+                next_block = retracted_block
+                continue
+
+            recent[next_block] = block.hash
+            if len(recent) > max_reorg_depth:
+                recent.popitem(last=False)
+
+            # Exponential moving average of the block time, from the timestamps of consecutive blocks
+            if previous_timestamp is not None and block.timestamp > previous_timestamp:
+                interval = block.timestamp - previous_timestamp
+                block_time = interval if block_time is None else 0.8 * block_time + 0.2 * interval
+            previous_timestamp = block.timestamp
+
+            yield "block", block
+            next_block += 1
+
+
+def follow_to_sink(w3, process_block, sink, from_block=None, full_transactions=False, max_reorg_depth=DEFAULT_MAX_REORG_DEPTH):
+    """
+    Run `process_block(block)` on every new block and write its rows to `sink`, tagged with the block hash, and write
+    a retraction row for every reorged block. Readers drop the rows of a retracted block hash.
+
+    The websocket endpoint is read from the ETHEREUM_WS_ENDPOINT environment variable, polling is used without it.
+    Every block is written as soon as it is processed, so the sink must not buffer rows: Parquet files are rejected.
+    """
+    if isinstance(sink, ParquetSink):
+        raise ValueError("Following blocks needs a sink written block by block, use a JSON Lines output instead of Parquet")
+    ws_endpoint = os.environ.get('ETHEREUM_WS_ENDPOINT')
+    print(f"Following new blocks {'over ' + ws_endpoint if ws_endpoint else 'by polling'} ...")
+    for event in follow_blocks(w3, from_block, full_transactions, ws_endpoint, max_reorg_depth):
+        if event[0] == "retract":
+            _, block_number, block_hash = event
+            sink.write([{"event": "retract", "block_number": block_number, "block_hash": block_hash.hex()}])
+            continue
+
+        block = event[1]
+        rows = process_block(block)
+        sink.write([{"event": "add", "block_number": block.number, "block_hash": block.hash.hex(), **row} for row in rows])
+        if rows:
+            print(f"Block {block.number}: {len(rows)} matches, {time.time() - block.timestamp:.2f}s after the block timestamp")
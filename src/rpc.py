@@ -0,0 +1,179 @@
+import logging
+import os
+
+import requests
+from requests.adapters import HTTPAdapter
+from web3 import AsyncWeb3, Web3
+from web3.providers import AsyncHTTPProvider, HTTPProvider
+
+from src import rpc_cache
+
+# Most providers accept up to 100-1000 calls per batch, QuickNode and Alchemy both document 1000 as a hard
+# limit but start throttling large batches earlier, so stay well under that.
+DEFAULT_MAX_BATCH_SIZE = 100
+REQUEST_TIMEOUT = 60
+
+_session = None
+_web3_instances = {}
+_async_web3_instances = {}
+
+
+def get_session() -> requests.Session:
+    """
+    Return the keep-alive HTTP session shared by every module talking to an RPC endpoint.
+
+    The session keeps a pool of open connections per host, so consecutive calls skip the TCP and TLS handshakes.
+    """
+    global _session
+    if _session is None:
+        _session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=10, pool_maxsize=32)
+        _session.mount("http://", adapter)
+        _session.mount("https://", adapter)
+    return _session
+
+
+class BatchingHTTPProvider(HTTPProvider):
+    """
+    HTTP provider that shares one pooled session and can pack several calls into JSON-RPC batch arrays.
+
+    Single calls made through Web3 go out as usual, `make_batch_request` sends a list of calls as batches of at most
+    `max_batch_size` entries. `stats` counts the HTTP round trips and the calls that were coalesced into batches.
+
+    Both paths go through the on-disk cache of src/rpc_cache.py: requests about final blocks are answered from disk
+    when they were made before, and their responses are stored otherwise. `cache_hits` counts the calls served from disk.
+    """
+
+    def __init__(self, endpoint_uri, max_batch_size=DEFAULT_MAX_BATCH_SIZE):
+        super().__init__(endpoint_uri, request_kwargs={"timeout": REQUEST_TIMEOUT}, session=get_session())
+        self.max_batch_size = max_batch_size
+        self.stats = {"http_requests": 0, "rpc_calls": 0, "coalesced_calls": 0, "cache_hits": 0}
+
+    def _head_block(self):
+        return rpc_cache.get_head_block(self.endpoint_uri, lambda: int(self._send("eth_blockNumber", [])["result"], 16))
+
+    def _send(self, method, params):
+        self.stats["http_requests"] += 1
+        self.stats["rpc_calls"] += 1
+        return super().make_request(method, params)
+
+    def make_request(self, method, params):
+        hit, result = rpc_cache.lookup(method, params)
+        if hit:
+            self.stats["cache_hits"] += 1
+            return {"jsonrpc": "2.0", "id": next(self.request_counter), "result": result}
+
+        response = self._send(method, params)
+        if "result" in response:
+            rpc_cache.store(method, params, response["result"], self._head_block)
+        return response
+
+    def make_batch_request(self, calls):
+        """
+        Send a list of (method, params) calls as JSON-RPC batches.
+
+        Args:
+        - calls (list): List of (method, params) tuples.
+
+        Returns:
+        - list: The raw JSON-RPC responses (dicts with either 'result' or 'error'), in the same order as `calls`.
+        """
+        responses = [None] * len(calls)
+        missing = []
+        for index, (method, params) in enumerate(calls):
+            hit, result = rpc_cache.lookup(method, params)
+            if hit:
+                self.stats["cache_hits"] += 1
+                responses[index] = {"jsonrpc": "2.0", "id": None, "result": result}
+            else:
+                missing.append(index)
+
+        for start in range(0, len(missing), self.max_batch_size):
+            chunk_indexes = missing[start:start + self.max_batch_size]
+            chunk = [calls[index] for index in chunk_indexes]
+            payload = [{"jsonrpc": "2.0", "method": method, "params": params, "id": next(self.request_counter)} for method, params in chunk]
+
+            response = get_session().post(self.endpoint_uri, json=payload, timeout=REQUEST_TIMEOUT)
+            response.raise_for_status()
+            data = response.json()
+            if isinstance(data, dict):
+                # Some nodes answer a batch they reject with a single error object
+                raise ValueError(f"Batch request rejected by {self.endpoint_uri}: {data.get('error', data)}")
+
+            # The JSON-RPC spec allows responses in any order, match them back by id
+            responses_by_id = {entry.get("id"): entry for entry in data}
+            for index, request in zip(chunk_indexes, payload):
+                responses[index] = responses_by_id.get(request["id"], {"error": {"message": "missing response in batch"}})
+                if "result" in responses[index]:
+                    rpc_cache.store(request["method"], request["params"], responses[index]["result"], self._head_block)
+
+            self.stats["http_requests"] += 1
+            self.stats["rpc_calls"] += len(chunk)
+            self.stats["coalesced_calls"] += len(chunk) - 1
+        return responses
+
+
+def get_web3(endpoint_env='ETHEREUM_HTTP_ENDPOINT', max_batch_size=DEFAULT_MAX_BATCH_SIZE) -> Web3:
+    """
+    Return the Web3 instance for the endpoint stored in the given environment variable, creating it on first use.
+
+    Every module asking for the same endpoint gets the same instance, and all instances share one HTTP session.
+    """
+    endpoint_uri = os.environ.get(endpoint_env)
+    if endpoint_uri not in _web3_instances:
+        _web3_instances[endpoint_uri] = Web3(BatchingHTTPProvider(endpoint_uri, max_batch_size=max_batch_size))
+    return _web3_instances[endpoint_uri]
+
+
+def get_async_web3(endpoint_env='ETHEREUM_HTTP_ENDPOINT') -> AsyncWeb3:
+    """
+    Return the AsyncWeb3 instance for the endpoint stored in the given environment variable, creating it on first use.
+
+    The provider keeps its own aiohttp session, so concurrent calls reuse pooled keep-alive connections.
+    """
+    endpoint_uri = os.environ.get(endpoint_env)
+    if endpoint_uri not in _async_web3_instances:
+        _async_web3_instances[endpoint_uri] = AsyncWeb3(AsyncHTTPProvider(endpoint_uri, request_kwargs={"timeout": REQUEST_TIMEOUT}))
+    return _async_web3_instances[endpoint_uri]
+
+
+def batch_call(w3, calls, raise_on_error=True):
+    """
+    Execute a list of raw JSON-RPC calls, batched when the provider supports it.
+
+    Args:
+    - w3: The Web3 instance to use.
+    - calls (list): List of (method, params) tuples, e.g. `[("eth_getBlockByNumber", [hex(n), False]) for n in blocks]`.
+    - raise_on_error (bool): If True, raise on the first error response. Otherwise failed calls return None.
+
+    Returns:
+    - list: The unformatted 'result' of every call, in the same order as `calls`.
+    """
+    if hasattr(w3.provider, "make_batch_request"):
+        responses = w3.provider.make_batch_request(calls)
+    else:
+        responses = [w3.provider.make_request(method, params) for method, params in calls]
+
+    results = []
+    for (method, params), response in zip(calls, responses):
+        if "error" in response:
+            if raise_on_error:
+                raise ValueError(f"RPC call {method}{params} failed: {response['error']}")
+            results.append(None)
+        else:
+            results.append(response["result"])
+    return results
+
+
+def rpc_stats() -> dict:
+    """ Sum the request counters of every provider created through `get_web3` """
+    totals = {"http_requests": 0, "rpc_calls": 0, "coalesced_calls": 0, "cache_hits": 0}
+    for w3 in _web3_instances.values():
+        for key, value in getattr(w3.provider, "stats", {}).items():
+            totals[key] += value
+    return totals
+
+
+def log_rpc_stats():
+    stats = rpc_stats()
+    logging.info(f"RPC calls: {stats['rpc_calls']}, HTTP requests: {stats['http_requests']}, coalesced into batches: {stats['coalesced_calls']}, served from the cache: {stats['cache_hits']}")
@@ -0,0 +1,205 @@
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+from src.constants import ROOT_DIRECTORY
+
+# Responses about blocks that can no longer be reorged never change, so they are kept on disk keyed by the hash of
+# the request (method and params) and served without any network call on later runs. Requests on `latest`,
+# `pending` or recent blocks always go to the node.
+RPC_CACHE_PATH = f"{ROOT_DIRECTORY}/data/rpc_cache.sqlite"
+RPC_CACHE_ENABLED = os.environ.get("RPC_CACHE", "1") != "0"
+# Blocks at least this deep below the head are treated as final (about two epochs on mainnet)
+FINALITY_DEPTH = int(os.environ.get("RPC_CACHE_FINALITY_DEPTH", 64))
+# Total size of the compressed responses, least recently used entries are evicted beyond it
+MAX_CACHE_BYTES = int(os.environ.get("RPC_CACHE_MAX_BYTES", 2 * 1024 ** 3))
+# Part of every key, so caches of different chains never mix. Every endpoint of this repo is mainnet (chain id 1).
+CACHE_NAMESPACE = os.environ.get("RPC_CACHE_NAMESPACE", "1")
+HEAD_TTL_SECONDS = 12
+
+# Position of the block number in the params of the methods whose result only depends on that block
+BLOCK_PARAM_INDEX = {
+    "eth_getBlockByNumber": 0,
+    "eth_getBlockReceipts": 0,
+    "eth_call": 1,
+    "eth_getBalance": 1,
+    "eth_getCode": 1,
+    "eth_getTransactionCount": 1,
+    "eth_getStorageAt": 2,
+    "trace_block": 0,
+    "trace_replayBlockTransactions": 0,
+}
+# Methods taking a filter object, final when its `toBlock` is
+RANGE_METHODS = {"eth_getLogs", "trace_filter"}
+# Methods taking a hash, final when the block of the result is
+HASH_METHODS = {"eth_getBlockByHash", "eth_getTransactionByHash", "eth_getTransactionReceipt", "trace_transaction"}
+
+_connection = None
+_lock = threading.Lock()
+_total_bytes = None
+_heads = {}
+
+
+def _get_connection():
+    global _connection
+    if _connection is None:
+        _connection = sqlite3.connect(RPC_CACHE_PATH, check_same_thread=False)
+        _connection.executescript("""
+            CREATE TABLE IF NOT EXISTS responses (key BLOB PRIMARY KEY, method TEXT NOT NULL, value BLOB NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL);
+            CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access);
+        """)
+    return _connection
+
+
+def _to_block_number(block_identifier):
+    """ Block number of a hex quantity or int param, None for tags such as 'latest', 'pending' or 'safe' """
+    if isinstance(block_identifier, int):
+        return block_identifier
+    if isinstance(block_identifier, str) and block_identifier.startswith("0x"):
+        return int(block_identifier, 16)
+    return None
+
+
+def request_block(method, params):
+    """
+    Block a request is about, when it can be known from the params.
+
+    Returns:
+    - int or None: The block number, or None when the request targets a tag or is not cacheable from its params.
+    """
+    if method in BLOCK_PARAM_INDEX:
+        index = BLOCK_PARAM_INDEX[method]
+        return _to_block_number(params[index]) if len(params) > index else None
+    if method in RANGE_METHODS and params and isinstance(params[0], dict) and "blockHash" not in params[0]:
+        return _to_block_number(params[0].get("toBlock"))
+    return None
+
+
+def result_block(method, result):
+    """ Block of the result of a hash based request, None when it is not mined yet """
+    if method == "trace_transaction":
+        return _to_block_number(result[0].get("blockNumber")) if result else None
+    if isinstance(result, dict):
+        return _to_block_number(result.get("blockNumber") or result.get("number"))
+    return None
+
+
+def is_cacheable(method):
+    return RPC_CACHE_ENABLED and (method in BLOCK_PARAM_INDEX or method in RANGE_METHODS or method in HASH_METHODS)
+
+
+def cache_key(method, params):
+    request = json.dumps([CACHE_NAMESPACE, method, params], sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(request.encode()).digest()
+
+
+def get_head_block(name, fetch_head):
+    """ Head block of the endpoint `name`, fetched with `fetch_head()` at most once every HEAD_TTL_SECONDS """
+    head, fetched_at = _heads.get(name, (None, 0))
+    if time.time() - fetched_at > HEAD_TTL_SECONDS:
+        head = fetch_head()
+        _heads[name] = (head, time.time())
+    return head
+
+
+def lookup(method, params):
+    """
+    Returns:
+    - tuple: (True, cached result) on a hit, (False, None) on a miss.
+    """
+    if not is_cacheable(method):
+        return False, None
+    key = cache_key(method, params)
+    with _lock:
+        connection = _get_connection()
+        rows = connection.execute("SELECT value FROM responses WHERE key = ?", (key,)).fetchall()
+        if not rows:
+            return False, None
+        connection.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+        connection.commit()
+    return True, json.loads(zlib.decompress(rows[0][0]))
+
+
+def store(method, params, result, head_block):
+    """
+    Cache the result of a request when the block it is about is at least FINALITY_DEPTH blocks below `head_block`.
+
+    Args:
+    - head_block (callable): Returns the current head block number, only called when the request may be cached.
+    """
+    if not is_cacheable(method) or result is None:
+        return
+    block = result_block(method, result) if method in HASH_METHODS else request_block(method, params)
+    if block is None or block > head_block() - FINALITY_DEPTH:
+        return
+
+    value = zlib.compress(json.dumps(result, separators=(",", ":")).encode())
+    key = cache_key(method, params)
+    with _lock:
+        connection = _get_connection()
+        with connection:
+            # A response stored again (e.g. by concurrent misses) replaces the previous one, whose size is freed
+            replaced = connection.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            connection.execute("INSERT OR REPLACE INTO responses (key, method, value, size, last_access) VALUES (?, ?, ?, ?, ?)",
+                               (key, method, value, len(value), time.time()))
+        _evict(connection, len(value) - (replaced[0] if replaced else 0))
+
+
+def _evict(connection, added_bytes):
+    """ Remove the least recently used responses once the cache is over MAX_CACHE_BYTES, down to 90% of it """
+    global _total_bytes
+    if _total_bytes is None:
+        _total_bytes = connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+    else:
+        _total_bytes += added_bytes
+    if _total_bytes <= MAX_CACHE_BYTES:
+        return
+
+    target = MAX_CACHE_BYTES * 0.9
+    with connection:
+        for key, size in connection.execute("SELECT key, size FROM responses ORDER BY last_access").fetchall():
+            if _total_bytes <= target:
+                break
+            connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+            _total_bytes -= size
+
+
+def clear():
+    global _total_bytes
+    with _lock:
+        connection = _get_connection()
+        with connection:
+            connection.execute("DELETE FROM responses")
+        connection.execute("VACUUM")
+        _total_bytes = 0
+    print(f"Cleared the RPC cache at {RPC_CACHE_PATH}")
+
+
+def cache_stats():
+    with _lock:
+        rows = _get_connection().execute("SELECT method, COUNT(*), SUM(size) FROM responses GROUP BY method ORDER BY method").fetchall()
+    return {method: {"responses": count, "bytes": size} for method, count, size in rows}
+
+
+def run():
+    parser = argparse.ArgumentParser(description='Manage the on-disk cache of RPC responses about finalized blocks.')
+    parser.add_argument('--clear', action='store_true', help='Remove every cached response')
+    parser.add_argument('--stats', action='store_true', help='Print the number and size of the cached responses per method')
+    args = parser.parse_args()
+
+    if args.clear:
+        clear()
+    elif args.stats:
+        for method, stats in cache_stats().items():
+            print(f"{method}: {stats['responses']} responses, {stats['bytes'] / 1024 ** 2:.1f} MB")
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    run()
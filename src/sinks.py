@@ -0,0 +1,109 @@
+import json
+import os
+
+from hexbytes import HexBytes
+
+# Rows written to a Parquet row group at once, bounds the memory used by the Parquet writer
+PARQUET_ROW_GROUP_SIZE = 10_000
+
+
+def _json_default(value):
+    """ JSON encoding of the values returned by web3 and eth_abi decoding (bytes, HexBytes, AttributeDict) """
+    if isinstance(value, (bytes, bytearray, HexBytes)):
+        return HexBytes(value).hex()
+    if hasattr(value, "items"):
+        return dict(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def to_json(value):
+    return json.dumps(value, default=_json_default)
+
+
+class JsonlSink:
+    """
+    Write rows to a JSON Lines file, one object per line, flushed after every write.
+
+    An existing file is replaced, so running a scan again does not duplicate its rows, unless `append` is set to
+    continue the file of an interrupted run.
+    """
+
+    def __init__(self, path, append=False):
+        self.path = path
+        self.file = open(path, 'a' if append else 'w')
+
+    def write(self, rows):
+        for row in rows:
+            self.file.write(to_json(row) + "\n")
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ParquetSink:
+    """
+    Write rows to a Parquet file in row groups of `row_group_size` rows.
+
+    Nested values (dicts and lists) are stored as JSON strings so every row group shares the schema of the first one.
+    Requires pyarrow, which is only imported when a Parquet file is written.
+    """
+
+    def __init__(self, path, row_group_size=PARQUET_ROW_GROUP_SIZE):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("Writing Parquet files requires pyarrow: pip install pyarrow")
+        self.pyarrow = pyarrow
+        self.path = path
+        self.row_group_size = row_group_size
+        self.buffer = []
+        self.writer = None
+
+    def _flatten(self, row):
+        return {key: to_json(value) if isinstance(value, (dict, list, tuple)) else value for key, value in row.items()}
+
+    def _flush(self):
+        if not self.buffer:
+            return
+        table = self.pyarrow.Table.from_pylist(self.buffer, schema=self.writer.schema if self.writer else None)
+        if self.writer is None:
+            self.writer = self.pyarrow.parquet.ParquetWriter(self.path, table.schema)
+        self.writer.write_table(table)
+        self.buffer = []
+
+    def write(self, rows):
+        self.buffer += [self._flatten(row) for row in rows]
+        if len(self.buffer) >= self.row_group_size:
+            self._flush()
+
+    def close(self):
+        self._flush()
+        if self.writer is not None:
+            self.writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def open_sink(path, append=False):
+    """
+    Return the sink matching the extension of `path`: .parquet for Parquet, anything else for JSON Lines.
+    `append` continues an existing JSON Lines file instead of replacing it, Parquet files are always replaced.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    if path.endswith(".parquet"):
+        if append:
+            raise ValueError(f"Parquet files cannot be appended to: {path}")
+        return ParquetSink(path)
+    return JsonlSink(path, append=append)
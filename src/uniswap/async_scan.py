@@ -0,0 +1,175 @@
+import asyncio
+from itertools import combinations
+
+from src.constants import *
+from src.constants import ERC20_ABI, UNISWAP_V2_FACTORY_ABI, UNISWAP_V2_POOL_ABI, UNISWAP_V3_FACTORY_ABI, UNISWAP_V3_POOL_ABI
+from src.rpc import get_async_web3
+from src.uniswap import metadata_cache
+from src.uniswap.uniswap import build_pool_rows
+
+DEFAULT_CONCURRENCY = 20
+
+
+async def _call(semaphore, contract_function, block_identifier='latest'):
+    """ Await a contract call while holding a slot of the concurrency limit """
+    async with semaphore:
+        return await contract_function.call(block_identifier=block_identifier)
+
+
+async def fetch_pair_pool_addresses(w3, semaphore, token0_address, token1_address, fee_tiers=UNISWAP_V3_TIERS_BPS):
+    """
+    Look up the v3 pools of every fee tier and the v2 pair of a token pair concurrently.
+
+    Returns:
+    - tuple: (list of v3 pool addresses, list of v2 pair addresses), without the zero address of missing pools.
+    """
+    v2_factory = w3.eth.contract(address=UNISWAP_V2_FACTORY_ADDR, abi=UNISWAP_V2_FACTORY_ABI)
+    v3_factory = w3.eth.contract(address=UNISWAP_V3_FACTORY_ADDR, abi=UNISWAP_V3_FACTORY_ABI)
+
+    async def lookup(version, contract_function, fee=0):
+        pool_address = metadata_cache.get_factory_pool(version, token0_address, token1_address, fee)
+        if not pool_address:
+            pool_address = await _call(semaphore, contract_function)
+            if pool_address != ZERO_ADDRESS:
+                metadata_cache.set_factory_pool(version, token0_address, token1_address, pool_address, fee)
+        return pool_address
+
+    lookups = [lookup("v3", v3_factory.functions.getPool(token0_address, token1_address, fee), fee) for fee in fee_tiers]
+    lookups.append(lookup("v2", v2_factory.functions.getPair(token0_address, token1_address)))
+    addresses = await asyncio.gather(*lookups)
+
+    v3_pool_addresses = [addr for addr in addresses[:-1] if addr != ZERO_ADDRESS]
+    v2_pool_addresses = [addr for addr in addresses[-1:] if addr != ZERO_ADDRESS]
+    return v3_pool_addresses, v2_pool_addresses
+
+
+async def _cached_call(semaphore, cached_value, contract_function):
+    """ Return the cached value if there is one, otherwise make the call """
+    if cached_value is not None:
+        return cached_value
+    return await _call(semaphore, contract_function)
+
+
+async def fetch_pool_state(w3, semaphore, pool_address, version):
+    """
+    Read the state of one pool, issuing every call that does not depend on a previous result at the same time.
+    token0/token1/fee and decimals come from the metadata cache when available.
+
+    Returns:
+    - dict: Pool state in the same format as `fetch_pool_states` in src/uniswap/uniswap.py.
+    """
+    metadata = metadata_cache.get_pool_metadata(pool_address) or {"token0": None, "token1": None, "fee": None}
+
+    if version == "v3":
+        pool_contract = w3.eth.contract(address=pool_address, abi=UNISWAP_V3_POOL_ABI)
+        token0_address, token1_address, slot0, fee = await asyncio.gather(
+            _cached_call(semaphore, metadata["token0"], pool_contract.functions.token0()),
+            _cached_call(semaphore, metadata["token1"], pool_contract.functions.token1()),
+            _call(semaphore, pool_contract.functions.slot0()),
+            _cached_call(semaphore, metadata["fee"], pool_contract.functions.fee()),
+        )
+        state = {"sqrt_price_x96": slot0[0], "fee": fee}
+    else:
+        pool_contract = w3.eth.contract(address=pool_address, abi=UNISWAP_V2_POOL_ABI)
+        token0_address, token1_address, reserves = await asyncio.gather(
+            _cached_call(semaphore, metadata["token0"], pool_contract.functions.token0()),
+            _cached_call(semaphore, metadata["token1"], pool_contract.functions.token1()),
+            _call(semaphore, pool_contract.functions.getReserves()),
+        )
+        state = {"token0_balance": reserves[0], "token1_balance": reserves[1]}
+        fee = None
+    if metadata["token0"] is None:
+        metadata_cache.set_pool_metadata(pool_address, version, token0_address, token1_address, fee)
+
+    token0_contract = w3.eth.contract(address=token0_address, abi=ERC20_ABI)
+    token1_contract = w3.eth.contract(address=token1_address, abi=ERC20_ABI)
+    cached_decimals = [metadata_cache.get_token_decimals(token0_address), metadata_cache.get_token_decimals(token1_address)]
+    calls = [_cached_call(semaphore, cached_decimals[0], token0_contract.functions.decimals()),
+             _cached_call(semaphore, cached_decimals[1], token1_contract.functions.decimals())]
+    if version == "v3":
+        calls += [_call(semaphore, token0_contract.functions.balanceOf(pool_address)), _call(semaphore, token1_contract.functions.balanceOf(pool_address))]
+    results = await asyncio.gather(*calls)
+
+    for token_address, cached, decimals in zip((token0_address, token1_address), cached_decimals, results[:2]):
+        if cached is None:
+            metadata_cache.set_token_decimals(token_address, decimals)
+
+    state.update({
+        "version": version,
+        "pool_address": pool_address,
+        "token0": token0_address,
+        "token1": token1_address,
+        "token0_decimals": results[0],
+        "token1_decimals": results[1],
+    })
+    if version == "v3":
+        state["token0_balance"], state["token1_balance"] = results[2], results[3]
+    return state
+
+
+async def scan_pairs_async(pairs, concurrency=DEFAULT_CONCURRENCY):
+    """
+    Fetch the state of every v2 and v3 pool of the given token pairs concurrently.
+
+    Factory lookups of all pairs run at the same time, then the details of all discovered pools. At most
+    `concurrency` calls are in flight at any moment.
+
+    Args:
+    - pairs (list): List of (token0_address, token1_address) tuples.
+    - concurrency (int): Maximum number of concurrent RPC calls.
+
+    Returns:
+    - list: Pool states, v3 pools of a pair first, pools shared by several pairs only once.
+    """
+    w3 = get_async_web3('ETHEREUM_HTTP_ENDPOINT')
+    semaphore = asyncio.Semaphore(concurrency)
+
+    pair_pools = await asyncio.gather(*(fetch_pair_pool_addresses(w3, semaphore, token0, token1) for token0, token1 in pairs))
+
+    pools = {}
+    for v3_pool_addresses, v2_pool_addresses in pair_pools:
+        pools.update({addr: "v3" for addr in v3_pool_addresses})
+        pools.update({addr: "v2" for addr in v2_pool_addresses})
+
+    states = await asyncio.gather(*(fetch_pool_state(w3, semaphore, addr, version) for addr, version in pools.items()), return_exceptions=True)
+
+    successful_states = []
+    for (addr, version), state in zip(pools.items(), states):
+        if isinstance(state, Exception):
+            print(f"Skipping {version} pool {addr}: {state}")
+        else:
+            successful_states.append(state)
+    return successful_states
+
+
+def all_token_pairs():
+    """ Every combination of two tokens in TOKEN_CONTRACT_MAP """
+    return list(combinations(TOKEN_CONTRACT_MAP.values(), 2))
+
+
+def parse_pairs(pairs_argument):
+    """
+    Parse a comma-separated list of pairs such as "WETH-USDC,DAI-0x...". Each side is either a key of
+    TOKEN_CONTRACT_MAP or a contract address.
+    """
+    pairs = []
+    for pair in pairs_argument.split(','):
+        token0, token1 = [TOKEN_CONTRACT_MAP.get(token.strip(), token.strip()) for token in pair.split('-')]
+        pairs.append((token0, token1))
+    return pairs
+
+
+def scan_pairs(pairs, concurrency=DEFAULT_CONCURRENCY, price_source='coingecko'):
+    """
+    Run the concurrent scan and build one CSV row per pool.
+
+    Args:
+    - pairs (list): List of (token0_address, token1_address) tuples.
+    - concurrency (int): Maximum number of concurrent RPC calls.
+    - price_source (str): 'coingecko' or 'onchain', see `build_pool_rows`.
+
+    Returns:
+    - list: Rows in the format of the CSV headers, ready for `write_to_csv`.
+    """
+    states = asyncio.run(scan_pairs_async(pairs, concurrency=concurrency))
+    return build_pool_rows(states, price_source=price_source)
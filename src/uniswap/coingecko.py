@@ -1,33 +1,121 @@
-import requests
+import json
+import os
+import time
 
+from src.constants import ROOT_DIRECTORY
+from src.rpc import get_session
 
-def get_token_prices(token_address_1, token_address_2, platform_id='ethereum', currency='usd'):
+# Can be pointed at a local stub, e.g. COINGECKO_API_URL=http://127.0.0.1:8000/api/v3
+COINGECKO_API_URL = os.environ.get('COINGECKO_API_URL', "https://api.coingecko.com/api/v3")
+PRICE_CACHE_PATH = f"{ROOT_DIRECTORY}/data/coingecko_prices.json"
+PRICE_TTL_SECONDS = int(os.environ.get('COINGECKO_PRICE_TTL', 300))
+# Maximum number of contract addresses per simple/token_price request, the allowance depends on the API plan
+MAX_ADDRESSES_PER_REQUEST = int(os.environ.get('COINGECKO_MAX_ADDRESSES', 100))
+MAX_RETRIES = 5
+
+# (platform_id, currency, lowercase token address) -> (price, unix time it was fetched)
+_price_cache = {}
+_disk_cache_loaded = False
+
+
+def _cache_key(platform_id, currency, token_address):
+    return f"{platform_id}|{currency}|{token_address.lower()}"
+
+
+def _load_disk_cache():
+    global _disk_cache_loaded
+    if _disk_cache_loaded:
+        return
+    _disk_cache_loaded = True
+    if os.path.exists(PRICE_CACHE_PATH):
+        with open(PRICE_CACHE_PATH, 'r') as file:
+            _price_cache.update({key: tuple(value) for key, value in json.load(file).items()})
+
+
+def _save_disk_cache():
+    now = time.time()
+    fresh_entries = {key: value for key, value in _price_cache.items() if now - value[1] < PRICE_TTL_SECONDS}
+    with open(PRICE_CACHE_PATH, 'w') as file:
+        json.dump(fresh_entries, file)
+
+
+def _get_with_backoff(url, params):
     """
-    Fetches the prices of two tokens using their contract addresses from CoinGecko API.
+    GET with exponential backoff on HTTP 429 (rate limited), honouring the Retry-After header when present.
+    """
+    for attempt in range(MAX_RETRIES):
+        response = get_session().get(url, params=params, timeout=30)
+        if response.status_code != 429:
+            response.raise_for_status()
+            return response.json()
+
+        retry_after = response.headers.get('Retry-After')
+        wait = float(retry_after) if retry_after and retry_after.isdigit() else 2 ** attempt
+        print(f"CoinGecko rate limit hit, retrying in {wait} seconds ...")
+        time.sleep(wait)
+
+    response.raise_for_status()
+
+
+def get_token_prices_batch(token_addresses, platform_id='ethereum', currency='usd'):
+    """
+    Fetches the prices of many tokens, asking CoinGecko only for those without a fresh cached price.
 
+    All missing addresses of a run go out in as few `simple/token_price` requests as the API allows. Prices are
+    kept in memory and in PRICE_CACHE_PATH for PRICE_TTL_SECONDS, so the pools of the same pair, and runs started
+    shortly after each other, share them.
+
+    :param token_addresses: Contract addresses of the tokens.
     :param platform_id: The platform ID issuing tokens (e.g., 'ethereum' for ETH tokens).
-    :param token_address_1: Contract address of the first token.
-    :param token_address_2: Contract address of the second token.
     :param currency: The currency in which the price should be returned. Default is 'usd'.
-    :return: Prices of the two tokens.
+    :return: Dict of lowercase token address -> price. Tokens unknown to CoinGecko are left out.
     """
+    _load_disk_cache()
+    now = time.time()
+    token_addresses = sorted({address.lower() for address in token_addresses})
 
-    COINGECKO_URL = f"https://api.coingecko.com/api/v3/simple/token_price/{platform_id}"
+    prices, missing = {}, []
+    for address in token_addresses:
+        cached = _price_cache.get(_cache_key(platform_id, currency, address))
+        if cached and now - cached[1] < PRICE_TTL_SECONDS:
+            prices[address] = cached[0]
+        else:
+            missing.append(address)
 
-    parameters = {
-        'contract_addresses': f"{token_address_1},{token_address_2}",
-        'vs_currencies': currency
-    }
+    for start in range(0, len(missing), MAX_ADDRESSES_PER_REQUEST):
+        chunk = missing[start:start + MAX_ADDRESSES_PER_REQUEST]
+        parameters = {
+            'contract_addresses': ",".join(chunk),
+            'vs_currencies': currency
+        }
+        data = _get_with_backoff(f"{COINGECKO_API_URL}/simple/token_price/{platform_id}", parameters)
 
-    response = requests.get(COINGECKO_URL, params=parameters)
+        fetched_at = time.time()
+        for address, quote in data.items():
+            if currency in quote:
+                prices[address.lower()] = quote[currency]
+                _price_cache[_cache_key(platform_id, currency, address)] = (quote[currency], fetched_at)
 
-    # Ensure we got a valid response
-    response.raise_for_status()
+    if missing:
+        _save_disk_cache()
 
-    data = response.json()
+    return prices
+
+
+def get_token_prices(token_address_1, token_address_2, platform_id='ethereum', currency='usd'):
+    """
+    Fetches the prices of two tokens using their contract addresses from CoinGecko API.
+
+    :param platform_id: The platform ID issuing tokens (e.g., 'ethereum' for ETH tokens).
+    :param token_address_1: Contract address of the first token.
+    :param token_address_2: Contract address of the second token.
+    :param currency: The currency in which the price should be returned. Default is 'usd'.
+    :return: Prices of the two tokens.
+    """
+    prices = get_token_prices_batch([token_address_1, token_address_2], platform_id=platform_id, currency=currency)
 
     # Fetching the prices
-    token1_price = data[token_address_1][currency]
-    token2_price = data[token_address_2][currency]
+    token1_price = prices[token_address_1.lower()]
+    token2_price = prices[token_address_2.lower()]
 
     return token1_price, token2_price
@@ -19,13 +19,14 @@ headers = [
 ]
 
 
-def write_to_csv(pool_data, pool_name):
+def write_to_csv(pool_data, pool_name, suffix="uniswap_pools"):
     """
     Writes the pool data to a specified CSV file.
 
     Args:
     - pool_data (list): List of dictionaries containing pool data.
     - filename (str, optional): The name of the CSV file to save. Defaults to "uniswap_pools.csv".
+    - suffix (str, optional): Suffix of the file name, e.g. "uniswap_depth" for liquidity depth curves.
 
     Returns:
     - None
@@ -36,7 +37,7 @@ def write_to_csv(pool_data, pool_name):
         print("The provided data is empty.")
         return
 
-    filename = f"{ROOT_DIRECTORY}/data/{pool_name}_uniswap_pools.csv"
+    filename = f"{ROOT_DIRECTORY}/data/{pool_name}_{suffix}.csv"
 
     # Write data to the CSV file
     with open(filename, 'w', newline='') as csvfile:
@@ -0,0 +1,152 @@
+import argparse
+
+from web3 import Web3
+
+from src.constants import *
+from src.constants import UNISWAP_V3_POOL_ABI
+from src.uniswap import pool_state_store
+from src.uniswap.async_scan import all_token_pairs, parse_pairs
+from src.uniswap.log_fetcher import iter_logs
+from src.uniswap.multicall import aggregate3
+from src.uniswap.uniswap import fetch_pool_states, get_v2_pool_address, get_v3_pool_addresses, w3
+
+# Stay this many blocks behind the head so indexed state is never built from blocks that can still be reorged
+DEFAULT_CONFIRMATIONS = 12
+
+# https://docs.uniswap.org/contracts/v2/reference/smart-contracts/pair#sync
+SYNC_TOPIC = Web3.keccak(text="Sync(uint112,uint112)")
+# https://docs.uniswap.org/contracts/v3/reference/core/interfaces/pool/IUniswapV3PoolEvents
+SWAP_TOPIC = Web3.keccak(text="Swap(address,address,int256,int256,uint160,uint128,int24)")
+MINT_TOPIC = Web3.keccak(text="Mint(address,address,int24,int24,uint128,uint256,uint256)")
+BURN_TOPIC = Web3.keccak(text="Burn(address,int24,int24,uint128,uint256,uint256)")
+# Collect, CollectProtocol and Flash move tokens in or out of a v3 pool without changing price or liquidity,
+# they are needed to keep the pool balances (balanceOf) right
+COLLECT_TOPIC = Web3.keccak(text="Collect(address,address,int24,int24,uint128,uint128)")
+COLLECT_PROTOCOL_TOPIC = Web3.keccak(text="CollectProtocol(address,address,uint128,uint128)")
+FLASH_TOPIC = Web3.keccak(text="Flash(address,address,uint256,uint256,uint256,uint256)")
+
+POOL_STATE_TOPICS = [SYNC_TOPIC, SWAP_TOPIC, MINT_TOPIC, BURN_TOPIC, COLLECT_TOPIC, COLLECT_PROTOCOL_TOPIC, FLASH_TOPIC]
+
+
+def _decode_topic_int24(topic):
+    return w3.codec.decode(["int24"], bytes(topic))[0]
+
+
+def apply_log(state, log):
+    """
+    Apply one pool event to the raw state of its pool.
+
+    V2 `Sync` carries the new reserves. V3 `Swap` carries the new sqrtPriceX96, tick and active liquidity, while
+    `Mint`/`Burn` change the active liquidity only when the position covers the current tick. Token balances of v3
+    pools follow the amounts moved by Swap/Mint/Collect/CollectProtocol/Flash. Tokens sent to a pool outside these
+    events (plain transfers) are not seen until the pool is watched again.
+    """
+    topic0 = bytes(log["topics"][0])
+    data = bytes(log["data"])
+
+    if topic0 == SYNC_TOPIC:
+        state["token0_balance"], state["token1_balance"] = w3.codec.decode(["uint112", "uint112"], data)
+    elif topic0 == SWAP_TOPIC:
+        amount0, amount1, sqrt_price_x96, liquidity, tick = w3.codec.decode(["int256", "int256", "uint160", "uint128", "int24"], data)
+        state["token0_balance"] += amount0
+        state["token1_balance"] += amount1
+        state["sqrt_price_x96"], state["liquidity"], state["tick"] = sqrt_price_x96, liquidity, tick
+    elif topic0 in (MINT_TOPIC, BURN_TOPIC):
+        tick_lower, tick_upper = _decode_topic_int24(log["topics"][2]), _decode_topic_int24(log["topics"][3])
+        if topic0 == MINT_TOPIC:
+            _, amount, amount0, amount1 = w3.codec.decode(["address", "uint128", "uint256", "uint256"], data)
+            state["token0_balance"] += amount0
+            state["token1_balance"] += amount1
+        else:
+            # Burned tokens stay in the pool until they are collected
+            amount, _, _ = w3.codec.decode(["uint128", "uint256", "uint256"], data)
+            amount = -amount
+        if tick_lower <= state["tick"] < tick_upper:
+            state["liquidity"] += amount
+    elif topic0 == COLLECT_TOPIC:
+        _, amount0, amount1 = w3.codec.decode(["address", "uint128", "uint128"], data)
+        state["token0_balance"] -= amount0
+        state["token1_balance"] -= amount1
+    elif topic0 == COLLECT_PROTOCOL_TOPIC:
+        amount0, amount1 = w3.codec.decode(["uint128", "uint128"], data)
+        state["token0_balance"] -= amount0
+        state["token1_balance"] -= amount1
+    elif topic0 == FLASH_TOPIC:
+        _, _, paid0, paid1 = w3.codec.decode(["uint256", "uint256", "uint256", "uint256"], data)
+        state["token0_balance"] += paid0
+        state["token1_balance"] += paid1
+
+
+def watch_pools(v3_pool_addresses, v2_pool_addresses, confirmations=DEFAULT_CONFIRMATIONS):
+    """
+    Add pools to the store, seeded with their state read through Multicall3 at the block the store is synced to.
+
+    Pools already watched are left untouched. Seeding also fills the metadata cache, so indexed pools can later be
+    read without any RPC call.
+    """
+    watched = pool_state_store.get_watched_pools()
+    v3_pool_addresses = [addr for addr in v3_pool_addresses if addr != ZERO_ADDRESS and addr not in watched]
+    v2_pool_addresses = [addr for addr in v2_pool_addresses if addr != ZERO_ADDRESS and addr not in watched]
+    if not v3_pool_addresses and not v2_pool_addresses:
+        return
+
+    block = pool_state_store.get_last_block()
+    if block is None:
+        block = w3.eth.block_number - confirmations
+
+    states = fetch_pool_states(v3_pool_addresses, v2_pool_addresses, block_identifier=block)
+    v3_states = [state for state in states.values() if state["version"] == "v3"]
+    liquidity_calls = [w3.eth.contract(address=state["pool_address"], abi=UNISWAP_V3_POOL_ABI).functions.liquidity() for state in v3_states]
+    for state, liquidity in zip(v3_states, aggregate3(w3, liquidity_calls, block_identifier=block)):
+        state["liquidity"] = liquidity
+
+    pool_state_store.save_pool_states(states, block)
+    print(f"Watching {len(states)} new pools from block {block}")
+
+
+def sync(to_block=None, confirmations=DEFAULT_CONFIRMATIONS):
+    """
+    Apply every pool event since the last indexed block to the watched pools.
+
+    Logs of all watched pools are streamed with adaptive `eth_getLogs` ranges, and the store is updated after
+    each range, so an interrupted sync resumes from the last completed range.
+
+    Args:
+    - to_block (int, optional): Last block to index. Defaults to the head minus `confirmations`.
+    - confirmations (int): Number of blocks to stay behind the head.
+    """
+    last_block = pool_state_store.get_last_block()
+    if last_block is None:
+        print("No pools are watched yet.")
+        return
+
+    to_block = to_block if to_block is not None else w3.eth.block_number - confirmations
+    states = pool_state_store.load_pool_states()
+    topics = [[topic.hex() for topic in POOL_STATE_TOPICS]]
+
+    for chunk_from, chunk_to, logs in iter_logs(w3, last_block + 1, to_block, address=list(states), topics=topics):
+        for log in logs:
+            state = states.get(log["address"])
+            if state is not None:
+                apply_log(state, log)
+        pool_state_store.save_pool_states(states, chunk_to)
+        print(f"Indexed {len(logs)} pool events in blocks {chunk_from} - {chunk_to}")
+
+
+def run():
+    parser = argparse.ArgumentParser(description='Index the state of Uniswap pools from their Sync/Swap/Mint/Burn logs.')
+    parser.add_argument('--pairs', type=str, help='Comma-separated token pairs whose pools should be watched, e.g. WETH-USDC,DAI-USDC', default='')
+    parser.add_argument('--all-pairs', action='store_true', help='Watch the pools of every combination of tokens in TOKEN_CONTRACT_MAP')
+    parser.add_argument('--to-block', type=int, help='Last block to index. Defaults to the head minus the confirmations', default=None)
+    parser.add_argument('--confirmations', type=int, help='Number of blocks to stay behind the head', default=DEFAULT_CONFIRMATIONS)
+    args = parser.parse_args()
+
+    pairs = all_token_pairs() if args.all_pairs else parse_pairs(args.pairs) if args.pairs else []
+    for token0_address, token1_address in pairs:
+        watch_pools(get_v3_pool_addresses(token0_address, token1_address), [get_v2_pool_address(token0_address, token1_address)], confirmations=args.confirmations)
+
+    sync(to_block=args.to_block, confirmations=args.confirmations)
+
+
+if __name__ == "__main__":
+    run()
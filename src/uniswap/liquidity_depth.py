@@ -0,0 +1,163 @@
+import math
+
+import numpy as np
+
+from src.constants import *
+from src.constants import UNISWAP_V3_POOL_ABI
+from src.uniswap.multicall import aggregate3
+from src.uniswap.uniswap import fetch_pool_states, w3
+
+# https://docs.uniswap.org/contracts/v3/reference/core/libraries/TickMath
+MIN_TICK = -887272
+MAX_TICK = 887272
+TICK_BASE = 1.0001
+
+DEFAULT_DEPTH_BPS = [10, 25, 50, 100, 200, 500, 1000]
+
+
+def ticks_for_move(bps):
+    """ Number of ticks the price crosses when it moves by `bps` basis points, in the direction that needs the most """
+    if not 0 < bps < 10_000:
+        # A price can fall by less than 100% only: the downward move needs 0 < bps < 10000
+        raise ValueError(f"Price moves must be between 1 and 9999 bps, got {bps}")
+    return math.ceil(abs(math.log(1 - bps / 10_000)) / math.log(TICK_BASE))
+
+
+def fetch_tick_data(pool_addresses, max_bps=max(DEFAULT_DEPTH_BPS), block_identifier='latest'):
+    """
+    Read the initialized ticks of v3 pools around their current price, batched through Multicall3.
+
+    One round reads the pool state (fetch_pool_states), one reads liquidity and tickSpacing, one reads the tickBitmap
+    words covering a move of `max_bps` in both directions, and one reads `ticks()` of every initialized tick found.
+
+    Returns:
+    - dict: Pool address -> pool state extended with "liquidity", "tick_spacing", "initialized_ticks" and
+      "liquidity_net" (numpy arrays sorted by tick) and the "lowest_tick"/"highest_tick" covered by the scan.
+    """
+    states = fetch_pool_states(pool_addresses, [], block_identifier=block_identifier)
+    pool_contracts = {addr: w3.eth.contract(address=addr, abi=UNISWAP_V3_POOL_ABI) for addr in states}
+
+    calls = []
+    for addr in states:
+        calls += [pool_contracts[addr].functions.liquidity(), pool_contracts[addr].functions.tickSpacing()]
+    results = iter(aggregate3(w3, calls, block_identifier=block_identifier))
+    for state in states.values():
+        state["liquidity"], state["tick_spacing"] = next(results), next(results)
+
+    # tickBitmap maps a word position to 256 bits, one per tick spacing: https://uniswapv3book.com/milestone_2/tick-bitmap-index.html
+    span_ticks = ticks_for_move(max_bps)
+    words = {}
+    for addr, state in states.items():
+        spacing = state["tick_spacing"]
+        word_position = (state["tick"] // spacing) >> 8
+        word_span = span_ticks // (256 * spacing) + 1
+        words[addr] = list(range(word_position - word_span, word_position + word_span + 1))
+        state["lowest_tick"] = max(MIN_TICK, (words[addr][0] * 256 - 1) * spacing)
+        state["highest_tick"] = min(MAX_TICK, (words[addr][-1] * 256 + 256) * spacing)
+
+    calls = [pool_contracts[addr].functions.tickBitmap(word) for addr in states for word in words[addr]]
+    results = iter(aggregate3(w3, calls, block_identifier=block_identifier))
+    initialized_ticks = {}
+    for addr, state in states.items():
+        initialized_ticks[addr] = []
+        for word in words[addr]:
+            bitmap = next(results) or 0
+            initialized_ticks[addr] += [(word * 256 + bit) * state["tick_spacing"] for bit in range(256) if bitmap >> bit & 1]
+
+    calls = [pool_contracts[addr].functions.ticks(tick) for addr in states for tick in initialized_ticks[addr]]
+    results = iter(aggregate3(w3, calls, block_identifier=block_identifier))
+    for addr, state in states.items():
+        state["initialized_ticks"] = np.array(initialized_ticks[addr], dtype=np.int64)
+        # ticks() returns (liquidityGross, liquidityNet, ...)
+        state["liquidity_net"] = np.array([float(next(results)[1]) for _ in initialized_ticks[addr]], dtype=np.float64)
+
+    return states
+
+
+def depth_curve(sqrt_price, current_tick, liquidity, initialized_ticks, liquidity_net, limit_tick, bps_moves, direction):
+    """
+    Amounts of tokens swapped to move the price of a v3 pool by each of the given moves, walking the initialized ticks.
+
+    Within a range of constant liquidity L, moving the sqrt price from a to b swaps L * (b - a) of token1 and
+    L * (1/a - 1/b) of token0 (https://atiselsts.github.io/pdfs/uniswap-v3-liquidity-math.pdf). The cumulative
+    amounts at every tick boundary are computed with one cumsum, and every target move is located with searchsorted.
+
+    Args:
+    - sqrt_price (float): Current sqrt price (sqrtPriceX96 / 2^96), in raw token units.
+    - current_tick (int): Current tick of the pool (slot0).
+    - liquidity (float): Active liquidity.
+    - initialized_ticks (np.ndarray): Initialized ticks sorted ascending.
+    - liquidity_net (np.ndarray): liquidityNet of each initialized tick.
+    - limit_tick (int): Furthest tick covered by the scanned tickBitmap words in this direction.
+    - bps_moves (np.ndarray): Price moves in basis points.
+    - direction (str): "up" (token1 in, token0 out) or "down" (token0 in, token1 out).
+
+    Returns:
+    - tuple: (raw amounts of token0, raw amounts of token1) for each move, NaN beyond the scanned ticks.
+    """
+    if direction == "up":
+        mask = initialized_ticks > current_tick
+        crossed_ticks, crossed_net = initialized_ticks[mask], liquidity_net[mask]
+        segment_liquidity = liquidity + np.concatenate(([0.0], np.cumsum(crossed_net)))
+        targets = sqrt_price * np.sqrt(1 + bps_moves / 10_000)
+    else:
+        mask = initialized_ticks <= current_tick
+        crossed_ticks, crossed_net = initialized_ticks[mask][::-1], liquidity_net[mask][::-1]
+        # Crossing a tick downwards removes its liquidityNet
+        segment_liquidity = liquidity - np.concatenate(([0.0], np.cumsum(crossed_net)))
+        targets = sqrt_price * np.sqrt(1 - bps_moves / 10_000)
+
+    segment_liquidity = np.maximum(segment_liquidity, 0.0)
+    boundaries = np.concatenate(([sqrt_price], np.power(TICK_BASE, crossed_ticks / 2), [TICK_BASE ** (limit_tick / 2)]))
+
+    # Work on distances from the current price so both directions are increasing sequences
+    distance = np.abs(boundaries - sqrt_price)
+    amount1_per_segment = segment_liquidity * np.abs(np.diff(boundaries))
+    amount0_per_segment = segment_liquidity * np.abs(np.diff(1 / boundaries))
+    cumulative1 = np.concatenate(([0.0], np.cumsum(amount1_per_segment)))
+    cumulative0 = np.concatenate(([0.0], np.cumsum(amount0_per_segment)))
+
+    target_distance = np.abs(targets - sqrt_price)
+    segment = np.clip(np.searchsorted(distance, target_distance, side='right') - 1, 0, len(segment_liquidity) - 1)
+    amount1 = cumulative1[segment] + segment_liquidity[segment] * np.abs(targets - boundaries[segment])
+    amount0 = cumulative0[segment] + segment_liquidity[segment] * np.abs(1 / targets - 1 / boundaries[segment])
+
+    beyond_scan = target_distance > distance[-1]
+    amount0[beyond_scan] = np.nan
+    amount1[beyond_scan] = np.nan
+    return amount0, amount1
+
+
+def get_depth_rows(pool_addresses, bps_moves=DEFAULT_DEPTH_BPS, block_identifier='latest'):
+    """
+    Build the cumulative depth curve of every given v3 pool: the amounts to swap in and out to move the pool price
+    of token0 (quoted in token1) up or down by each of `bps_moves`.
+
+    Returns:
+    - list: One row per pool, direction and move, amounts normalized by decimals.
+    """
+    states = fetch_tick_data(pool_addresses, max_bps=max(bps_moves), block_identifier=block_identifier)
+    bps_moves = np.asarray(bps_moves, dtype=np.float64)
+
+    rows = []
+    for addr, state in states.items():
+        sqrt_price = state["sqrt_price_x96"] / 2 ** 96
+        token0_scale, token1_scale = 10 ** state["token0_decimals"], 10 ** state["token1_decimals"]
+        for direction, limit_tick in (("up", state["highest_tick"]), ("down", state["lowest_tick"])):
+            amount0, amount1 = depth_curve(sqrt_price, state["tick"], float(state["liquidity"]), state["initialized_ticks"], state["liquidity_net"],
+                                           limit_tick, bps_moves, direction)
+            # Moving the price up means buying token0 with token1, moving it down selling token0 for token1
+            for bps, token0_amount, token1_amount in zip(bps_moves, amount0, amount1):
+                rows.append({
+                    "Pool address": addr,
+                    "Contract address for token0": state["token0"],
+                    "Contract address for token1": state["token1"],
+                    "Fee tier (in bps)": state["fee"],
+                    "Direction": direction,
+                    "Price move (bps)": int(bps),
+                    "Amount of token0 in": token0_amount / token0_scale if direction == "down" else 0.0,
+                    "Amount of token0 out": token0_amount / token0_scale if direction == "up" else 0.0,
+                    "Amount of token1 in": token1_amount / token1_scale if direction == "up" else 0.0,
+                    "Amount of token1 out": token1_amount / token1_scale if direction == "down" else 0.0,
+                })
+    return rows
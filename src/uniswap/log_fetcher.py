@@ -0,0 +1,92 @@
+import time
+
+import requests
+
+DEFAULT_CHUNK_SIZE = 2000
+MIN_CHUNK_SIZE = 1
+MAX_CHUNK_SIZE = 100_000
+# Grow the block range again only while chunks stay well below the result caps of common providers (10k logs)
+GROWTH_THRESHOLD_LOGS = 2000
+
+# Providers word the "too many results" error differently, these are their messages (lowercased):
+# Infura and geth "query returned more than 10000 results", Alchemy "Log response size exceeded",
+# QuickNode "eth_getLogs is limited to a 10,000 range", Ankr "block range is too wide",
+# Chainstack "exceed maximum block range: 5000", BSC nodes "response size should not greater than 10000000 bytes",
+# Reth "query exceeds max results 20000", Erigon "block range too large"
+TOO_MANY_RESULTS_MARKERS = ("query returned more than", "log response size exceeded", "eth_getlogs is limited to", "block range is too wide",
+                            "exceed maximum block range", "response size should not greater than", "query exceeds max results", "block range too large")
+# Rate limiting is answered with HTTP 429, or with a JSON-RPC error by some providers: Infura "project ID request rate
+# exceeded", Alchemy "Your app has exceeded its compute units per second capacity". Those are retried on the same range.
+RATE_LIMIT_MARKERS = ("too many requests", "rate limit", "request rate exceeded", "compute units per second")
+MAX_RATE_LIMIT_RETRIES = 6
+MAX_BACKOFF_SECONDS = 30
+
+
+def is_too_many_results_error(error):
+    message = str(error).lower()
+    return any(marker in message for marker in TOO_MANY_RESULTS_MARKERS)
+
+
+def is_rate_limit_error(error):
+    response = getattr(error, "response", None)
+    if isinstance(error, requests.HTTPError) and response is not None and response.status_code == 429:
+        return True
+    message = str(error).lower()
+    return any(marker in message for marker in RATE_LIMIT_MARKERS)
+
+
+def rate_limit_delay(error, attempt):
+    """ Seconds to wait before retrying: the Retry-After header of a 429 response when given, else exponential """
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("Retry-After") if response is not None else None
+    if retry_after is not None and retry_after.isdigit():
+        return min(MAX_BACKOFF_SECONDS, int(retry_after))
+    return min(MAX_BACKOFF_SECONDS, 2 ** attempt)
+
+
+def iter_logs(w3, from_block, to_block, address=None, topics=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Stream `eth_getLogs` results over a block range in adaptive chunks.
+
+    The chunk is halved whenever the provider rejects a range for returning too many results, and doubled after
+    chunks that returned few logs, so dense and sparse parts of the chain are both fetched in few requests.
+    Rate limited requests are retried on the same range after a backoff, other errors are raised.
+
+    Args:
+    - w3: The Web3 instance to use.
+    - from_block (int): First block of the range.
+    - to_block (int): Last block of the range (inclusive).
+    - address (str or list, optional): Contract address(es) emitting the logs.
+    - topics (list, optional): Topic filter, e.g. `[[topic_a, topic_b]]` for logs whose first topic is either.
+    - chunk_size (int): Initial number of blocks per request.
+
+    Yields:
+    - tuple: (chunk_from_block, chunk_to_block, logs) for consecutive chunks, logs in chain order.
+    """
+    start = from_block
+    rate_limited = 0
+    while start <= to_block:
+        end = min(start + chunk_size - 1, to_block)
+        log_filter = {"fromBlock": start, "toBlock": end}
+        if address is not None:
+            log_filter["address"] = address
+        if topics is not None:
+            log_filter["topics"] = topics
+
+        try:
+            logs = w3.eth.get_logs(log_filter)
+        except Exception as e:
+            if is_rate_limit_error(e) and rate_limited < MAX_RATE_LIMIT_RETRIES:
+                time.sleep(rate_limit_delay(e, rate_limited))
+                rate_limited += 1
+                continue
+            if is_too_many_results_error(e) and chunk_size > MIN_CHUNK_SIZE:
+                chunk_size = max(MIN_CHUNK_SIZE, chunk_size // 2)
+                continue
+            raise
+
+        rate_limited = 0
+        yield start, end, logs
+        start = end + 1
+        if len(logs) < GROWTH_THRESHOLD_LOGS:
+            chunk_size = min(MAX_CHUNK_SIZE, chunk_size * 2)
@@ -1,9 +1,14 @@
 import argparse
+from src.rpc import log_rpc_stats
+from src.uniswap.async_scan import DEFAULT_CONCURRENCY, all_token_pairs, parse_pairs, scan_pairs
+from src.uniswap.snapshots import DEFAULT_MAX_WORKERS, snapshot_blocks, snapshot_pair
 from src.uniswap.csv_writer import write_to_csv
-from uniswap import *
+from src.uniswap.liquidity_depth import DEFAULT_DEPTH_BPS, get_depth_rows
+from src.uniswap.pool_discovery import find_pools
+from src.uniswap.uniswap import *
 
 
-def main(token0_address=None, token1_address=None):
+def main(token0_address=None, token1_address=None, batched=False, price_source='coingecko', use_indexed_state=False, use_pool_index=False):
     # If the addresses are not provided, default to WETH-USDC
     if not token0_address or not token1_address:
         token0_name = 'WETH'
@@ -11,16 +16,29 @@ def main(token0_address=None, token1_address=None):
         token0_address = TOKEN_CONTRACT_MAP[token0_name]
         token1_address = TOKEN_CONTRACT_MAP[token1_name]
 
-    # Fetching pool addresses
-    v2_pool_address = get_v2_pool_address(token0_address, token1_address)
-    v3_pool_addresses = get_v3_pool_addresses(token0_address, token1_address)
+    # Fetching pool addresses, from the local index built by src/uniswap/pool_discovery.py or from the factories.
+    # Fee tiers and pairs without a pool come back as the zero address and are dropped.
+    pools = find_pools(token0_address, token1_address) if use_pool_index else []
+    if use_pool_index and not pools:
+        # Never synced, or not synced up to the creation of the pools of the pair
+        print(f"Warning: no pool of {token0_address}-{token1_address} in the pool index, run src/uniswap/pool_discovery.py to sync it. Using the factories instead.")
+    if pools:
+        v3_pool_addresses = [pool["address"] for pool in pools if pool["version"] == "v3"]
+        v2_pool_addresses = [pool["address"] for pool in pools if pool["version"] == "v2"]
+    else:
+        v3_pool_addresses = [addr for addr in get_v3_pool_addresses(token0_address, token1_address) if addr != ZERO_ADDRESS]
+        v2_pool_addresses = [addr for addr in [get_v2_pool_address(token0_address, token1_address)] if addr != ZERO_ADDRESS]
 
-    # Fetching pool data (placeholder)
-    pool_data = []
-    for addr in v3_pool_addresses:
-        pool_data.append(get_v3_pool_details(addr))
+    # Fetching pool data, either with Multicall3 batches or pool by pool
+    if batched:
+        pool_data = get_pool_details_batched(v3_pool_addresses, v2_pool_addresses, price_source=price_source)
+    else:
+        pool_data = []
+        for addr in v3_pool_addresses:
+            pool_data.append(get_v3_pool_details(addr, use_indexed_state=use_indexed_state))
 
-    pool_data.append(get_v2_pool_details(v2_pool_address))
+        for addr in v2_pool_addresses:
+            pool_data.append(get_v2_pool_details(addr, use_indexed_state=use_indexed_state))
 
     # If token names are not known, use addresses for the CSV filename
     pool_name = f"{token0_address}-{token1_address}"
@@ -34,14 +52,95 @@ def main(token0_address=None, token1_address=None):
             pool_name = f"{token0_address}-{token1_address}"
 
     write_to_csv(pool_data, pool_name=pool_name)
+    log_rpc_stats()
+
+
+def main_multi_pairs(pairs, concurrency=DEFAULT_CONCURRENCY, price_source='coingecko'):
+    """
+    Scan the pools of several token pairs concurrently and write all of them to one combined CSV.
+    """
+    print(f"Starting concurrent processing for {len(pairs)} pairs ...")
+    pool_data = scan_pairs(pairs, concurrency=concurrency, price_source=price_source)
+    write_to_csv(pool_data, pool_name="all_pairs")
+
+
+def main_snapshots(token0_address, token1_address, blocks, max_workers=DEFAULT_MAX_WORKERS, price_source='onchain'):
+    """
+    Sample every pool of a pair at the given blocks into one time-series CSV, resuming from the last checkpoint.
+    """
+    reverse_map = {v: k for k, v in TOKEN_CONTRACT_MAP.items()}
+    pool_name = f"{reverse_map.get(token0_address, token0_address)}-{reverse_map.get(token1_address, token1_address)}"
+    print(f"Starting historical snapshots for {pool_name} over {len(blocks)} blocks ...")
+    snapshot_pair(token0_address, token1_address, blocks, pool_name, max_workers=max_workers, price_source=price_source)
+
+
+def main_depth(token0_address, token1_address, bps_moves=DEFAULT_DEPTH_BPS):
+    """
+    Write the tick-level liquidity depth curve of every v3 pool of a pair: the amounts needed to move each pool price by `bps_moves`.
+    """
+    reverse_map = {v: k for k, v in TOKEN_CONTRACT_MAP.items()}
+    pool_name = f"{reverse_map.get(token0_address, token0_address)}-{reverse_map.get(token1_address, token1_address)}"
+    print(f"Starting liquidity depth for {pool_name} v3 pools ...")
+    v3_pool_addresses = [addr for addr in get_v3_pool_addresses(token0_address, token1_address) if addr != ZERO_ADDRESS]
+    write_to_csv(get_depth_rows(v3_pool_addresses, bps_moves=bps_moves), pool_name=pool_name, suffix="uniswap_depth")
+    log_rpc_stats()
+
+
+def depth_bps(value):
+    """ argparse type of --depth-bps: the price can fall by less than 100% only """
+    bps = int(value)
+    if not 0 < bps < 10_000:
+        raise argparse.ArgumentTypeError(f"price moves must be between 1 and 9999 bps, got {value}")
+    return bps
 
 
 def run():
     parser = argparse.ArgumentParser(description='Generate Uniswap CSV for token pair.')
     parser.add_argument('--token0', type=str, help='Smart contract address of token0', default='')
     parser.add_argument('--token1', type=str, help='Smart contract address of token1', default='')
+    parser.add_argument('--batched', action='store_true', help='Group all pool reads into Multicall3 aggregate3 calls')
+    parser.add_argument('--indexed', action='store_true', help='Read pools watched by src/uniswap/event_indexer.py from the local store instead of the chain')
+    parser.add_argument('--use-pool-index', action='store_true', help='Find the pools of the pair in the index built by src/uniswap/pool_discovery.py, or the factories when it has none')
+    parser.add_argument('--pairs', type=str, help='Comma-separated token pairs scanned concurrently, e.g. WETH-USDC,DAI-USDC', default='')
+    parser.add_argument('--all-pairs', action='store_true', help='Scan every combination of tokens in TOKEN_CONTRACT_MAP concurrently')
+    parser.add_argument('--concurrency', type=int, help='Maximum number of concurrent RPC calls for multi-pair scans', default=DEFAULT_CONCURRENCY)
+    parser.add_argument('--price-source', type=str, choices=['coingecko', 'onchain'], default=None,
+                        help='USD prices: CoinGecko (default for current state), or derived from the pools read in the run (default for snapshots)')
+    parser.add_argument('--from-block', type=int, help='First block of a historical snapshot range', default=None)
+    parser.add_argument('--to-block', type=int, help='Last block (inclusive) of a historical snapshot range. Defaults to --from-block', default=None)
+    parser.add_argument('--stride', type=int, help='Sample every N blocks of the snapshot range', default=1)
+    parser.add_argument('--blocks', type=int, nargs='+', help='Explicit list of blocks to snapshot', default=None)
+    parser.add_argument('--workers', type=int, help='Number of blocks fetched concurrently in snapshot mode', default=DEFAULT_MAX_WORKERS)
+    parser.add_argument('--depth', action='store_true', help='Write the tick-level liquidity depth curve of the v3 pools of the pair')
+    parser.add_argument('--depth-bps', type=depth_bps, nargs='+', help='Price moves (in bps) of the depth curve', default=DEFAULT_DEPTH_BPS)
     args = parser.parse_args()
 
+    if args.depth:
+        main_depth(args.token0 or TOKEN_CONTRACT_MAP['WETH'], args.token1 or TOKEN_CONTRACT_MAP['USDC'], bps_moves=args.depth_bps)
+        return
+
+    if args.blocks or args.from_block is not None:
+        if not args.blocks:
+            to_block = args.from_block if args.to_block is None else args.to_block
+            if args.stride < 1:
+                parser.error(f"--stride must be at least 1, got {args.stride}")
+            if to_block < args.from_block:
+                parser.error(f"--to-block {to_block} is before --from-block {args.from_block}")
+        blocks = args.blocks or snapshot_blocks(args.from_block, to_block, args.stride)
+        if min(blocks) < MULTICALL3_DEPLOY_BLOCK:
+            # Snapshots read every pool through Multicall3, which answers nothing before it was deployed
+            parser.error(f"snapshot blocks must be at least {MULTICALL3_DEPLOY_BLOCK}, the block Multicall3 was deployed at")
+        token0_address = args.token0 or TOKEN_CONTRACT_MAP['WETH']
+        token1_address = args.token1 or TOKEN_CONTRACT_MAP['USDC']
+        # CoinGecko only has spot prices, snapshots are priced on-chain unless explicitly asked otherwise
+        main_snapshots(token0_address, token1_address, blocks, max_workers=args.workers, price_source=args.price_source or 'onchain')
+        return
+
+    if args.pairs or args.all_pairs:
+        pairs = all_token_pairs() if args.all_pairs else parse_pairs(args.pairs)
+        main_multi_pairs(pairs, concurrency=args.concurrency, price_source=args.price_source or 'coingecko')
+        return
+
     use_defaults = False
     if not args.token0 or not args.token1:
         args.token0 = input("Enter the smart contract address for token0 (Press enter for default WETH): ")
@@ -59,7 +158,7 @@ def run():
     else:
         print(f"Starting processing for WETH and USDC pools ...")
 
-    main(args.token0, args.token1)
+    main(args.token0, args.token1, batched=args.batched, price_source=args.price_source or 'coingecko', use_indexed_state=args.indexed, use_pool_index=args.use_pool_index)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,114 @@
+import argparse
+import sqlite3
+import threading
+
+from web3 import Web3
+
+from src.constants import ROOT_DIRECTORY
+
+# token0/token1/fee of a pool, the decimals of an ERC20 and the pool a factory returns for an existing pair
+# never change once deployed, so they are read from chain once and kept on disk. Missing pools (zero address)
+# are never cached since they can be created later.
+METADATA_CACHE_PATH = f"{ROOT_DIRECTORY}/data/uniswap_metadata.sqlite"
+
+_connection = None
+_lock = threading.Lock()
+
+
+def _get_connection():
+    global _connection
+    if _connection is None:
+        _connection = sqlite3.connect(METADATA_CACHE_PATH, check_same_thread=False)
+        _connection.executescript("""
+            CREATE TABLE IF NOT EXISTS tokens (address TEXT PRIMARY KEY, decimals INTEGER NOT NULL);
+            CREATE TABLE IF NOT EXISTS pools (address TEXT PRIMARY KEY, version TEXT NOT NULL, token0 TEXT NOT NULL, token1 TEXT NOT NULL, fee INTEGER);
+            CREATE TABLE IF NOT EXISTS factory_pools (version TEXT NOT NULL, token_a TEXT NOT NULL, token_b TEXT NOT NULL, fee INTEGER NOT NULL, pool TEXT NOT NULL,
+                                                      PRIMARY KEY (version, token_a, token_b, fee));
+        """)
+    return _connection
+
+
+def _execute(query, params=()):
+    with _lock:
+        connection = _get_connection()
+        rows = connection.execute(query, params).fetchall()
+        connection.commit()
+        return rows
+
+
+def _sorted_pair(token_a, token_b):
+    # The factories return the same pool whatever the order of the two tokens
+    return tuple(sorted([Web3.to_checksum_address(token_a), Web3.to_checksum_address(token_b)], key=str.lower))
+
+
+def get_token_decimals(token_address):
+    rows = _execute("SELECT decimals FROM tokens WHERE address = ?", (Web3.to_checksum_address(token_address),))
+    return rows[0][0] if rows else None
+
+
+def set_token_decimals(token_address, decimals):
+    _execute("INSERT OR REPLACE INTO tokens (address, decimals) VALUES (?, ?)", (Web3.to_checksum_address(token_address), decimals))
+
+
+def get_pool_metadata(pool_address):
+    """
+    Returns:
+    - dict: {"version", "token0", "token1", "fee"} of the pool, or None if the pool is not cached yet. `fee` is None for v2.
+    """
+    rows = _execute("SELECT version, token0, token1, fee FROM pools WHERE address = ?", (Web3.to_checksum_address(pool_address),))
+    if not rows:
+        return None
+    version, token0_address, token1_address, fee = rows[0]
+    return {"version": version, "token0": token0_address, "token1": token1_address, "fee": fee}
+
+
+def set_pool_metadata(pool_address, version, token0_address, token1_address, fee=None):
+    _execute("INSERT OR REPLACE INTO pools (address, version, token0, token1, fee) VALUES (?, ?, ?, ?, ?)",
+             (Web3.to_checksum_address(pool_address), version, Web3.to_checksum_address(token0_address), Web3.to_checksum_address(token1_address), fee))
+
+
+def get_factory_pool(version, token_a, token_b, fee=0):
+    """ Return the cached pool of a pair (and fee tier for v3) or None. Use fee=0 for v2 pairs. """
+    rows = _execute("SELECT pool FROM factory_pools WHERE version = ? AND token_a = ? AND token_b = ? AND fee = ?", (version, *_sorted_pair(token_a, token_b), fee))
+    return rows[0][0] if rows else None
+
+
+def set_factory_pool(version, token_a, token_b, pool_address, fee=0):
+    _execute("INSERT OR REPLACE INTO factory_pools (version, token_a, token_b, fee, pool) VALUES (?, ?, ?, ?, ?)",
+             (version, *_sorted_pair(token_a, token_b), fee, Web3.to_checksum_address(pool_address)))
+
+
+def invalidate(address=None):
+    """
+    Remove cached metadata.
+
+    Args:
+    - address (str, optional): Only remove entries for this token or pool address. Removes everything if not provided.
+    """
+    if address is None:
+        for table in ("tokens", "pools", "factory_pools"):
+            _execute(f"DELETE FROM {table}")
+        print(f"Cleared the metadata cache at {METADATA_CACHE_PATH}")
+        return
+
+    address = Web3.to_checksum_address(address)
+    _execute("DELETE FROM tokens WHERE address = ?", (address,))
+    _execute("DELETE FROM pools WHERE address = ? OR token0 = ? OR token1 = ?", (address, address, address))
+    _execute("DELETE FROM factory_pools WHERE pool = ? OR token_a = ? OR token_b = ?", (address, address, address))
+    print(f"Removed cached metadata for {address}")
+
+
+def run():
+    parser = argparse.ArgumentParser(description='Manage the on-disk cache of immutable Uniswap token and pool metadata.')
+    parser.add_argument('--invalidate', action='store_true', help='Remove cached metadata')
+    parser.add_argument('--address', type=str, help='Only invalidate entries for this token or pool address', default=None)
+    args = parser.parse_args()
+
+    if args.invalidate:
+        invalidate(args.address)
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,70 @@
+from web3._utils.abi import get_abi_output_types, map_abi_data
+from web3._utils.normalizers import BASE_RETURN_NORMALIZERS
+
+from src.constants import MULTICALL3_ADDR, MULTICALL3_ABI
+from src.rpc import batch_call
+
+# https://github.com/mds1/multicall#batch-contract-reads
+# aggregate3 lets every call fail independently (allowFailure), so one missing pool or a non-standard token
+# does not revert the whole batch. The batch size keeps the calldata and the returned payload well under
+# the gas and response size limits of common RPC providers.
+MULTICALL_BATCH_SIZE = 500
+
+
+def decode_call_result(w3, contract_function, success, return_data):
+    """
+    Decode the return data of a single call made through Multicall3.
+
+    Args:
+    - w3: The Web3 instance whose codec is used for decoding.
+    - contract_function: The bound contract function (e.g. `pool_contract.functions.slot0()`) that was called.
+    - success (bool): Whether the call succeeded.
+    - return_data (bytes): The raw return data of the call.
+
+    Returns:
+    - The decoded value, a tuple when the function has several outputs, or None if the call failed.
+    """
+    if not success or not return_data:
+        return None
+    output_types = get_abi_output_types(contract_function.abi)
+    # Same normalization as contract calls made through web3 (checksum addresses)
+    decoded = map_abi_data(BASE_RETURN_NORMALIZERS, output_types, w3.codec.decode(output_types, return_data))
+    return decoded[0] if len(decoded) == 1 else decoded
+
+
+def aggregate3(w3, contract_functions, block_identifier='latest', allow_failure=True, batch_size=MULTICALL_BATCH_SIZE):
+    """
+    Execute a list of read-only contract calls through Multicall3 `aggregate3`.
+
+    Every `batch_size` calls are packed into a single `eth_call`, and when there are several of them they are
+    sent together as one JSON-RPC batch, so reading hundreds of values costs a single round trip. Works against
+    any node where Multicall3 is deployed, including an anvil fork of mainnet.
+
+    Args:
+    - w3: The Web3 instance to use.
+    - contract_functions (list): Bound contract functions, e.g. `[token.functions.decimals(), pool.functions.slot0()]`.
+    - block_identifier: Block at which the calls are executed. Defaults to 'latest'.
+    - allow_failure (bool): If True, failing calls return None instead of reverting the batch.
+    - batch_size (int): Maximum number of calls per `aggregate3` call.
+
+    Returns:
+    - list: The decoded results, in the same order as `contract_functions`.
+    """
+    multicall = w3.eth.contract(address=MULTICALL3_ADDR, abi=MULTICALL3_ABI)
+    chunks = [contract_functions[start:start + batch_size] for start in range(0, len(contract_functions), batch_size)]
+    encoded_chunks = [[(fn.address, allow_failure, fn._encode_transaction_data()) for fn in chunk] for chunk in chunks]
+
+    if len(chunks) > 1:
+        # Several aggregate3 calls are still one round trip when sent as a single JSON-RPC batch
+        block_param = hex(block_identifier) if isinstance(block_identifier, int) else block_identifier
+        raw_calls = [("eth_call", [{"to": MULTICALL3_ADDR, "data": multicall.functions.aggregate3(calls)._encode_transaction_data()}, block_param]) for calls in encoded_chunks]
+        raw_chunk_results = [w3.codec.decode(["(bool,bytes)[]"], bytes.fromhex(result[2:]))[0] for result in batch_call(w3, raw_calls)]
+    else:
+        raw_chunk_results = [multicall.functions.aggregate3(calls).call(block_identifier=block_identifier) for calls in encoded_chunks]
+
+    results = []
+    for chunk, raw_results in zip(chunks, raw_chunk_results):
+        for fn, (success, return_data) in zip(chunk, raw_results):
+            results.append(decode_call_result(w3, fn, success, return_data))
+
+    return results
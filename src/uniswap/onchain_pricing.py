@@ -0,0 +1,88 @@
+import heapq
+from collections import defaultdict
+
+from src.constants import TOKEN_CONTRACT_MAP
+from src.uniswap.price_math import sqrt_price_to_price_exact
+
+# Tokens assumed to be worth exactly 1 USD, every other price is derived from pool prices starting from them
+USD_ANCHORS = {
+    TOKEN_CONTRACT_MAP['USDC']: 1.0,
+    TOKEN_CONTRACT_MAP['USDT']: 1.0,
+}
+
+
+def pool_price_and_balances(state):
+    """
+    Compute the pool level price and the normalized balances of a pool from its raw state.
+
+    Args:
+    - state (dict): Pool state as returned by `fetch_pool_states`.
+
+    Returns:
+    - tuple: (price of token0 quoted in token1, token0 balance, token1 balance), balances normalized by decimals.
+    """
+    token0_balance = state['token0_balance'] / (10 ** state['token0_decimals'])
+    token1_balance = state['token1_balance'] / (10 ** state['token1_decimals'])
+
+    if state['version'] == "v3":
+        price = sqrt_price_to_price_exact(state['sqrt_price_x96'], state['token0_decimals'], state['token1_decimals'])[0]
+    else:
+        price = token1_balance / token0_balance if token0_balance else 0.0
+
+    return price, token0_balance, token1_balance
+
+
+def build_price_graph(pool_states):
+    """
+    Build the graph of pool prices: for every pool, one edge per direction.
+
+    Returns:
+    - dict: token -> list of (other token, price of the other token quoted in this token, balance of this token in the pool)
+    """
+    graph = defaultdict(list)
+    for state in pool_states:
+        price, token0_balance, token1_balance = pool_price_and_balances(state)
+        if price <= 0 or token0_balance <= 0 or token1_balance <= 0:
+            continue
+        graph[state['token0']].append((state['token1'], 1 / price, token0_balance))
+        graph[state['token1']].append((state['token0'], price, token1_balance))
+    return graph
+
+
+def derive_usd_prices(pool_states, anchors=None):
+    """
+    Derive the USD price of every token reachable from a USD anchor through the given pools.
+
+    Each token is priced through its most liquid path: the path whose least liquid pool holds the most USD on the
+    already priced side (a widest path search over the pool graph). Only the states passed in are used, so pricing
+    adds no network calls and works for any block the states were read at.
+
+    Args:
+    - pool_states (iterable): Pool states as returned by `fetch_pool_states`, read at the same block.
+    - anchors (dict, optional): Token address -> USD price of the tokens used as reference. Defaults to USDC and USDT at 1 USD.
+
+    Returns:
+    - dict: Token address -> USD price. Tokens without a path to an anchor are left out.
+    """
+    anchors = USD_ANCHORS if anchors is None else anchors
+    graph = build_price_graph(pool_states)
+
+    usd_prices = {}
+    # Max-heap on the bottleneck liquidity of the path found so far
+    heap = [(-float('inf'), token, price) for token, price in anchors.items()]
+    heapq.heapify(heap)
+
+    while heap:
+        negative_bottleneck, token, price = heapq.heappop(heap)
+        if token in usd_prices:
+            continue
+        usd_prices[token] = price
+
+        for other_token, other_price_in_token, token_balance in graph[token]:
+            if other_token in usd_prices:
+                continue
+            # USD liquidity of the pool, measured on the side whose price is already known
+            bottleneck = min(-negative_bottleneck, token_balance * price)
+            heapq.heappush(heap, (-bottleneck, other_token, other_price_in_token * price))
+
+    return usd_prices
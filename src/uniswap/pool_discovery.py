@@ -0,0 +1,145 @@
+import argparse
+import sqlite3
+import threading
+
+from web3 import Web3
+
+from src.constants import *
+from src.uniswap.log_fetcher import iter_logs
+from src.uniswap.uniswap import w3
+
+# Every pool ever created by the factories, backfilled from their creation events, so "which pools exist for these
+# tokens" is an indexed local lookup instead of one getPair/getPool call per pair and fee tier.
+POOL_INDEX_PATH = f"{ROOT_DIRECTORY}/data/uniswap_pool_index.sqlite"
+DEFAULT_CONFIRMATIONS = 12
+
+# https://docs.uniswap.org/contracts/v2/reference/smart-contracts/factory#paircreated
+PAIR_CREATED_TOPIC = Web3.keccak(text="PairCreated(address,address,address,uint256)")
+# https://docs.uniswap.org/contracts/v3/reference/core/interfaces/IUniswapV3Factory#poolcreated
+POOL_CREATED_TOPIC = Web3.keccak(text="PoolCreated(address,address,uint24,int24,address)")
+
+# (version, factory address, creation event topic, factory deployment block)
+FACTORIES = [
+    ("v2", UNISWAP_V2_FACTORY_ADDR, PAIR_CREATED_TOPIC, 10000835),
+    ("v3", UNISWAP_V3_FACTORY_ADDR, POOL_CREATED_TOPIC, 12369621),
+]
+
+_connection = None
+_lock = threading.Lock()
+
+
+def _get_connection():
+    global _connection
+    if _connection is None:
+        _connection = sqlite3.connect(POOL_INDEX_PATH, check_same_thread=False)
+        _connection.executescript("""
+            CREATE TABLE IF NOT EXISTS pools (address TEXT PRIMARY KEY, version TEXT NOT NULL, token0 TEXT NOT NULL, token1 TEXT NOT NULL,
+                                              fee INTEGER, tick_spacing INTEGER, created_block INTEGER NOT NULL);
+            CREATE INDEX IF NOT EXISTS pools_token0 ON pools (token0);
+            CREATE INDEX IF NOT EXISTS pools_token1 ON pools (token1);
+            CREATE TABLE IF NOT EXISTS progress (factory TEXT PRIMARY KEY, last_block INTEGER NOT NULL);
+        """)
+    return _connection
+
+
+def _topic_to_address(topic):
+    return Web3.to_checksum_address(bytes(topic)[-20:])
+
+
+def decode_creation_log(version, log):
+    """
+    Decode a PairCreated (v2) or PoolCreated (v3) log.
+
+    Returns:
+    - tuple: (pool address, version, token0, token1, fee, tick spacing, block number), fee and tick spacing are None for v2.
+    """
+    token0_address, token1_address = _topic_to_address(log["topics"][1]), _topic_to_address(log["topics"][2])
+    if version == "v2":
+        pool_address, _ = w3.codec.decode(["address", "uint256"], bytes(log["data"]))
+        fee, tick_spacing = None, None
+    else:
+        fee = w3.codec.decode(["uint24"], bytes(log["topics"][3]))[0]
+        tick_spacing, pool_address = w3.codec.decode(["int24", "address"], bytes(log["data"]))
+    return Web3.to_checksum_address(pool_address), version, token0_address, token1_address, fee, tick_spacing, log["blockNumber"]
+
+
+def get_last_indexed_block(factory_address):
+    with _lock:
+        rows = _get_connection().execute("SELECT last_block FROM progress WHERE factory = ?", (factory_address,)).fetchall()
+    return rows[0][0] if rows else None
+
+
+def sync_pool_index(to_block=None, confirmations=DEFAULT_CONFIRMATIONS):
+    """
+    Backfill the creation events of both factories, starting from the last indexed block of each.
+
+    The first run scans from the factory deployment blocks, later runs only the blocks created since. Pools and
+    progress are committed together after every log range, so an interrupted sync resumes where it stopped.
+
+    Args:
+    - to_block (int, optional): Last block to index. Defaults to the head minus `confirmations`.
+    - confirmations (int): Number of blocks to stay behind the head.
+    """
+    to_block = to_block if to_block is not None else w3.eth.block_number - confirmations
+
+    for version, factory_address, topic, deployment_block in FACTORIES:
+        last_block = get_last_indexed_block(factory_address)
+        from_block = deployment_block if last_block is None else last_block + 1
+
+        for chunk_from, chunk_to, logs in iter_logs(w3, from_block, to_block, address=factory_address, topics=[topic.hex()]):
+            rows = [decode_creation_log(version, log) for log in logs]
+            with _lock:
+                connection = _get_connection()
+                with connection:
+                    connection.executemany("INSERT OR REPLACE INTO pools (address, version, token0, token1, fee, tick_spacing, created_block) VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+                    connection.execute("INSERT OR REPLACE INTO progress (factory, last_block) VALUES (?, ?)", (factory_address, chunk_to))
+            if rows:
+                print(f"Indexed {len(rows)} {version} pools in blocks {chunk_from} - {chunk_to}")
+
+
+def _rows_to_pools(rows):
+    return [{"address": address, "version": version, "token0": token0_address, "token1": token1_address, "fee": fee}
+            for address, version, token0_address, token1_address, fee in rows]
+
+
+def find_pools(token_a, token_b):
+    """
+    Return every indexed v2 and v3 pool of a token pair, whatever the order of the tokens.
+
+    Returns:
+    - list: Dicts with the pool "address", "version", "token0", "token1" and "fee" (None for v2), v3 pools first.
+    """
+    token0_address, token1_address = sorted([Web3.to_checksum_address(token_a), Web3.to_checksum_address(token_b)], key=str.lower)
+    with _lock:
+        rows = _get_connection().execute(
+            "SELECT address, version, token0, token1, fee FROM pools WHERE token0 = ? AND token1 = ? ORDER BY version DESC, fee",
+            (token0_address, token1_address)).fetchall()
+    return _rows_to_pools(rows)
+
+
+def find_pools_with_token(token_address):
+    """ Return every indexed pool containing the given token, on either side """
+    token_address = Web3.to_checksum_address(token_address)
+    with _lock:
+        rows = _get_connection().execute(
+            "SELECT address, version, token0, token1, fee FROM pools WHERE token0 = ? UNION ALL SELECT address, version, token0, token1, fee FROM pools WHERE token1 = ?",
+            (token_address, token_address)).fetchall()
+    return _rows_to_pools(rows)
+
+
+def run():
+    parser = argparse.ArgumentParser(description='Index every Uniswap v2/v3 pool from the factory creation events.')
+    parser.add_argument('--to-block', type=int, help='Last block to index. Defaults to the head minus the confirmations', default=None)
+    parser.add_argument('--confirmations', type=int, help='Number of blocks to stay behind the head', default=DEFAULT_CONFIRMATIONS)
+    parser.add_argument('--token', type=str, help='List the indexed pools containing this token address instead of syncing', default=None)
+    args = parser.parse_args()
+
+    if args.token:
+        for pool in find_pools_with_token(args.token):
+            print(pool)
+    else:
+        sync_pool_index(to_block=args.to_block, confirmations=args.confirmations)
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,112 @@
+import sqlite3
+import threading
+
+from web3 import Web3
+
+from src.constants import ROOT_DIRECTORY
+from src.uniswap import metadata_cache
+
+# Current state of every watched pool, kept up to date by src/uniswap/event_indexer.py from Sync/Swap/Mint/Burn/
+# Collect/Flash logs. Balances, sqrtPriceX96 and liquidity overflow SQLite integers and are stored as text.
+POOL_STATE_PATH = f"{ROOT_DIRECTORY}/data/uniswap_pool_state.sqlite"
+
+_connection = None
+_lock = threading.Lock()
+
+
+def _get_connection():
+    global _connection
+    if _connection is None:
+        _connection = sqlite3.connect(POOL_STATE_PATH, check_same_thread=False)
+        _connection.executescript("""
+            CREATE TABLE IF NOT EXISTS pool_state (address TEXT PRIMARY KEY, version TEXT NOT NULL, token0_balance TEXT NOT NULL, token1_balance TEXT NOT NULL,
+                                                   sqrt_price_x96 TEXT, liquidity TEXT, tick INTEGER);
+            CREATE TABLE IF NOT EXISTS progress (id INTEGER PRIMARY KEY CHECK (id = 0), last_block INTEGER NOT NULL);
+        """)
+    return _connection
+
+
+def get_last_block():
+    """ Last block whose logs are applied to every watched pool, or None if nothing is indexed yet """
+    with _lock:
+        rows = _get_connection().execute("SELECT last_block FROM progress WHERE id = 0").fetchall()
+    return rows[0][0] if rows else None
+
+
+def get_watched_pools():
+    """ Return a dict of pool address -> version of every watched pool """
+    with _lock:
+        return dict(_get_connection().execute("SELECT address, version FROM pool_state").fetchall())
+
+
+_STATE_COLUMNS = "address, version, token0_balance, token1_balance, sqrt_price_x96, liquidity, tick"
+
+
+def _row_to_state(row):
+    address, version, token0_balance, token1_balance, sqrt_price_x96, liquidity, tick = row
+    return {
+        "version": version,
+        "token0_balance": int(token0_balance),
+        "token1_balance": int(token1_balance),
+        "sqrt_price_x96": int(sqrt_price_x96) if sqrt_price_x96 is not None else None,
+        "liquidity": int(liquidity) if liquidity is not None else None,
+        "tick": tick,
+    }
+
+
+def load_pool_states():
+    """ Load the raw state of every watched pool, as a dict of pool address -> mutable state dict """
+    with _lock:
+        rows = _get_connection().execute(f"SELECT {_STATE_COLUMNS} FROM pool_state").fetchall()
+    return {row[0]: _row_to_state(row) for row in rows}
+
+
+def save_pool_states(pool_states, last_block):
+    """
+    Persist the state of the given pools and the indexing progress in a single transaction, so the store never
+    holds state from a partially applied block range.
+    """
+    def to_text(value):
+        return str(value) if value is not None else None
+
+    with _lock:
+        connection = _get_connection()
+        with connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO pool_state (address, version, token0_balance, token1_balance, sqrt_price_x96, liquidity, tick) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(address, state["version"], str(state["token0_balance"]), str(state["token1_balance"]), to_text(state.get("sqrt_price_x96")),
+                  to_text(state.get("liquidity")), state.get("tick")) for address, state in pool_states.items()])
+            connection.execute("INSERT OR REPLACE INTO progress (id, last_block) VALUES (0, ?)", (last_block,))
+
+
+def get_indexed_state(pool_address):
+    """
+    Return the state of a watched pool in the format of `fetch_pool_states`, without any RPC call.
+
+    Token addresses, decimals and fee tier come from the metadata cache, which is filled when the pool is first watched.
+
+    Returns:
+    - dict: The pool state, or None if the pool is not watched or its metadata is not cached.
+    """
+    pool_address = Web3.to_checksum_address(pool_address)
+    with _lock:
+        rows = _get_connection().execute(f"SELECT {_STATE_COLUMNS} FROM pool_state WHERE address = ?", (pool_address,)).fetchall()
+    metadata = metadata_cache.get_pool_metadata(pool_address)
+    if not rows or metadata is None:
+        return None
+
+    state = _row_to_state(rows[0])
+    token0_decimals = metadata_cache.get_token_decimals(metadata["token0"])
+    token1_decimals = metadata_cache.get_token_decimals(metadata["token1"])
+    if token0_decimals is None or token1_decimals is None:
+        return None
+
+    state.update({
+        "pool_address": pool_address,
+        "token0": metadata["token0"],
+        "token1": metadata["token1"],
+        "token0_decimals": token0_decimals,
+        "token1_decimals": token1_decimals,
+        "fee": metadata["fee"],
+    })
+    return state
@@ -0,0 +1,72 @@
+import numpy as np
+
+# https://blog.uniswap.org/uniswap-v3-math-primer
+Q96 = 2 ** 96
+Q192 = 2 ** 192
+
+
+def _divide(numerator, denominator):
+    """ Correctly rounded int / int, saturating to inf when the result is beyond float64 """
+    try:
+        return numerator / denominator
+    except (OverflowError, ZeroDivisionError):
+        return float('inf')
+
+
+def sqrt_price_to_price_exact(sqrt_price_x96, token0_decimals, token1_decimals):
+    """
+    Convert one sqrtPriceX96 to the prices of both tokens with exact integer arithmetic.
+
+    Python's int / int true division is correctly rounded, so the results are the floats closest to the exact
+    rational prices, saturating to 0 or inf beyond the float64 range.
+
+    Returns:
+    - tuple: (price of token0 quoted in token1, price of token1 quoted in token0)
+    """
+    decimals_difference = token0_decimals - token1_decimals
+    numerator = sqrt_price_x96 * sqrt_price_x96 * 10 ** max(decimals_difference, 0)
+    denominator = Q192 * 10 ** max(-decimals_difference, 0)
+    return _divide(numerator, denominator), _divide(denominator, numerator)
+
+
+def sqrt_prices_to_prices(sqrt_prices_x96, token0_decimals, token1_decimals, exact=False):
+    """
+    Convert arrays of sqrtPriceX96 values to the prices of both tokens of each pool.
+
+    The float64 path is accurate to a few ulps for every sqrtPriceX96 Uniswap allows (2^32 to 2^160) and usual
+    decimals, since sqrtPriceX96 / 2^96 squared stays within 2^-128 and 2^128. Elements whose float result
+    overflows or underflows, or all elements when `exact` is True, go through the exact integer path instead.
+
+    Args:
+    - sqrt_prices_x96 (array-like): sqrtPriceX96 values as Python ints (they overflow int64).
+    - token0_decimals (int or array-like): Decimals of token0, broadcast against the prices.
+    - token1_decimals (int or array-like): Decimals of token1, broadcast against the prices.
+    - exact (bool): Use exact integer arithmetic for every element.
+
+    Returns:
+    - tuple: (prices of token0 quoted in token1, prices of token1 quoted in token0) as float64 arrays.
+    """
+    sqrt_prices_x96 = np.atleast_1d(np.asarray(sqrt_prices_x96, dtype=object))
+    decimals_difference = np.broadcast_to(np.asarray(token0_decimals, dtype=np.int64) - np.asarray(token1_decimals, dtype=np.int64), sqrt_prices_x96.shape)
+
+    if exact:
+        needs_exact = np.ones(sqrt_prices_x96.shape, dtype=bool)
+        price0_in_1 = np.empty(sqrt_prices_x96.shape, dtype=np.float64)
+    else:
+        with np.errstate(over='ignore', under='ignore', divide='ignore'):
+            ratio = sqrt_prices_x96.astype(np.float64) / Q96
+            price0_in_1 = ratio * ratio * np.power(10.0, decimals_difference)
+        needs_exact = ~np.isfinite(price0_in_1) | (price0_in_1 == 0)
+
+    with np.errstate(divide='ignore'):
+        price1_in_0 = 1 / price0_in_1
+
+    for index in zip(*np.nonzero(needs_exact)):
+        if sqrt_prices_x96[index] == 0:
+            # Pool not initialized yet
+            price0_in_1[index], price1_in_0[index] = 0.0, np.inf
+            continue
+        difference = int(decimals_difference[index])
+        price0_in_1[index], price1_in_0[index] = sqrt_price_to_price_exact(int(sqrt_prices_x96[index]), difference, 0)
+
+    return price0_in_1, price1_in_0
@@ -0,0 +1,111 @@
+import csv
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from src.constants import ROOT_DIRECTORY
+from src.uniswap.uniswap import build_pool_rows, fetch_pool_states, get_v2_pool_address, get_v3_pool_addresses
+
+DEFAULT_MAX_WORKERS = 8
+
+
+def snapshot_blocks(from_block, to_block, stride=1):
+    """ Block numbers from `from_block` to `to_block` (inclusive) every `stride` blocks """
+    return list(range(from_block, to_block + 1, stride))
+
+
+def load_checkpoint(checkpoint_path):
+    """ Return the set of blocks already written by a previous run """
+    if not os.path.exists(checkpoint_path):
+        return set()
+    with open(checkpoint_path, 'r') as file:
+        return {int(line) for line in file if line.strip()}
+
+
+def drop_unfinished_blocks(filename, completed_blocks):
+    """
+    Remove from the CSV the rows of blocks missing from the checkpoint, and a last line cut short.
+
+    Rows are written before their block is checkpointed, so a run interrupted in between leaves rows that the next
+    run would write again. They are dropped and their blocks fetched once more, which keeps one set of rows per block.
+    """
+    if not os.path.exists(filename) or os.path.getsize(filename) == 0:
+        return
+    with open(filename, 'r', newline='') as csvfile:
+        lines = csvfile.readlines()
+    complete_lines = lines if lines[-1].endswith('\n') else lines[:-1]
+    header, rows = complete_lines[:1], complete_lines[1:]
+    kept_rows = [row for row, record in zip(rows, csv.DictReader(header + rows)) if int(record["Block number"]) in completed_blocks]
+    if len(kept_rows) == len(rows) == len(lines) - 1:
+        return
+    print(f"Dropping {len(lines) - 1 - len(kept_rows)} rows of blocks that were not completed from {filename}")
+    with open(f"{filename}.tmp", 'w', newline='') as csvfile:
+        csvfile.writelines(header + kept_rows)
+    os.replace(f"{filename}.tmp", filename)
+
+
+def snapshot_block(block_number, v3_pool_addresses, v2_pool_addresses, price_source='onchain'):
+    """
+    Read every pool at one block (batched through Multicall3) and build its rows.
+
+    Returns:
+    - list: Rows in the format of the CSV headers, with a leading "Block number" column.
+    """
+    states = fetch_pool_states(v3_pool_addresses, v2_pool_addresses, block_identifier=block_number)
+    return [{"Block number": block_number, **row} for row in build_pool_rows(states.values(), price_source=price_source)]
+
+
+def snapshot_pair(token0_address, token1_address, blocks, pool_name, max_workers=DEFAULT_MAX_WORKERS, price_source='onchain'):
+    """
+    Sample every pool of a pair at each of the given blocks and append the rows to one time-series CSV.
+
+    Blocks are read concurrently, and rows are written in block order. After every block the checkpoint file is
+    updated, so an interrupted backfill started again with the same arguments skips the blocks already written, and
+    drops the rows of a block written but not checkpointed before it fetches that block again.
+    USD prices are derived on-chain by default since CoinGecko only provides spot prices.
+
+    Args:
+    - token0_address (str): Contract address of token0.
+    - token1_address (str): Contract address of token1.
+    - blocks (list): Block numbers to sample.
+    - pool_name (str): Name used for the output and checkpoint files, e.g. "WETH-USDC".
+    - max_workers (int): Number of blocks fetched concurrently.
+    - price_source (str): 'onchain' or 'coingecko', see `build_pool_rows`.
+
+    Returns:
+    - str: Path of the CSV file.
+    """
+    filename = f"{ROOT_DIRECTORY}/data/{pool_name}_uniswap_snapshots.csv"
+    # One completed block number per line, appending keeps checkpointing cheap on multi-day backfills
+    checkpoint_path = f"{filename}.checkpoint"
+
+    completed_blocks = load_checkpoint(checkpoint_path)
+    drop_unfinished_blocks(filename, completed_blocks)
+    pending_blocks = [block for block in blocks if block not in completed_blocks]
+    print(f"{len(completed_blocks)} blocks already written, {len(pending_blocks)} blocks to fetch for {pool_name} ...")
+
+    # Pool addresses do not depend on the block, pools deployed later are skipped at earlier blocks
+    v3_pool_addresses = get_v3_pool_addresses(token0_address, token1_address)
+    v2_pool_addresses = [get_v2_pool_address(token0_address, token1_address)]
+
+    write_header = not os.path.exists(filename) or os.path.getsize(filename) == 0
+    with open(filename, 'a', newline='') as csvfile, open(checkpoint_path, 'a') as checkpoint, ThreadPoolExecutor(max_workers=max_workers) as executor:
+        writer = None
+        # Submit a bounded window of blocks at a time so an interruption does not wait for the whole range
+        window = max_workers * 4
+        for start in range(0, len(pending_blocks), window):
+            window_blocks = pending_blocks[start:start + window]
+            rows_per_block = executor.map(lambda block: snapshot_block(block, v3_pool_addresses, v2_pool_addresses, price_source), window_blocks)
+            for block, rows in zip(window_blocks, rows_per_block):
+                if rows:
+                    if writer is None:
+                        writer = csv.DictWriter(csvfile, fieldnames=rows[0].keys())
+                        if write_header:
+                            writer.writeheader()
+                    writer.writerows(rows)
+                    csvfile.flush()
+
+                checkpoint.write(f"{block}\n")
+                checkpoint.flush()
+
+    print(f"Snapshots written successfully to {filename}!")
+    return filename
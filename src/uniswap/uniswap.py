@@ -1,15 +1,19 @@
-from web3 import Web3
 from src.constants import *
+from src.constants import ERC20_ABI, UNISWAP_V2_FACTORY_ABI, UNISWAP_V2_POOL_ABI, UNISWAP_V3_FACTORY_ABI, UNISWAP_V3_POOL_ABI
 from dotenv import load_dotenv
 import os
-from decimal import Decimal, getcontext
-getcontext().prec = 100  # Setting precision to a large number
 
-from src.uniswap.coingecko import get_token_prices
+from src.uniswap.coingecko import get_token_prices, get_token_prices_batch
+from src.uniswap.onchain_pricing import derive_usd_prices
+from src.uniswap.multicall import aggregate3
+from src.uniswap import metadata_cache
+from src.uniswap.pool_state_store import get_indexed_state
+from src.uniswap.price_math import sqrt_price_to_price_exact, sqrt_prices_to_prices
+from src.rpc import get_web3
 
 load_dotenv()
 
-w3 = Web3(Web3.HTTPProvider(os.environ.get('ETHEREUM_HTTP_ENDPOINT')))  # https://www.quicknode.com/
+w3 = get_web3('ETHEREUM_HTTP_ENDPOINT')  # https://www.quicknode.com/
 
 # https://docs.uniswap.org/contracts/v2/reference/smart-contracts/factory, https://unpkg.com/@uniswap/v2-core@1.0.0/build/IUniswapV2Factory.json
 # https://web3py.readthedocs.io/en/stable/overview.html
@@ -17,15 +21,53 @@ w3 = Web3(Web3.HTTPProvider(os.environ.get('ETHEREUM_HTTP_ENDPOINT')))  # https:
 
 
 def get_v2_pool_address(token0_address, token1_address):
+    cached_pool = metadata_cache.get_factory_pool("v2", token0_address, token1_address)
+    if cached_pool:
+        return cached_pool
+
     v2_factory = w3.eth.contract(address=UNISWAP_V2_FACTORY_ADDR, abi=UNISWAP_V2_FACTORY_ABI)
-    return v2_factory.functions.getPair(token0_address, token1_address).call()
+    pool_address = v2_factory.functions.getPair(token0_address, token1_address).call()
+    if pool_address != ZERO_ADDRESS:
+        metadata_cache.set_factory_pool("v2", token0_address, token1_address, pool_address)
+    return pool_address
 
 
 def get_v3_pool_addresses(token0_address, token1_address, fee_tiers=UNISWAP_V3_TIERS_BPS):
     # https://docs.uniswap.org/contracts/v3/reference/core/UniswapV3Factory
     # https://etherscan.io/address/0x7858e59e0c01ea06df3af3d20ac7b0003275d4bf USDC-USDT example
     v3_factory = w3.eth.contract(address=UNISWAP_V3_FACTORY_ADDR, abi=UNISWAP_V3_FACTORY_ABI)
-    return [v3_factory.functions.getPool(token0_address, token1_address, fee).call() for fee in fee_tiers]
+    pool_addresses = []
+    for fee in fee_tiers:
+        pool_address = metadata_cache.get_factory_pool("v3", token0_address, token1_address, fee)
+        if not pool_address:
+            pool_address = v3_factory.functions.getPool(token0_address, token1_address, fee).call()
+            if pool_address != ZERO_ADDRESS:
+                metadata_cache.set_factory_pool("v3", token0_address, token1_address, pool_address, fee)
+        pool_addresses.append(pool_address)
+    return pool_addresses
+
+
+def get_token_decimals(token_address):
+    """ Return the decimals of an ERC20, read from chain only the first time it is seen """
+    decimals = metadata_cache.get_token_decimals(token_address)
+    if decimals is None:
+        decimals = w3.eth.contract(address=token_address, abi=ERC20_ABI).functions.decimals().call()
+        metadata_cache.set_token_decimals(token_address, decimals)
+    return decimals
+
+
+def get_pool_metadata(pool_contract, version):
+    """ Return token0, token1 and fee (None for v2) of a pool, read from chain only the first time it is seen """
+    metadata = metadata_cache.get_pool_metadata(pool_contract.address)
+    if metadata is None:
+        metadata = {
+            "version": version,
+            "token0": pool_contract.functions.token0().call(),
+            "token1": pool_contract.functions.token1().call(),
+            "fee": pool_contract.functions.fee().call() if version == "v3" else None,
+        }
+        metadata_cache.set_pool_metadata(pool_contract.address, **metadata)
+    return metadata
 
 
 def get_v3_pool_balances(pool_address, token0_address, token1_address):
@@ -43,10 +85,8 @@ def get_v3_pool_balances(pool_address, token0_address, token1_address):
 def sqrt_price_to_price(sqrtPriceX96, token0Decimals, token1Decimals):
     """Converts the sqrt price to actual price."""
     # https://blog.uniswap.org/uniswap-v3-math-primer
-    math_price = (Decimal(sqrtPriceX96) ** 2) / (Decimal(2) ** 192)
-    decimal_adjustment = Decimal(10) ** (token0Decimals - token1Decimals)
-    price = math_price * decimal_adjustment
-    return float(price)
+    # Exact integer arithmetic, see src/uniswap/price_math.py for the vectorized version
+    return sqrt_price_to_price_exact(sqrtPriceX96, token0Decimals, token1Decimals)[0]
 
 
 def get_pool_level_prices(token0_balance, token1_balance, token0_decimals, token1_decimals, pool_contract, quote_token="token1"):
@@ -64,9 +104,6 @@ def get_pool_level_prices(token0_balance, token1_balance, token0_decimals, token
     A tuple (priceToken0inToken1, priceToken1inToken0)
     """
 
-    # Ensure precision for Decimal calculations
-    getcontext().prec = 100
-
     # Assert non-zero balances
     assert token0_balance > 0, "Token0 balance must be greater than 0"
     assert token1_balance > 0, "Token1 balance must be greater than 0"
@@ -86,50 +123,48 @@ def get_pool_level_prices(token0_balance, token1_balance, token0_decimals, token
         raise ValueError("Invalid quote_token specified. Must be 'token1' or 'token0'.")
 
 
-def get_v3_pool_details(pool_address):
-    # Create a contract object using Web3
-    pool_contract = w3.eth.contract(address=pool_address, abi=UNISWAP_V3_POOL_ABI)
-
-    # Fetch the token addresses
-    token0_address = pool_contract.functions.token0().call()
-    token1_address = pool_contract.functions.token1().call()
+def v3_pool_row(state, token0_usd_price=None, token1_usd_price=None, prices=None):
+    """
+    Build the CSV row of a v3 pool from its on-chain state.
 
-    # Load the ABI for a standard ERC20 token
-    # You'll need to have this ABI stored in your project
-    token0_contract = w3.eth.contract(address=token0_address, abi=ERC20_ABI)
-    token1_contract = w3.eth.contract(address=token1_address, abi=ERC20_ABI)
+    Args:
+    - state (dict): Pool state as returned by `fetch_pool_states` (raw balances, decimals, sqrtPriceX96, fee).
+    - token0_usd_price (float, optional): USD price of token0. Fetched from CoinGecko if not provided.
+    - token1_usd_price (float, optional): USD price of token1. Fetched from CoinGecko if not provided.
+    - prices (tuple, optional): (price of token0 in token1, price of token1 in token0) if already computed in a batch.
 
-    # Fetch token decimals
-    token0_decimals = token0_contract.functions.decimals().call()
-    token1_decimals = token1_contract.functions.decimals().call()
+    Returns:
+    - dict: The row in the format of the CSV headers.
+    """
+    token0_address, token1_address = state['token0'], state['token1']
 
-    # Fetch token balances for given pool
-    token0_balance, token1_balance = get_v3_pool_balances(pool_address, token0_address, token1_address)
+    # Assert non-zero balances
+    assert state['token0_balance'] > 0, "Token0 balance must be greater than 0"
+    assert state['token1_balance'] > 0, "Token1 balance must be greater than 0"
+    assert state['sqrt_price_x96'] > 0, "sqrtPriceX96 should be greater than 0"
 
-    # Use our new method to fetch the prices
-    priceToken0inToken1 = get_pool_level_prices(token0_balance, token1_balance, token0_decimals, token1_decimals, pool_contract, quote_token="token1")
-    priceToken1inToken0 = get_pool_level_prices(token0_balance, token1_balance, token0_decimals, token1_decimals, pool_contract, quote_token="token0")
+    if prices is None:
+        prices = sqrt_price_to_price_exact(state['sqrt_price_x96'], state['token0_decimals'], state['token1_decimals'])
+    priceToken0inToken1, priceToken1inToken0 = prices
 
-    token0_balance = token0_balance / (10 ** token0_decimals)
-    token1_balance = token1_balance / (10 ** token1_decimals)
+    token0_balance = state['token0_balance'] / (10 ** state['token0_decimals'])
+    token1_balance = state['token1_balance'] / (10 ** state['token1_decimals'])
 
-    # Fetch the token prices in USD from an external source (placeholder)
-    # Replace with your actual implementation
-    token0_usd_price, token1_usd_price = get_token_prices(token0_address.lower(), token1_address.lower())
+    # Fetch the token prices in USD from an external source unless the caller already has them
+    if token0_usd_price is None or token1_usd_price is None:
+        token0_usd_price, token1_usd_price = get_token_prices(token0_address.lower(), token1_address.lower())
 
     # Calculate values as per CSV format
     token0_usd_value = token0_balance * token0_usd_price
     token1_usd_value = token1_balance * token1_usd_price
 
-    fee_tier = w3.eth.contract(address=pool_address, abi=UNISWAP_V3_POOL_ABI).functions.fee().call()
-
     # Return data in the format of the CSV headers
     return {
         "Uniswap version": "v3",
-        "Pool address": pool_address,
+        "Pool address": state['pool_address'],
         "Contract address for token0": token0_address,
         "Contract address for token1": token1_address,
-        "Fee tier (in bps)": fee_tier,
+        "Fee tier (in bps)": state['fee'],
         "Amount of token0 in the pool (normalized by decimals)": token0_balance,
         "Amount of token1 in the pool (normalized by decimals)": token1_balance,
         "Total value locked in the pool as token0 denominated in USD": token0_usd_value,
@@ -141,33 +176,30 @@ def get_v3_pool_details(pool_address):
     }
 
 
-def get_v2_pool_details(pool_address):
-    # Create a contract object using Web3 for the v2 pool
-    pool_contract = w3.eth.contract(address=pool_address, abi=UNISWAP_V2_POOL_ABI)
-
-    # Fetch the token addresses
-    token0_address = pool_contract.functions.token0().call()
-    token1_address = pool_contract.functions.token1().call()
+def v2_pool_row(state, token0_usd_price=None, token1_usd_price=None):
+    """
+    Build the CSV row of a v2 pool from its on-chain state.
 
-    # Create contract objects for the tokens
-    token0_contract = w3.eth.contract(address=token0_address, abi=ERC20_ABI)
-    token1_contract = w3.eth.contract(address=token1_address, abi=ERC20_ABI)
+    Args:
+    - state (dict): Pool state as returned by `fetch_pool_states` (raw reserves and decimals).
+    - token0_usd_price (float, optional): USD price of token0. Fetched from CoinGecko if not provided.
+    - token1_usd_price (float, optional): USD price of token1. Fetched from CoinGecko if not provided.
 
-    # Fetch token decimals
-    token0_decimals = token0_contract.functions.decimals().call()
-    token1_decimals = token1_contract.functions.decimals().call()
+    Returns:
+    - dict: The row in the format of the CSV headers.
+    """
+    token0_address, token1_address = state['token0'], state['token1']
 
-    # Fetch token balances (reserves) for the given v2 pool
-    token0_balance, token1_balance, _ = pool_contract.functions.getReserves().call()
-    token0_balance, token1_balance = token0_balance / (10 ** token0_decimals), token1_balance / (10 ** token1_decimals)
+    token0_balance = state['token0_balance'] / (10 ** state['token0_decimals'])
+    token1_balance = state['token1_balance'] / (10 ** state['token1_decimals'])
 
     # Calculate pool-level prices
     priceToken0inToken1 = token0_balance / token1_balance
     priceToken1inToken0 = token1_balance / token0_balance
 
-    # Fetch the token prices in USD from an external source (placeholder)
-    # Replace with your actual implementation
-    token0_usd_price, token1_usd_price = get_token_prices(token0_address.lower(), token1_address.lower())
+    # Fetch the token prices in USD from an external source unless the caller already has them
+    if token0_usd_price is None or token1_usd_price is None:
+        token0_usd_price, token1_usd_price = get_token_prices(token0_address.lower(), token1_address.lower())
 
     # Calculate values as per CSV format
     token0_usd_value = token0_balance * token0_usd_price
@@ -176,7 +208,7 @@ def get_v2_pool_details(pool_address):
     # Return data in the format of the CSV headers
     return {
         "Uniswap version": "v2",
-        "Pool address": pool_address,
+        "Pool address": state['pool_address'],
         "Contract address for token0": token0_address,
         "Contract address for token1": token1_address,
         "Fee tier (in bps)": "N/A",  # Not applicable for v2
@@ -190,3 +222,226 @@ def get_v2_pool_details(pool_address):
         "Price of token1 in USD from external API": token1_usd_price
     }
 
+
+def get_v3_pool_details(pool_address, use_indexed_state=False):
+    # Read the pool from the local store kept up to date by src/uniswap/event_indexer.py, without any RPC call
+    if use_indexed_state:
+        state = get_indexed_state(pool_address)
+        if state is not None:
+            return v3_pool_row(state)
+
+    # Create a contract object using Web3
+    pool_contract = w3.eth.contract(address=pool_address, abi=UNISWAP_V3_POOL_ABI)
+
+    # Fetch the token addresses and fee tier (cached after the first run)
+    metadata = get_pool_metadata(pool_contract, "v3")
+    token0_address, token1_address = metadata["token0"], metadata["token1"]
+
+    # Fetch token decimals (cached after the first run)
+    token0_decimals = get_token_decimals(token0_address)
+    token1_decimals = get_token_decimals(token1_address)
+
+    # Fetch token balances for given pool
+    token0_balance, token1_balance = get_v3_pool_balances(pool_address, token0_address, token1_address)
+
+    state = {
+        "version": "v3",
+        "pool_address": pool_address,
+        "token0": token0_address,
+        "token1": token1_address,
+        "token0_decimals": token0_decimals,
+        "token1_decimals": token1_decimals,
+        "token0_balance": token0_balance,
+        "token1_balance": token1_balance,
+        "sqrt_price_x96": pool_contract.functions.slot0().call()[0],
+        "fee": metadata["fee"],
+    }
+    return v3_pool_row(state)
+
+
+def get_v2_pool_details(pool_address, use_indexed_state=False):
+    # Read the pool from the local store kept up to date by src/uniswap/event_indexer.py, without any RPC call
+    if use_indexed_state:
+        state = get_indexed_state(pool_address)
+        if state is not None:
+            return v2_pool_row(state)
+
+    # Create a contract object using Web3 for the v2 pool
+    pool_contract = w3.eth.contract(address=pool_address, abi=UNISWAP_V2_POOL_ABI)
+
+    # Fetch the token addresses (cached after the first run)
+    metadata = get_pool_metadata(pool_contract, "v2")
+    token0_address, token1_address = metadata["token0"], metadata["token1"]
+
+    # Fetch token decimals (cached after the first run)
+    token0_decimals = get_token_decimals(token0_address)
+    token1_decimals = get_token_decimals(token1_address)
+
+    # Fetch token balances (reserves) for the given v2 pool
+    token0_balance, token1_balance, _ = pool_contract.functions.getReserves().call()
+
+    state = {
+        "version": "v2",
+        "pool_address": pool_address,
+        "token0": token0_address,
+        "token1": token1_address,
+        "token0_decimals": token0_decimals,
+        "token1_decimals": token1_decimals,
+        "token0_balance": token0_balance,
+        "token1_balance": token1_balance,
+    }
+    return v2_pool_row(state)
+
+
+def fetch_pool_states(v3_pool_addresses, v2_pool_addresses, block_identifier='latest'):
+    """
+    Read the state of every given pool through Multicall3 in two rounds of batched calls.
+
+    The first round reads slot0 of the v3 pools and getReserves of the v2 pools, plus token0/token1/fee of pools
+    not in the metadata cache yet. The second round reads the v3 pool balances, plus the decimals of tokens not in
+    the cache yet, which both depend on the token addresses. Once the metadata is cached, only the calls for
+    mutable state are issued. Zero addresses (fee tiers or pairs without a pool) are skipped.
+
+    Args:
+    - v3_pool_addresses (list): Addresses of Uniswap v3 pools.
+    - v2_pool_addresses (list): Addresses of Uniswap v2 pairs.
+    - block_identifier: Block at which the state is read. Defaults to 'latest'.
+
+    Returns:
+    - dict: Pool address -> state dict with the raw (not normalized) balances, the token decimals and,
+      for v3 pools, sqrtPriceX96 and the fee tier. Pools with a failed call are left out.
+    """
+    pools = [(addr, "v3") for addr in v3_pool_addresses if addr != ZERO_ADDRESS]
+    pools += [(addr, "v2") for addr in v2_pool_addresses if addr != ZERO_ADDRESS]
+
+    # Round 1: everything that only depends on the pool address
+    states, calls, targets = {}, [], []
+    for addr, version in pools:
+        pool_contract = w3.eth.contract(address=addr, abi=UNISWAP_V3_POOL_ABI if version == "v3" else UNISWAP_V2_POOL_ABI)
+        states[addr] = {"version": version, "pool_address": addr}
+
+        metadata = metadata_cache.get_pool_metadata(addr)
+        if metadata:
+            states[addr].update(token0=metadata["token0"], token1=metadata["token1"], fee=metadata["fee"])
+        else:
+            calls += [pool_contract.functions.token0(), pool_contract.functions.token1()]
+            targets += [(addr, "token0"), (addr, "token1")]
+            if version == "v3":
+                calls.append(pool_contract.functions.fee())
+                targets.append((addr, "fee"))
+
+        calls.append(pool_contract.functions.slot0() if version == "v3" else pool_contract.functions.getReserves())
+        targets.append((addr, "slot0" if version == "v3" else "reserves"))
+
+    for (addr, key), result in zip(targets, aggregate3(w3, calls, block_identifier=block_identifier)):
+        states[addr][key] = result
+
+    existing_pools = []
+    for addr, version in pools:
+        state = states[addr]
+        mutable_state = state.pop("slot0" if version == "v3" else "reserves")
+        if mutable_state is None or state["token0"] is None or state["token1"] is None:
+            # Failed calls: the pool is not deployed yet at this block or is not a Uniswap pool
+            print(f"Skipping {version} pool {addr}: no state at block {block_identifier}")
+            del states[addr]
+            continue
+        if version == "v3":
+            state["sqrt_price_x96"], state["tick"] = mutable_state[0], mutable_state[1]
+        else:
+            state["token0_balance"], state["token1_balance"] = mutable_state[0], mutable_state[1]
+        if metadata_cache.get_pool_metadata(addr) is None:
+            metadata_cache.set_pool_metadata(addr, version, state["token0"], state["token1"], state.get("fee"))
+        existing_pools.append((addr, version))
+    pools = existing_pools
+
+    # Round 2: decimals of tokens not cached yet and balances of the v3 pools
+    token_addresses = sorted({state[key] for state in states.values() for key in ("token0", "token1")})
+    decimals = {token: metadata_cache.get_token_decimals(token) for token in token_addresses}
+    missing_tokens = [token for token, value in decimals.items() if value is None]
+
+    calls = [w3.eth.contract(address=token, abi=ERC20_ABI).functions.decimals() for token in missing_tokens]
+    v3_pools = [addr for addr, version in pools if version == "v3"]
+    for addr in v3_pools:
+        for key in ("token0", "token1"):
+            calls.append(w3.eth.contract(address=states[addr][key], abi=ERC20_ABI).functions.balanceOf(addr))
+    results = iter(aggregate3(w3, calls, block_identifier=block_identifier))
+
+    for token in missing_tokens:
+        decimals[token] = next(results)
+        if decimals[token] is not None:
+            metadata_cache.set_token_decimals(token, decimals[token])
+    for addr in v3_pools:
+        states[addr]["token0_balance"], states[addr]["token1_balance"] = next(results), next(results)
+    for addr, version in pools:
+        state = states[addr]
+        state["token0_decimals"] = decimals[state["token0"]]
+        state["token1_decimals"] = decimals[state["token1"]]
+        if None in (state["token0_decimals"], state["token1_decimals"], state["token0_balance"], state["token1_balance"]):
+            # Failed calls: a token without decimals() or balanceOf, which no price can be derived for
+            print(f"Skipping {version} pool {addr}: no token decimals or balances at block {block_identifier}")
+            del states[addr]
+
+    return states
+
+
+def build_pool_rows(pool_states, price_source='coingecko'):
+    """
+    Build the CSV rows of several pools, pricing all their tokens at once.
+
+    Args:
+    - pool_states (iterable): Pool states as returned by `fetch_pool_states`.
+    - price_source (str): 'coingecko' for one batched CoinGecko request, or 'onchain' to derive USD prices from
+      the pool states themselves (see src/uniswap/onchain_pricing.py), which also works for historical blocks.
+
+    Returns:
+    - list: One row per pool whose tokens could be priced and whose pool level price is defined.
+    """
+    pool_states = list(pool_states)
+    token_addresses = [state[key] for state in pool_states for key in ("token0", "token1")]
+    if price_source == "onchain":
+        usd_prices = {token.lower(): price for token, price in derive_usd_prices(pool_states).items()}
+    elif price_source == "coingecko":
+        usd_prices = get_token_prices_batch(token_addresses)
+    else:
+        raise ValueError(f"Invalid price_source: {price_source}. Allowed values are 'coingecko', 'onchain'.")
+
+    # Pool level prices of every v3 pool in one vectorized pass
+    v3_states = [state for state in pool_states if state["version"] == "v3"]
+    v3_prices = {}
+    if v3_states:
+        price0_in_1, price1_in_0 = sqrt_prices_to_prices([state["sqrt_price_x96"] for state in v3_states],
+                                                         [state["token0_decimals"] for state in v3_states],
+                                                         [state["token1_decimals"] for state in v3_states])
+        v3_prices = {state["pool_address"]: (float(p0), float(p1)) for state, p0, p1 in zip(v3_states, price0_in_1, price1_in_0)}
+
+    rows = []
+    for state in pool_states:
+        token0_usd_price = usd_prices.get(state["token0"].lower())
+        token1_usd_price = usd_prices.get(state["token1"].lower())
+        if token0_usd_price is None or token1_usd_price is None:
+            print(f"Skipping {state['version']} pool {state['pool_address']}: no {price_source} USD price for one of its tokens")
+            continue
+        try:
+            if state["version"] == "v3":
+                rows.append(v3_pool_row(state, token0_usd_price, token1_usd_price, prices=v3_prices[state["pool_address"]]))
+            else:
+                rows.append(v2_pool_row(state, token0_usd_price, token1_usd_price))
+        except (AssertionError, ZeroDivisionError) as e:
+            # Empty pools have no meaningful price
+            print(f"Skipping {state['version']} pool {state['pool_address']}: {e}")
+    return rows
+
+
+def get_pool_details_batched(v3_pool_addresses, v2_pool_addresses, block_identifier='latest', price_source='coingecko'):
+    """
+    Batched equivalent of calling `get_v3_pool_details`/`get_v2_pool_details` for every pool.
+
+    All on-chain reads of all pools are grouped into Multicall3 `aggregate3` calls (see `fetch_pool_states`),
+    so a whole pair scan costs two round trips instead of roughly ten per pool. The USD prices of all tokens are
+    fetched with a single CoinGecko request, or derived from the pool states with price_source='onchain'.
+
+    Returns:
+    - list: One row per existing pool, v3 pools first, in the format of the CSV headers.
+    """
+    states = fetch_pool_states(v3_pool_addresses, v2_pool_addresses, block_identifier=block_identifier)
+    return build_pool_rows(states.values(), price_source=price_source)
@@ -1,30 +1,14 @@
-import json
+from web3 import Web3
 
-import requests
-from selenium import webdriver
-import os
-
-from src.constants import root_directory, ADDRESS_TO_ABI_MAPPING
-
-
-def root_directory() -> str:
-    """
-    Determine the root directory of the project based on the presence of '.git' directory.
-
-    Returns:
-    - str: The path to the root directory of the project.
-    """
-    current_dir = os.getcwd()
-
-    while True:
-        if '.git' in os.listdir(current_dir):
-            return current_dir
-        else:
-            # Go up one level
-            current_dir = os.path.dirname(current_dir)
+from src.abi_registry import fetch_abis
+from src.constants import ROOT_DIRECTORY, root_directory
+from src.decoder_registry import decode_input
 
 
 def return_driver():
+    # selenium is only needed here, importing it at module level slowed down every command using src.utils
+    from selenium import webdriver
+
     # set up Chrome driver options
     options = webdriver.ChromeOptions()
     options.add_argument("--disable-blink-features=AutomationControlled")
@@ -41,8 +25,8 @@ def return_driver():
     # and provide direct paths to script for both binary and driver
     # First run the script get_correct_chromedriver.sh
     # Paths for the Chrome binary and ChromeDriver
-    CHROME_BINARY_PATH = f'{root_directory()}/src/chromium/chrome-linux64/chrome'
-    CHROMEDRIVER_PATH = f'{root_directory()}/src/chromium/chromedriver-linux64/chromedriver'
+    CHROME_BINARY_PATH = f'{ROOT_DIRECTORY}/src/chromium/chrome-linux64/chrome'
+    CHROMEDRIVER_PATH = f'{ROOT_DIRECTORY}/src/chromium/chromedriver-linux64/chromedriver'
 
     options = webdriver.ChromeOptions()
     options.binary_location = CHROME_BINARY_PATH
@@ -51,69 +35,19 @@ def return_driver():
     return driver
 
 
-ETHERSCAN_API_URL = "https://api.etherscan.io/api"
-ETHERSCAN_API_KEY = os.environ.get("ETHERSCAN_API_KEY")  # Replace with your Etherscan API key
-
-
-def get_contract_abi(contract_address: str) -> dict:
-    """
-    Fetch ABI of a contract from Etherscan
-    """
-    params = {
-        "module": "contract",
-        "action": "getabi",
-        "address": contract_address,
-        "apikey": ETHERSCAN_API_KEY
-    }
-
-    response = requests.get(ETHERSCAN_API_URL, params=params)
-    data = response.json()
-
-    if data['status'] == '1' and 'result' in data:
-        return json.loads(data['result'])
-    else:
-        raise Exception(f"Error fetching ABI for {contract_address}. Error: {data['message']}")
-
-
-def save_abi_locally(contract_address: str, directory=f"{root_directory()}/src/uniswap/ABI/"):
+def save_abi_locally(contract_address: str):
     """
-    Fetch ABI from Etherscan and save it locally in a specified directory. If ABI exists locally, load from the file.
+    Make sure the ABI of a contract is in the ABI registry (src/abi_registry.py), fetching it from Etherscan if missing.
+    Use `abi_registry.fetch_abis` to fetch several ABIs concurrently.
     """
-    filepath = os.path.join(directory, f"{contract_address}.json")
-
-    # If ABI file exists locally, load and return
-    if os.path.exists(filepath):
-        with open(filepath, 'r') as file:
-            print(f"Loading ABI for {contract_address} from local file.")
-            return json.load(file)
-
-    # Ensure the directory exists
-    if not os.path.exists(directory):
-        os.makedirs(directory)
-
-    # Fetch ABI from Etherscan
-    abi = get_contract_abi(contract_address)
-
-    # Save the ABI to a JSON file named after the contract address
-    with open(filepath, 'w') as file:
-        json.dump(abi, file, indent=4)
-
-    print(f"ABI for {contract_address} saved successfully!")
-    return abi
+    return fetch_abis([contract_address])[Web3.to_checksum_address(contract_address)]
 
 
 def decode_transaction(w3, transaction, contract_address):
-    abi = ADDRESS_TO_ABI_MAPPING.get(contract_address, None)  # Retrieve ABI directly from the mapping
-    if not abi:
-        return None
-    contract = w3.eth.contract(address=contract_address, abi=abi)
-    try:
-        decoded_data = contract.decode_function_input(transaction['input'])
-        return {
-            "function_name": decoded_data[0].fn_name,
-            "values": decoded_data[1]
-        }
-    except:
-        return None
-
+    """
+    Decode the input of a transaction or trace sent to a contract whose ABI is in the ABI registry.
 
+    Uses the selector tables of src/decoder_registry.py, compiled once per contract. Inputs that cannot be decoded
+    return None and are counted in `decoder_registry.decode_stats`. `w3` is kept for backward compatibility.
+    """
+    return decode_input(contract_address, transaction['input'])
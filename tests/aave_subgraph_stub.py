@@ -0,0 +1,78 @@
+import re
+
+from aiohttp import web
+
+# Fields of a query as sent by src/aave/subgraph.py: `[alias: ]entity(where: {...} orderBy: ... orderDirection: ... first: N)`
+FIELD_PATTERN = re.compile(r'(?:(\w+): )?(\w+)\(\s*where: \{(.*?)\},?\s*orderBy: (\w+),?\s*orderDirection: (\w+),?\s*first: (\d+)', re.S)
+CONDITION_PATTERN = re.compile(r'(timestamp_gte|timestamp_lt|timestamp|id_gt): "?([\w:]*)"?')
+
+
+def event(event_id, timestamp):
+    """ An event in the shape returned by the subgraph """
+    return {"id": event_id, "timestamp": timestamp, "reserve": {"stableBorrowRate": "0", "variableBorrowRate": str(10 ** 25), "utilizationRate": "0.5",
+                                                                "lastUpdateTimestamp": timestamp}}
+
+
+class SubgraphStub:
+    """
+    In-process aiohttp server answering the queries of src/aave/subgraph.py from `events`, a dict
+    (symbol, entity) -> list of events, like the Aave subgraph does: filtered, ordered, `first` rows at most.
+
+    `failures` are served, in order, instead of the next answers: an int is a status code, "disconnect" closes the
+    connection, "graphql" and "indexer" are a validation and a transient GraphQL error. Every query is kept in `queries`.
+    """
+
+    def __init__(self, events, failures=()):
+        self.events = events
+        self.failures = list(failures)
+        self.queries = []
+        self.runner = None
+        self.url = None
+
+    def select(self, entity, where, order_by, direction, first):
+        symbol = re.search(r'symbol: "(\w+)"', where).group(1)
+        rows = self.events.get((symbol, entity), [])
+        for key, value in CONDITION_PATTERN.findall(where):
+            if key == "timestamp_gte":
+                rows = [row for row in rows if row["timestamp"] >= int(value)]
+            elif key == "timestamp_lt":
+                rows = [row for row in rows if row["timestamp"] < int(value)]
+            elif key == "timestamp":
+                rows = [row for row in rows if row["timestamp"] == int(value)]
+            else:
+                rows = [row for row in rows if row["id"] > value]
+        # Ties are ordered by id, like the subgraph
+        rows = sorted(rows, key=lambda row: (row[order_by], row["id"]), reverse=direction == "desc")
+        return [{**row, "timestamp": str(row["timestamp"])} for row in rows[:first]]
+
+    async def handle(self, request):
+        query = (await request.json())["query"]
+        self.queries.append(query)
+        if self.failures:
+            failure = self.failures.pop(0)
+            if failure == "disconnect":
+                request.transport.close()
+                return web.Response()
+            if failure == "graphql":
+                return web.json_response({"errors": [{"message": "Type `Query` has no field `deposits`"}]})
+            if failure == "indexer":
+                return web.json_response({"errors": [{"message": "bad indexers: indexer request timed out"}]})
+            return web.Response(status=failure)
+        data = {}
+        for alias, entity, where, order_by, direction, first in FIELD_PATTERN.findall(query):
+            data[alias or entity] = self.select(entity, where, order_by, direction, int(first))
+        return web.json_response({"data": data})
+
+    async def __aenter__(self):
+        app = web.Application()
+        app.router.add_post("/", self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        port = self.runner.addresses[0][1]
+        self.url = f"http://127.0.0.1:{port}/"
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.runner.cleanup()
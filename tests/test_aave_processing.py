@@ -0,0 +1,53 @@
+import os
+
+import pandas as pd
+import pytest
+
+from src.aave import event_store, main
+from tests.aave_subgraph_stub import event
+
+DAY = 86400
+START = 1_700_006_400  # 2023-11-15 00:00 UTC
+
+
+@pytest.fixture(autouse=True)
+def data_directory(tmp_path, monkeypatch):
+    (tmp_path / "data").mkdir()
+    monkeypatch.setattr(main, "ROOT_DIRECTORY", str(tmp_path))
+    monkeypatch.setattr(event_store, "EVENT_STORE_PATH", str(tmp_path / "data" / "aave_events.sqlite"))
+    monkeypatch.setattr(event_store, "_connection", None)
+    yield tmp_path
+    if event_store._connection is not None:
+        event_store._connection.close()
+
+
+def store(market, token_symbol, data_type, events):
+    event_store.append_events(market, token_symbol, data_type, events)
+    event_store.advance_cursor(market, token_symbol, data_type)
+
+
+def test_each_reserve_has_its_own_processed_csv(data_directory):
+    store("aave_v3", "USDC", "supplies", [event(f"usdc:{day}", START + day * DAY) for day in range(3)])
+    store("aave_v3", "DAI", "supplies", [event(f"dai:{day}", START + day * DAY) for day in range(5)])
+    store("aave_v2", "USDC", "supplies", [event(f"v2:{day}", START + day * DAY) for day in range(2)])
+
+    assert len(main.process_synced_data("supplies", "USDC", "aave_v3")) == 3
+    assert len(main.process_synced_data("supplies", "DAI", "aave_v3")) == 5
+    assert len(main.process_synced_data("supplies", "USDC", "aave_v2")) == 2
+
+    # With nothing new, every reserve keeps its own CSV rather than the one written last
+    assert len(main.process_synced_data("supplies", "USDC", "aave_v3")) == 3
+    assert len(main.process_synced_data("supplies", "DAI", "aave_v3")) == 5
+    for market, token_symbol in [("aave_v3", "USDC"), ("aave_v3", "DAI"), ("aave_v2", "USDC")]:
+        assert os.path.exists(data_directory / "data" / f"{market}_{token_symbol}_processed_supplies.csv")
+
+
+def test_incremental_update_keeps_the_earlier_days(data_directory):
+    store("aave_v3", "USDC", "borrows", [event(f"a:{day}", START + day * DAY) for day in range(4)])
+    main.process_synced_data("borrows", "USDC")
+    store("aave_v3", "USDC", "borrows", [event("b:3", START + 3 * DAY + 60), event("b:4", START + 4 * DAY)])
+
+    processed = main.process_synced_data("borrows", "USDC")
+
+    assert processed['date'].tolist() == pd.to_datetime([START + day * DAY for day in range(5)], unit='s').strftime('%Y-%m-%d').tolist()
+    assert processed.equals(pd.read_csv(main.processed_path("aave_v3", "USDC", "borrows"), float_precision='round_trip'))
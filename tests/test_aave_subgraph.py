@@ -0,0 +1,157 @@
+import asyncio
+import random
+
+import aiohttp
+import pytest
+
+from src.aave import subgraph
+from src.aave.subgraph import PAGE_SIZE, PageCursor, fetch_markets_events, fetch_reserve_events, post_query, shard_bounds
+from tests.aave_subgraph_stub import SubgraphStub, event
+
+START = 1_700_000_000
+
+
+def history(count, seed=0, burst_at=None, burst_size=0):
+    """ `count` events a few seconds apart with several events per second, plus `burst_size` events in the second `burst_at` """
+    rng = random.Random(seed)
+    events, timestamp = [], START
+    for i in range(count):
+        timestamp += rng.choice([0, 0, 1, 7])
+        events.append(event(f"0x{rng.getrandbits(64):016x}:{i}", timestamp))
+    events += [event(f"0x{rng.getrandbits(64):016x}:burst{i}", burst_at) for i in range(burst_size)]
+    return sorted(events, key=lambda row: (row["timestamp"], row["id"]))
+
+
+def ids(events):
+    return [row["id"] for row in events]
+
+
+@pytest.fixture(autouse=True)
+def no_retry_delay(monkeypatch):
+    monkeypatch.setattr(subgraph, "RETRY_DELAY", 0)
+
+
+def test_shard_bounds_cover_the_range_with_half_open_shards():
+    bounds = shard_bounds(100, 199, 4)
+    assert bounds == [(100, 125), (125, 150), (150, 175), (175, 200)]
+    # Fewer seconds than shards: one shard per second
+    assert shard_bounds(10, 12, 16) == [(10, 11), (11, 12), (12, 13)]
+    assert shard_bounds(5, 5, 4) == [(5, 6)]
+    for start, end, shards in [(0, 1000, 7), (START, START + 86400 * 365, 16)]:
+        bounds = shard_bounds(start, end, shards)
+        assert bounds[0][0] == start and bounds[-1][1] == end + 1
+        assert all(upper == lower for (_, upper), (lower, _) in zip(bounds, bounds[1:]))
+
+
+def test_page_cursor_skips_the_events_of_the_boundary_second():
+    cursor = PageCursor("borrows", "USDC", START)
+    page = [event(f"a{i}", START + i // 10) for i in range(PAGE_SIZE)]
+    assert cursor.advance(page) == page
+    last_second = START + (PAGE_SIZE - 1) // 10
+    assert (cursor.timestamp, cursor.done, cursor.second_id) == (last_second, False, None)
+
+    # The next page starts at the last second again: the events of that second already returned are dropped
+    next_page = [row for row in page if row["timestamp"] == last_second] + [event("b0", last_second), event("b1", last_second + 3)]
+    assert ids(cursor.advance(next_page)) == ["b0", "b1"]
+    assert cursor.done and cursor.count == PAGE_SIZE + 2
+
+
+def test_page_cursor_reads_a_full_second_by_id():
+    cursor = PageCursor("borrows", "USDC", START, START + 10)
+    burst = [event(f"id{i:05d}", START) for i in range(PAGE_SIZE)]
+    assert cursor.advance(burst) == burst
+    assert cursor.second_id == "" and 'id_gt: ""' in cursor.field() and "orderBy: id" in cursor.field()
+
+    rest = [event(f"id{i:05d}", START) for i in range(PAGE_SIZE, 2 * PAGE_SIZE)]
+    assert cursor.advance(rest) == rest
+    assert cursor.second_id == "id01999"
+
+    # A short page ends the second, the cursor moves on by timestamp from the next second
+    assert cursor.advance([]) == []
+    assert (cursor.timestamp, cursor.second_id, cursor.seen_ids, cursor.done) == (START + 1, None, set(), False)
+    assert f"timestamp_gte: {START + 1}" in cursor.field() and f"timestamp_lt: {START + 10}" in cursor.field()
+
+
+@pytest.mark.parametrize("shards", [1, 3, 16])
+def test_sharded_fetch_returns_every_event_once_in_order(shards):
+    # Many events per second, so shard and page boundaries fall inside seconds, and a second holding 2.5 pages
+    borrows = history(5000, seed=1, burst_at=START + 4000, burst_size=2500)
+    supplies = history(1200, seed=2)
+
+    async def fetch():
+        async with SubgraphStub({("USDC", "borrows"): borrows, ("USDC", "supplies"): supplies}) as stub:
+            return await fetch_reserve_events("USDC", shards=shards, concurrency=4, endpoint=stub.url)
+
+    events = asyncio.run(fetch())
+    assert ids(events["borrows"]) == ids(borrows)
+    assert ids(events["supplies"]) == ids(supplies)
+
+
+def test_incremental_fetch_starts_at_the_given_timestamp():
+    borrows = history(3000, seed=3)
+    since = borrows[1700]["timestamp"]
+
+    async def fetch():
+        async with SubgraphStub({("USDC", "borrows"): borrows}) as stub:
+            return await fetch_reserve_events("USDC", data_types=("borrows",), shards=4, endpoint=stub.url, since={"borrows": since})
+
+    assert ids(asyncio.run(fetch())["borrows"]) == ids([row for row in borrows if row["timestamp"] >= since])
+
+
+def test_batched_fetch_routes_every_alias_to_its_reserve(monkeypatch):
+    events = {("USDC", "borrows"): history(2500, seed=4), ("USDC", "supplies"): history(10, seed=5), ("DAI", "borrows"): [],
+              ("DAI", "supplies"): history(1500, seed=6, burst_at=START + 5, burst_size=1200)}
+
+    async def fetch(batch_size):
+        async with SubgraphStub(events) as stub:
+            monkeypatch.setitem(subgraph.SUBGRAPH_URLS, "aave_v3", stub.url)
+            return await fetch_markets_events(["aave_v3"], ["USDC", "DAI"], batch_size=batch_size), len(stub.queries)
+
+    fetched, batched_queries = asyncio.run(fetch(batch_size=4))
+    for (symbol, data_type), expected in events.items():
+        assert ids(fetched[("aave_v3", symbol, data_type)]) == ids(expected)
+    # One query per page of the reserve with the most pages, instead of one per page of every reserve
+    unbatched, queries = asyncio.run(fetch(batch_size=1))
+    assert unbatched == fetched and batched_queries < queries
+
+
+def run_post_query(failures, timeout=None):
+    async def post():
+        async with SubgraphStub({("USDC", "borrows"): history(3)}, failures=failures) as stub:
+            session_timeout = aiohttp.ClientTimeout(total=timeout) if timeout else None
+            async with aiohttp.ClientSession(timeout=session_timeout) as session:
+                try:
+                    return await post_query(session, asyncio.Semaphore(1), "{" + PageCursor("borrows", "USDC").field() + "\n}", stub.url), len(stub.queries)
+                except ValueError as e:
+                    return e, len(stub.queries)
+    return asyncio.run(post())
+
+
+def test_post_query_retries_transient_failures():
+    data, queries = run_post_query([429, 502, "disconnect", "indexer"])
+    assert len(data["borrows"]) == 3 and queries == 5
+
+
+def test_post_query_fails_fast_on_errors_that_would_repeat():
+    for failure in ("graphql", 400):
+        error, queries = run_post_query([failure])
+        assert isinstance(error, ValueError) and queries == 1
+
+
+def test_post_query_gives_up_after_max_retries():
+    error, queries = run_post_query([503] * subgraph.MAX_RETRIES)
+    assert isinstance(error, ValueError) and queries == subgraph.MAX_RETRIES
+
+
+def test_post_query_retries_timeouts(monkeypatch):
+    original_handle = SubgraphStub.handle
+    slow = [True]
+
+    async def handle(self, request):
+        if slow.pop(0) if slow else False:
+            await asyncio.sleep(1)
+        return await original_handle(self, request)
+
+    monkeypatch.setattr(SubgraphStub, "handle", handle)
+    data, _ = run_post_query([], timeout=0.3)
+    assert len(data["borrows"]) == 3
@@ -0,0 +1,83 @@
+from types import SimpleNamespace
+
+from src import bloom
+from src.bloom import bloom_mask, filter_blocks_by_bloom
+
+CONTRACT = "0x5C69bEe701ef814a2B6a3EDD4B1652CB9cc5aA6f"
+SENDER = "0x00000000000000000000000000000000000000aa"
+OTHER = "0x00000000000000000000000000000000000000bb"
+TRANSFER_TOPIC = "0xddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef"
+
+
+def logs_bloom(*items):
+    mask = 0
+    for item in items:
+        mask |= bloom_mask(item)
+    return "0x" + mask.to_bytes(256, 'big').hex()
+
+
+class FakeNode:
+    """ Headers with the given logsBloom and trace_filter over the given top-level and internal traces """
+
+    def __init__(self, blooms, traces, trace_filter=True):
+        self.blooms, self.traces, self.trace_filter = blooms, traces, trace_filter
+        self.trace_filters = []
+
+    def make_request(self, method, params):
+        if method == "eth_getBlockByNumber":
+            return {"result": {"logsBloom": self.blooms[int(params[0], 16)]}}
+        assert method == "trace_filter"
+        if not self.trace_filter:
+            return {"error": {"code": -32601, "message": "the method trace_filter does not exist/is not available"}}
+        trace_filter = params[0]
+        self.trace_filters.append(trace_filter)
+        side, addresses = ("toAddress", trace_filter["toAddress"]) if "toAddress" in trace_filter else ("fromAddress", trace_filter["fromAddress"])
+        key = "to" if side == "toAddress" else "from"
+        matches = [trace for trace in self.traces if int(trace_filter["fromBlock"], 16) <= trace["blockNumber"] <= int(trace_filter["toBlock"], 16)
+                   and trace["action"][key] in addresses]
+        return {"result": matches[trace_filter["after"]:trace_filter["after"] + trace_filter["count"]]}
+
+
+def trace(block_number, sender, to, trace_address=()):
+    return {"blockNumber": block_number, "traceAddress": list(trace_address), "action": {"from": sender, "to": to}}
+
+
+def fake_w3(node):
+    return SimpleNamespace(provider=node)
+
+
+def setup_function():
+    bloom._trace_filter_unsupported = False
+
+
+def test_blocks_with_transactions_that_emit_no_log_are_kept():
+    node = FakeNode(
+        blooms={1: logs_bloom(CONTRACT, TRANSFER_TOPIC), 2: logs_bloom(OTHER), 3: logs_bloom(OTHER), 4: logs_bloom()},
+        # Block 2: a plain call to the contract without logs, block 3: only an internal call to it, block 4: nothing
+        traces=[trace(2, SENDER, CONTRACT), trace(3, SENDER, OTHER), trace(3, OTHER, CONTRACT, trace_address=[0])],
+    )
+    assert filter_blocks_by_bloom(fake_w3(node), [1, 2, 3, 4], [CONTRACT], interaction_type="to") == [1, 2]
+
+
+def test_senders_that_emit_no_log_are_confirmed_from_both_sides():
+    node = FakeNode(blooms={1: logs_bloom(OTHER), 2: logs_bloom(), 3: logs_bloom()}, traces=[trace(1, SENDER, OTHER), trace(3, OTHER, SENDER)])
+    # "both" queries the senders and the recipients separately: one filter with both fields would match neither block
+    assert filter_blocks_by_bloom(fake_w3(node), [1, 2, 3], [SENDER], interaction_type="both") == [1, 3]
+    assert [("fromAddress" in trace_filter, "toAddress" in trace_filter) for trace_filter in node.trace_filters] == [(False, True), (True, False)]
+
+
+def test_trace_filter_pages_are_followed():
+    node = FakeNode(blooms={block: logs_bloom() for block in range(1, 6)}, traces=[trace(block, SENDER, CONTRACT) for block in (1, 2, 3, 5)])
+    assert bloom.blocks_with_transactions(fake_w3(node), 1, 5, [CONTRACT], interaction_type="to", page_size=2) == {1, 2, 3, 5}
+    assert [trace_filter["after"] for trace_filter in node.trace_filters] == [0, 2, 4]
+
+
+def test_nothing_is_pruned_without_trace_filter():
+    node = FakeNode(blooms={1: logs_bloom(CONTRACT), 2: logs_bloom()}, traces=[], trace_filter=False)
+    assert filter_blocks_by_bloom(fake_w3(node), [1, 2], [CONTRACT]) == [1, 2]
+
+
+def test_topics_keep_only_blocks_that_may_hold_the_events():
+    node = FakeNode(blooms={1: logs_bloom(CONTRACT, TRANSFER_TOPIC), 2: logs_bloom(CONTRACT), 3: logs_bloom()}, traces=[trace(3, SENDER, CONTRACT)])
+    assert filter_blocks_by_bloom(fake_w3(node), [1, 2, 3], [CONTRACT], topics=[TRANSFER_TOPIC]) == [1]
+    assert node.trace_filters == []
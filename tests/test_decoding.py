@@ -0,0 +1,47 @@
+from eth_abi import encode
+from eth_utils import function_signature_to_4byte_selector
+from hexbytes import HexBytes
+from web3 import Web3
+from web3.datastructures import AttributeDict
+
+from src import abi_registry, decoder_registry
+from src.constants import TOKEN_CONTRACT_MAP
+from src.decoding_transactions_with_ABIs.main import decode_selected, filter_transactions, select_transactions
+
+USDC = TOKEN_CONTRACT_MAP['USDC']
+DAI = TOKEN_CONTRACT_MAP['DAI']
+USER = "0x00000000000000000000000000000000000000Aa"
+
+
+def transfer(amount):
+    return "0x" + (function_signature_to_4byte_selector("transfer(address,uint256)") + encode(["address", "uint256"], [USER, amount])).hex()
+
+
+def block(*transactions):
+    return AttributeDict({"transactions": [AttributeDict({"hash": HexBytes(index.to_bytes(32, 'big')), "from": USER, "to": to, "input": data})
+                                           for index, (to, data) in enumerate(transactions)]})
+
+
+def test_a_window_of_blocks_is_decoded_in_one_pass_like_block_by_block():
+    blocks = [block((USDC, transfer(1)), (DAI, transfer(2))), block(), block((USER, "0x"), (DAI, "0x12"), (USDC, transfer(3)))]
+    selections = [select_transactions(block, [USDC, DAI]) for block in blocks]
+    window_results = decode_selected(selections)
+
+    assert window_results == [filter_transactions(block, [USDC, DAI]) for block in blocks]
+    assert [[result["decoded"]["values"]["_value"] for result in results] for results in window_results] == [[1, 2], [], [3]]
+
+
+def test_decoders_follow_an_abi_replaced_in_the_registry(tmp_path, monkeypatch):
+    monkeypatch.setattr(abi_registry, "ABI_REGISTRY_PATH", str(tmp_path / "abi_registry.sqlite"))
+    monkeypatch.setattr(abi_registry, "_connection", None)
+    proxy = Web3.to_checksum_address("0x00000000000000000000000000000000000000bb")
+    upgrade_to = {"type": "function", "name": "upgradeTo", "inputs": [{"name": "implementation", "type": "address"}], "outputs": []}
+    transfer_abi = {"type": "function", "name": "transfer", "inputs": [{"name": "_to", "type": "address"}, {"name": "_value", "type": "uint256"}], "outputs": []}
+
+    abi_registry.store_abi(proxy, [upgrade_to])
+    assert decoder_registry.decode_input(proxy, transfer(5)) is None
+
+    # The ABI of the implementation merged into the proxy's, as fetch_abi does
+    abi_registry.store_abi(proxy, [transfer_abi, upgrade_to], implementation=USER)
+    assert decoder_registry.decode_input(proxy, transfer(5))["values"]["_value"] == 5
+    abi_registry._connection.close()
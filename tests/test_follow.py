@@ -0,0 +1,142 @@
+import importlib
+import json
+import sys
+
+import pytest
+from hexbytes import HexBytes
+from web3.datastructures import AttributeDict
+from web3.exceptions import BlockNotFound
+from websockets.exceptions import ConnectionClosed
+
+from src import follow
+from src.follow import follow_blocks, follow_to_sink
+from src.sinks import ParquetSink
+
+BLOCK_TIME = 12
+
+
+class SimulatedChain:
+    """
+    A chain served like the eth namespace of Web3. `script` holds the changes applied one by one whenever the
+    follower waits (sleeps or reads the websocket): ("mine", fork) appends a block, ("reorg", depth, fork) replaces
+    the last `depth` blocks by as many blocks of another fork.
+    """
+
+    def __init__(self, length, script=()):
+        self.blocks = []
+        self.script = list(script)
+        for _ in range(length):
+            self.mine()
+
+    def _block(self, number, fork):
+        parent_hash = self.blocks[number - 1].hash if number else HexBytes(b"\x00" * 32)
+        return AttributeDict({"number": number, "hash": HexBytes(bytes([fork]) + number.to_bytes(31, 'big')), "parentHash": parent_hash,
+                              "timestamp": 1_700_000_000 + number * BLOCK_TIME, "transactions": []})
+
+    def mine(self, fork=0):
+        self.blocks.append(self._block(len(self.blocks), fork))
+
+    def reorg(self, depth, fork):
+        del self.blocks[-depth:]
+        for _ in range(depth):
+            self.mine(fork)
+
+    def advance(self, *_):
+        if not self.script:
+            raise StopIteration("nothing left to simulate")
+        change, *arguments = self.script.pop(0)
+        getattr(self, change)(*arguments)
+
+    @property
+    def block_number(self):
+        return self.blocks[-1].number
+
+    def get_block(self, block_identifier, full_transactions=False):
+        if block_identifier == 'latest':
+            return self.blocks[-1]
+        if block_identifier >= len(self.blocks):
+            raise BlockNotFound(block_identifier)
+        return self.blocks[block_identifier]
+
+
+class FakeWeb3:
+    def __init__(self, chain):
+        self.eth = chain
+
+
+def run_follower(chain, monkeypatch, **kwargs):
+    monkeypatch.setattr(follow.time, "sleep", chain.advance)
+    events = []
+    try:
+        for event in follow_blocks(FakeWeb3(chain), **kwargs):
+            events.append(("block", event[1].number, event[1].hash[0]) if event[0] == "block" else ("retract", event[1], event[2][0]))
+    except RuntimeError:
+        # The StopIteration of an exhausted script, raised inside the generator
+        pass
+    return events
+
+
+def test_new_blocks_are_yielded_in_order(monkeypatch):
+    chain = SimulatedChain(3, script=[("mine",), ("mine",)])
+    assert run_follower(chain, monkeypatch, from_block=1) == [("block", 1, 0), ("block", 2, 0), ("block", 3, 0), ("block", 4, 0)]
+
+
+def test_reorged_blocks_are_retracted_and_read_again(monkeypatch):
+    # Block 4 replaced without growing the chain, then blocks 3 and 4 replaced by a longer fork
+    chain = SimulatedChain(5, script=[("reorg", 1, 1), ("reorg", 2, 2), ("mine", 2)])
+    assert run_follower(chain, monkeypatch, from_block=3) == [
+        ("block", 3, 0), ("block", 4, 0),
+        ("retract", 4, 0), ("block", 4, 1),
+        ("retract", 4, 1), ("retract", 3, 0), ("block", 3, 2), ("block", 4, 2),
+        ("block", 5, 2),
+    ]
+
+
+def test_a_closed_subscription_is_replaced(monkeypatch):
+    chain = SimulatedChain(2, script=[("mine",), ("mine",)])
+
+    class Subscription:
+        def __init__(self, closes):
+            self.closes = closes
+
+        def recv(self, timeout=None):
+            if self.closes:
+                raise ConnectionClosed(None, None)
+            chain.advance()
+
+    subscriptions = [Subscription(closes=True), Subscription(closes=False)]
+    monkeypatch.setattr(follow, "_subscribe_new_heads", lambda ws_endpoint: subscriptions.pop(0))
+    assert run_follower(chain, monkeypatch, from_block=1, ws_endpoint="ws://node") == [("block", 1, 0), ("block", 2, 0), ("block", 3, 0)]
+    assert subscriptions == []
+
+
+def test_polling_takes_over_when_subscribing_again_fails(monkeypatch):
+    chain = SimulatedChain(2, script=[("mine",)])
+
+    class ClosedSubscription:
+        def recv(self, timeout=None):
+            raise ConnectionClosed(None, None)
+
+    subscriptions = [ClosedSubscription(), None]
+    monkeypatch.setattr(follow, "_subscribe_new_heads", lambda ws_endpoint: subscriptions.pop(0))
+    assert run_follower(chain, monkeypatch, from_block=1, ws_endpoint="ws://node") == [("block", 1, 0), ("block", 2, 0)]
+
+
+def test_follow_rejects_buffered_sinks():
+    # Not opened, so that pyarrow is not needed
+    sink = ParquetSink.__new__(ParquetSink)
+    with pytest.raises(ValueError):
+        follow_to_sink(FakeWeb3(SimulatedChain(1)), lambda block: [], sink)
+
+
+@pytest.mark.parametrize("module_name", ["src.decoding_transactions_with_ABIs.main", "src.decoding_traces_with_ABIs.main"])
+def test_restarted_follow_jobs_keep_the_rows_written_before(tmp_path, monkeypatch, module_name):
+    module = importlib.import_module(module_name)
+    output = tmp_path / "follow.jsonl"
+    monkeypatch.setattr(module, "fetch_abis", lambda addresses: None)
+    monkeypatch.setattr(module, "follow_to_sink", lambda w3, decode, sink, **kwargs: sink.write([{"run": len(output.read_text().splitlines())}]))
+    monkeypatch.setattr(sys, "argv", ["main.py", "--follow", "--output", str(output)])
+
+    module.run()
+    module.run()
+    assert [json.loads(line) for line in output.read_text().splitlines()] == [{"run": 0}, {"run": 1}]
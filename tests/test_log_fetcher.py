@@ -0,0 +1,63 @@
+from types import SimpleNamespace
+
+import pytest
+import requests
+
+from src.uniswap import log_fetcher
+from src.uniswap.log_fetcher import iter_logs
+
+
+def fake_w3(get_logs):
+    return SimpleNamespace(eth=SimpleNamespace(get_logs=get_logs))
+
+
+def http_error(status_code, headers=None):
+    response = requests.Response()
+    response.status_code = status_code
+    response.headers.update(headers or {})
+    return requests.HTTPError(f"{status_code} Client Error", response=response)
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(log_fetcher.time, "sleep", sleeps.append)
+    return sleeps
+
+
+def test_range_is_halved_when_the_provider_returns_too_many_results(sleeps):
+    requested = []
+
+    def get_logs(log_filter):
+        requested.append((log_filter["fromBlock"], log_filter["toBlock"]))
+        if log_filter["toBlock"] - log_filter["fromBlock"] >= 250:
+            raise ValueError({"code": -32005, "message": "query returned more than 10000 results"})
+        return [{"blockNumber": log_filter["fromBlock"]}]
+
+    chunks = list(iter_logs(fake_w3(get_logs), 0, 499, chunk_size=500))
+    assert [(start, end) for start, end, _ in chunks] == [(0, 249), (250, 499)]
+    assert requested[:3] == [(0, 499), (0, 249), (250, 499)]
+    assert sleeps == []
+
+
+def test_rate_limits_are_retried_on_the_same_range(sleeps):
+    errors = [http_error(429, {"Retry-After": "3"}), ValueError({"code": -32005, "message": "project ID request rate exceeded"})]
+    requested = []
+
+    def get_logs(log_filter):
+        requested.append((log_filter["fromBlock"], log_filter["toBlock"]))
+        if errors:
+            raise errors.pop(0)
+        return []
+
+    assert [(start, end) for start, end, _ in iter_logs(fake_w3(get_logs), 0, 99, chunk_size=100)] == [(0, 99)]
+    assert requested == [(0, 99)] * 3
+    assert sleeps == [3, 2]
+
+
+def test_unrelated_errors_are_raised(sleeps):
+    def get_logs(log_filter):
+        raise ValueError({"code": -32000, "message": "execution timeout, limit exceeded for this range"})
+
+    with pytest.raises(ValueError):
+        list(iter_logs(fake_w3(get_logs), 0, 99))
@@ -0,0 +1,122 @@
+from eth_abi import decode, encode
+from eth_utils import function_signature_to_4byte_selector, to_checksum_address
+from web3 import Web3
+from web3.providers import BaseProvider
+
+from src.constants import MULTICALL3_ADDR
+from src.uniswap import metadata_cache
+from src.uniswap import uniswap
+
+V3_POOL = to_checksum_address("0x88e6a0c2ddd26feeb64f039a2c41296fcb3f5640")
+V2_PAIR = to_checksum_address("0xb4e16d0168e52d35cacd2c6185b44281ec28c9dc")
+USDC = to_checksum_address("0xa0b86991c6218b36c1d19d4a2e9eb0ce3606eb48")
+WETH = to_checksum_address("0xc02aaa39b223fe8d0a0e5c4f27ead9083c756cc2")
+# v3 pool of a token without decimals()
+ODD_POOL = to_checksum_address("0x1111111111111111111111111111111111111111")
+ODD_TOKEN = to_checksum_address("0x2222222222222222222222222222222222222222")
+SQRT_PRICE_X96 = 1_700_000_000_000_000_000_000_000_000_000_000
+
+
+def selector(signature):
+    return function_signature_to_4byte_selector(signature)
+
+
+# (target, selector, arguments) -> ABI encoded return data of the calls the fake chain answers, addresses lowercase as
+# in real return data
+CONTRACT_STATE = {
+    (V3_POOL, selector("token0()")): encode(["address"], [USDC.lower()]),
+    (V3_POOL, selector("token1()")): encode(["address"], [WETH.lower()]),
+    (V3_POOL, selector("fee()")): encode(["uint24"], [500]),
+    (V3_POOL, selector("slot0()")): encode(["uint160", "int24", "uint16", "uint16", "uint16", "uint8", "bool"], [SQRT_PRICE_X96, 201000, 1, 1, 1, 0, True]),
+    (V2_PAIR, selector("token0()")): encode(["address"], [USDC.lower()]),
+    (V2_PAIR, selector("token1()")): encode(["address"], [WETH.lower()]),
+    (V2_PAIR, selector("getReserves()")): encode(["uint112", "uint112", "uint32"], [30_000_000 * 10 ** 6, 15_000 * 10 ** 18, 0]),
+    (ODD_POOL, selector("token0()")): encode(["address"], [USDC.lower()]),
+    (ODD_POOL, selector("token1()")): encode(["address"], [ODD_TOKEN.lower()]),
+    (ODD_POOL, selector("fee()")): encode(["uint24"], [3000]),
+    (ODD_POOL, selector("slot0()")): encode(["uint160", "int24", "uint16", "uint16", "uint16", "uint8", "bool"], [SQRT_PRICE_X96, 201000, 1, 1, 1, 0, True]),
+    (USDC, selector("decimals()")): encode(["uint8"], [6]),
+    (WETH, selector("decimals()")): encode(["uint8"], [18]),
+}
+BALANCES = {(USDC, V3_POOL): 100_000_000 * 10 ** 6, (WETH, V3_POOL): 50_000 * 10 ** 18, (USDC, ODD_POOL): 10 ** 6, (ODD_TOKEN, ODD_POOL): 10 ** 18}
+
+
+class FakeChainProvider(BaseProvider):
+    """ Answers `eth_call` to Multicall3 aggregate3 from CONTRACT_STATE and BALANCES, records the calls it gets """
+
+    def __init__(self):
+        self.eth_calls = []
+
+    def _call(self, target, calldata):
+        target = to_checksum_address(target)
+        if calldata[:4] == selector("balanceOf(address)"):
+            owner = to_checksum_address(decode(["address"], calldata[4:])[0])
+            return True, encode(["uint256"], [BALANCES[(target, owner)]])
+        return_data = CONTRACT_STATE.get((target, calldata[:4]))
+        return return_data is not None, return_data or b""
+
+    def make_request(self, method, params):
+        if method == "eth_chainId":
+            return {"jsonrpc": "2.0", "id": 1, "result": "0x1"}
+        assert method == "eth_call", method
+        transaction = params[0]
+        assert transaction["to"] == MULTICALL3_ADDR
+        data = bytes.fromhex(transaction["data"][2:])
+        assert data[:4] == selector("aggregate3((address,bool,bytes)[])")
+        calls = decode(["(address,bool,bytes)[]"], data[4:])[0]
+        self.eth_calls.append(calls)
+        results = [self._call(target, calldata) for target, _, calldata in calls]
+        return {"jsonrpc": "2.0", "id": 1, "result": "0x" + encode(["(bool,bytes)[]"], [results]).hex()}
+
+
+def fake_chain(monkeypatch):
+    """ Point uniswap at a FakeChainProvider, starting from an empty metadata cache kept in memory """
+    provider = FakeChainProvider()
+    monkeypatch.setattr(uniswap, "w3", Web3(provider))
+    pools, decimals = {}, {}
+    monkeypatch.setattr(metadata_cache, "get_pool_metadata", pools.get)
+    monkeypatch.setattr(metadata_cache, "set_pool_metadata", lambda addr, version, token0, token1, fee=None: pools.update({addr: {"token0": token0, "token1": token1, "fee": fee}}))
+    monkeypatch.setattr(metadata_cache, "get_token_decimals", decimals.get)
+    monkeypatch.setattr(metadata_cache, "set_token_decimals", decimals.__setitem__)
+    return provider
+
+
+def test_fetch_pool_states_reads_every_pool_in_two_multicall_rounds(monkeypatch):
+    provider = fake_chain(monkeypatch)
+
+    states = uniswap.fetch_pool_states([V3_POOL, uniswap.ZERO_ADDRESS], [V2_PAIR])
+
+    assert len(provider.eth_calls) == 2
+    assert states[V3_POOL] == {
+        "version": "v3", "pool_address": V3_POOL, "token0": USDC, "token1": WETH, "fee": 500, "sqrt_price_x96": SQRT_PRICE_X96,
+        "tick": 201000, "token0_balance": 100_000_000 * 10 ** 6, "token1_balance": 50_000 * 10 ** 18, "token0_decimals": 6, "token1_decimals": 18,
+    }
+    assert states[V2_PAIR] == {
+        "version": "v2", "pool_address": V2_PAIR, "token0": USDC, "token1": WETH, "token0_balance": 30_000_000 * 10 ** 6,
+        "token1_balance": 15_000 * 10 ** 18, "token0_decimals": 6, "token1_decimals": 18,
+    }
+
+    # Once the metadata is cached, only the mutable state is read again
+    provider.eth_calls.clear()
+    cached_states = uniswap.fetch_pool_states([V3_POOL], [V2_PAIR])
+    assert cached_states[V3_POOL] == states[V3_POOL]
+    assert cached_states[V2_PAIR] == {**states[V2_PAIR], "fee": None}
+    assert [len(calls) for calls in provider.eth_calls] == [2, 2]
+
+
+def test_pools_of_tokens_without_decimals_are_skipped(monkeypatch):
+    fake_chain(monkeypatch)
+    states = uniswap.fetch_pool_states([V3_POOL, ODD_POOL], [V2_PAIR])
+    assert set(states) == {V3_POOL, V2_PAIR}
+
+    monkeypatch.setattr(uniswap, "get_token_prices_batch", lambda tokens: {USDC.lower(): 1.0, WETH.lower(): 2000.0, ODD_TOKEN.lower(): 1.0})
+    rows = uniswap.build_pool_rows(states.values())
+    assert len(rows) == 2
+
+
+def test_decode_call_result_checksums_addresses():
+    w3 = Web3(FakeChainProvider())
+    token0 = w3.eth.contract(address=V3_POOL, abi=uniswap.UNISWAP_V3_POOL_ABI).functions.token0()
+    decoded = uniswap.aggregate3(w3, [token0])
+    assert decoded == [USDC]
+    assert Web3.is_checksum_address(decoded[0])
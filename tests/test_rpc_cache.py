@@ -0,0 +1,47 @@
+import pytest
+
+from src import rpc_cache
+
+HEAD = 20_000_000
+
+
+@pytest.fixture(autouse=True)
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(rpc_cache, "RPC_CACHE_PATH", str(tmp_path / "rpc_cache.sqlite"))
+    monkeypatch.setattr(rpc_cache, "RPC_CACHE_ENABLED", True)
+    monkeypatch.setattr(rpc_cache, "_connection", None)
+    monkeypatch.setattr(rpc_cache, "_total_bytes", None)
+    yield
+    rpc_cache._connection.close()
+
+
+def stored_bytes():
+    return rpc_cache._get_connection().execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+
+def store_block(number, transactions=10):
+    rpc_cache.store("eth_getBlockByNumber", [hex(number), False], {"number": hex(number), "transactions": [f"0x{i:064x}" for i in range(transactions)]}, lambda: HEAD)
+
+
+def test_rewritten_responses_are_counted_once(monkeypatch):
+    store_block(1000)
+    store_block(1001)
+    size = stored_bytes()
+    monkeypatch.setattr(rpc_cache, "MAX_CACHE_BYTES", size)
+
+    # Storing the same responses again neither grows the total nor evicts anything
+    for _ in range(5):
+        store_block(1000)
+        store_block(1001)
+    assert rpc_cache._total_bytes == stored_bytes() == size
+    assert rpc_cache.lookup("eth_getBlockByNumber", [hex(1000), False])[0]
+
+
+def test_least_recently_used_responses_are_evicted_down_to_the_budget(monkeypatch):
+    store_block(1000)
+    monkeypatch.setattr(rpc_cache, "MAX_CACHE_BYTES", stored_bytes() * 3)
+    for number in range(1001, 1006):
+        store_block(number)
+        assert rpc_cache._total_bytes == stored_bytes() <= rpc_cache.MAX_CACHE_BYTES
+    assert not rpc_cache.lookup("eth_getBlockByNumber", [hex(1000), False])[0]
+    assert rpc_cache.lookup("eth_getBlockByNumber", [hex(1005), False])[0]
@@ -0,0 +1,25 @@
+import json
+
+from src.sinks import open_sink
+
+
+def read_jsonl(path):
+    with open(path) as file:
+        return [json.loads(line) for line in file]
+
+
+def test_jsonl_sink_replaces_the_file_of_a_previous_run(tmp_path):
+    path = str(tmp_path / "transactions_1_2.jsonl")
+    for _ in range(2):
+        with open_sink(path) as sink:
+            sink.write([{"block_number": 1, "input": "0x1234"}, {"block_number": 2, "input": None}])
+    assert read_jsonl(path) == [{"block_number": 1, "input": "0x1234"}, {"block_number": 2, "input": None}]
+
+
+def test_jsonl_sink_appends_when_resuming(tmp_path):
+    path = str(tmp_path / "transactions_1_2.jsonl")
+    with open_sink(path) as sink:
+        sink.write([{"block_number": 1}])
+    with open_sink(path, append=True) as sink:
+        sink.write([{"block_number": 2}])
+    assert read_jsonl(path) == [{"block_number": 1}, {"block_number": 2}]
@@ -0,0 +1,46 @@
+import csv
+import sys
+
+import pytest
+
+from src.uniswap.snapshots import drop_unfinished_blocks
+
+
+def test_resume_drops_rows_of_blocks_written_but_not_checkpointed(tmp_path):
+    filename = tmp_path / "WETH-USDC_uniswap_snapshots.csv"
+    with open(filename, 'w', newline='') as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=["Block number", "Pool"])
+        writer.writeheader()
+        writer.writerows([{"Block number": block, "Pool": pool} for block in (100, 101, 102) for pool in ("v3", "v2")])
+        # Interrupted in the middle of a row
+        csvfile.write("103,v")
+
+    drop_unfinished_blocks(filename, completed_blocks={100, 101})
+    with open(filename, newline='') as csvfile:
+        assert [(row["Block number"], row["Pool"]) for row in csv.DictReader(csvfile)] == [("100", "v3"), ("100", "v2"), ("101", "v3"), ("101", "v2")]
+
+    # Nothing left to drop: the file is not rewritten
+    modified = filename.stat().st_mtime_ns
+    drop_unfinished_blocks(filename, completed_blocks={100, 101})
+    assert filename.stat().st_mtime_ns == modified
+
+
+def run_snapshots(monkeypatch, *arguments):
+    """ Blocks the snapshot CLI would sample with `arguments` """
+    from src.uniswap import main
+    sampled = []
+    monkeypatch.setattr(main, "main_snapshots", lambda token0, token1, blocks, **kwargs: sampled.append(blocks))
+    monkeypatch.setattr(sys, "argv", ["main.py", *arguments])
+    main.run()
+    return sampled[0]
+
+
+def test_snapshot_range_defaults_to_the_first_block(monkeypatch):
+    assert run_snapshots(monkeypatch, "--from-block", "17000000") == [17000000]
+    assert run_snapshots(monkeypatch, "--from-block", "17000000", "--to-block", "17000010", "--stride", "5") == [17000000, 17000005, 17000010]
+
+
+@pytest.mark.parametrize("arguments", [["--stride", "0"], ["--stride", "-1"], ["--to-block", "16999999"]])
+def test_snapshot_range_rejects_empty_selections(monkeypatch, arguments):
+    with pytest.raises(SystemExit):
+        run_snapshots(monkeypatch, "--from-block", "17000000", *arguments)
@@ -0,0 +1,56 @@
+import sys
+
+import pytest
+
+from src.decoding_traces_with_ABIs import main as traces_main
+
+FACTORY = "0x5c69bee701ef814a2b6a3edd4b1652cb9cc5aa6f"
+ROUTER = "0x7a250d5630b4cf539739df2c5dacb4c659f2488d"
+USER = "0x00000000000000000000000000000000000000aa"
+
+
+def trace(transaction_hash, trace_address, sender, to):
+    return {"blockNumber": 10008355, "transactionHash": transaction_hash, "traceAddress": trace_address, "action": {"from": sender, "to": to}}
+
+
+TRACES = [
+    trace("0x01", [], USER, ROUTER),
+    trace("0x01", [0], ROUTER, FACTORY),
+    trace("0x01", [0, 0], FACTORY, USER),
+    trace("0x02", [], ROUTER, USER),
+    trace("0x03", [], USER, FACTORY),
+]
+
+
+def test_both_sides_are_queried_separately_and_deduplicated(monkeypatch):
+    filters = []
+
+    def trace_rpc(method, params):
+        trace_filter = params[0]
+        filters.append(trace_filter)
+        assert "mode" not in trace_filter and ("fromAddress" in trace_filter) != ("toAddress" in trace_filter)
+        key, addresses = ("from", trace_filter["fromAddress"]) if "fromAddress" in trace_filter else ("to", trace_filter["toAddress"])
+        matches = [trace for trace in TRACES if trace["action"][key] in addresses]
+        return matches[trace_filter["after"]:trace_filter["after"] + trace_filter["count"]]
+
+    monkeypatch.setattr(traces_main, "trace_rpc", trace_rpc)
+    monkeypatch.setattr(traces_main, "filter_traces", lambda traces, contract_addresses, interaction_type: traces)
+
+    pages = list(traces_main.iter_filtered_traces(10008355, 10008355, [FACTORY, ROUTER], "both", page_size=2))
+    returned = [(trace["transactionHash"], trace["traceAddress"]) for page in pages for trace in page]
+    # The call from the router to the factory matches both queries and is returned once
+    assert sorted(returned) == [("0x01", []), ("0x01", [0]), ("0x01", [0, 0]), ("0x02", []), ("0x03", [])]
+    assert [(("fromAddress" in trace_filter), trace_filter["after"]) for trace_filter in filters] == [(True, 0), (True, 2), (False, 0), (False, 2)]
+
+
+@pytest.mark.parametrize("arguments", [["--bloom-filter"], ["--topics", "0x01"], ["--workers", "4"]])
+def test_traces_cli_rejects_transaction_only_flags(monkeypatch, arguments):
+    monkeypatch.setattr(sys, "argv", ["main.py", "--from-block", "10008355", *arguments])
+    with pytest.raises(SystemExit):
+        traces_main.parse_args()
+
+
+def test_traces_cli_accepts_its_own_flags(monkeypatch):
+    monkeypatch.setattr(sys, "argv", ["main.py", "--from-block", "10008355", "--to-block", "10008360", "--decode-processes", "2"])
+    args = traces_main.parse_args()
+    assert (args.from_block, args.to_block, args.decode_processes) == (10008355, 10008360, 2)
@@ -0,0 +1,27 @@
+from src.constants import TOKEN_CONTRACT_MAP
+from src.uniswap import main
+
+V3_POOL = "0x88e6A0c2dDD26FEEb64F039a2c41296FcB3f5640"
+V2_PAIR = "0xB4e16d0168e52d35CaCD2c6185b44281Ec28C9Dc"
+
+
+def scanned_pools(monkeypatch, indexed_pools):
+    """ Pool addresses `main` reads with --use-pool-index when the index holds `indexed_pools` """
+    scanned = []
+    monkeypatch.setattr(main, "find_pools", lambda token0, token1: indexed_pools)
+    monkeypatch.setattr(main, "get_v3_pool_addresses", lambda token0, token1: [V3_POOL, main.ZERO_ADDRESS])
+    monkeypatch.setattr(main, "get_v2_pool_address", lambda token0, token1: V2_PAIR)
+    monkeypatch.setattr(main, "get_pool_details_batched", lambda v3, v2, price_source: scanned.append((v3, v2)) or [])
+    monkeypatch.setattr(main, "write_to_csv", lambda pool_data, pool_name: None)
+    main.main(TOKEN_CONTRACT_MAP['WETH'], TOKEN_CONTRACT_MAP['USDC'], batched=True, use_pool_index=True)
+    return scanned[0]
+
+
+def test_pool_index_is_used_when_it_has_the_pair(monkeypatch, capsys):
+    assert scanned_pools(monkeypatch, [{"address": V3_POOL, "version": "v3"}]) == ([V3_POOL], [])
+    assert "Warning" not in capsys.readouterr().out
+
+
+def test_empty_pool_index_falls_back_to_the_factories(monkeypatch, capsys):
+    assert scanned_pools(monkeypatch, []) == ([V3_POOL], [V2_PAIR])
+    assert "src/uniswap/pool_discovery.py" in capsys.readouterr().out